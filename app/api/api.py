@@ -1,20 +1,58 @@
-from fastapi import FastAPI, UploadFile, File, HTTPException
-from fastapi.responses import FileResponse
-from pydantic import BaseModel
-from typing import Dict
+from fastapi import BackgroundTasks, FastAPI, UploadFile, File, Form, HTTPException, Query, Request
+from fastapi.responses import JSONResponse, PlainTextResponse, StreamingResponse
+from pydantic import BaseModel, ValidationError
+from typing import Any, Dict, List, Optional
 import os
+import glob
+import hashlib
+import json
+import re
 import shutil
 import uuid
 import asyncio
 import time
-from app.api.state import jobs, job_queue, JobStatus, used_job_ids
+from app.api.state import jobs, job_queue, JobStatus, used_job_ids, result_cache, job_events
+from app.api.job_events import JOB_EVENTS_HEARTBEAT, JOB_EVENTS_POLL_INTERVAL, MAX_LONG_POLL_SECONDS, job_version
+from app.api.job_store import evict_expired_jobs, DEFAULT_JOB_TTL, TERMINAL_STATUSES
+from app.api.responses import ZeroCopyFileResponse
+from app.api.scheduler import QueueFull
+from app.api.spool import SpoolQueue
 from app.api.worker import worker
+from app.api.upload import stream_upload, read_file_header, check_required_columns, UploadRejected, DEFAULT_CHUNK_SIZE
+from app.service.checkpoints import prune_checkpoints
+from app.service.datasets import Dataset
+from app.service.executor import default_job_slots, get_execution_backend
+from app.service.query import QuerySpec
+from app.service.result_formats import OutputOptions, open_decoded, read_result
 from app.utils.logger import Logger
+from app.service.warmup import DEFAULT_PREWARM, warm_up
+from app.utils.metrics import (
+    FIRST_RESULT_SECONDS, REGISTRY, STARTUP_SECONDS, WARMUP_SECONDS, counter, gauge, observe_stage, process_uptime
+)
 
 FILE_DIR = os.path.abspath(os.path.join(os.path.dirname(__file__), '../../FILE_DIR'))
 OUTPUT_DIR = os.path.abspath(os.path.join(os.path.dirname(__file__), '../../OUTPUT_DIR'))
+UPLOAD_CHUNK_SIZE = DEFAULT_CHUNK_SIZE
+JOB_MAINTENANCE_INTERVAL = float(os.getenv("JOB_MAINTENANCE_INTERVAL", 60))
+# Results up to this size can be returned by /job_status?inline=true
+INLINE_RESULT_MAX_BYTES = int(os.getenv("INLINE_RESULT_MAX_BYTES", 64 * 1024))
+# Workers run inside the API process, by default as many as the host has job
+# slots; with JOB_QUEUE=spool this can be 0 and jobs left to worker daemons
+# (python -m app.api.runners)
+API_WORKERS = int(os.getenv("API_WORKERS") or default_job_slots())
 
 app = FastAPI()
+# Set once the startup warm-up has finished (or was skipped); reported by /ready
+readiness = {"ready": False}
+
+# Read from their owners only when /metrics is scraped
+gauge("csv_queue_depth", "Jobs waiting in the queue.", func=lambda: job_queue.qsize())
+gauge("csv_queue_bytes", "Input bytes of the jobs waiting in the queue.", func=lambda: job_queue.stats()["queued_bytes"])
+counter("csv_queue_rejected_total", "Jobs refused by admission control.", func=lambda: job_queue.rejected)
+counter("csv_result_cache_hits_total", "Jobs served from the result cache.", func=lambda: result_cache.hits)
+counter("csv_result_cache_misses_total", "Result cache lookups that missed.", func=lambda: result_cache.misses)
+counter("csv_log_records_dropped_total", "Log records dropped by rate limiting or a full log queue.", func=lambda: Logger().dropped)
+gauge("csv_job_event_subscribers", "Open status streams and long polls.", func=lambda: job_events.subscribers())
 
 class CSVFileRequest(BaseModel):
     job_id: str
@@ -24,39 +62,303 @@ class CSVFileRequest(BaseModel):
 async def startup_event():
     logger = Logger()
     logger.info("Starting up FastAPI app and launching workers...")
-    for _ in range(4):  # Number of workers
+    for _ in range(API_WORKERS):
         asyncio.create_task(worker(logger=logger))
-    logger.info("All workers launched.")
+    logger.info("Launched %s workers.", API_WORKERS)
+    asyncio.create_task(job_maintenance(logger=logger))
+    asyncio.create_task(prepare(logger=logger))
 
-@app.post("/process")
-async def process_csv_endpoint(job_id: str, csv_file: UploadFile = File(...)):
-    logger = Logger()
-    file_path = os.path.join(FILE_DIR, csv_file.filename)
-    with open(file_path, "wb") as buffer:
-        shutil.copyfileobj(csv_file.file, buffer)
-    logger.info(f"Received file {csv_file.filename} for job {job_id}, saved to {file_path}")
-    if not os.path.exists(file_path):
-        logger.error(f"CSV file {file_path} not found after upload for job {job_id}")
-        raise HTTPException(status_code=400, detail="CSV file not found after upload.")
-    # Enforce job_id uniqueness even after completion
+@app.on_event("shutdown")
+async def shutdown_event():
+    if isinstance(job_queue, SpoolQueue):
+        job_queue.close()
+    jobs.close()
+    get_execution_backend().shutdown(wait=False)
+
+async def prepare(logger=None, prewarm: bool = DEFAULT_PREWARM):
+    """Warm up the aggregation path, then report ready on /ready."""
+    logger = logger or Logger()
+    if prewarm:
+        start = time.perf_counter()
+        try:
+            await warm_up(get_execution_backend(), logger)
+            WARMUP_SECONDS.set(time.perf_counter() - start)
+        except Exception as e:
+            logger.warning("Warm-up failed; the first job will start cold: %s", e)
+    readiness["ready"] = True
+    STARTUP_SECONDS.set(process_uptime())
+    logger.info("Ready %.2fs after process start.", STARTUP_SECONDS.value())
+
+async def job_maintenance(logger=None):
+    """Periodically flush buffered job-store writes, evict expired jobs and prune abandoned checkpoints."""
+    logger = logger or Logger()
+    while True:
+        await asyncio.sleep(JOB_MAINTENANCE_INTERVAL)
+        try:
+            await asyncio.to_thread(jobs.flush)
+            await asyncio.to_thread(evict_expired_jobs, jobs, DEFAULT_JOB_TTL, logger)
+            await asyncio.to_thread(prune_checkpoints)
+        except Exception as e:
+            logger.error("Job maintenance failed: %s", e)
+
+def _job_upload_dir(job_id: str) -> str:
+    """Directory in FILE_DIR holding a job's uploads; removed when the job is evicted."""
+    safe = re.sub(r"[^A-Za-z0-9_.-]", "_", job_id).lstrip(".")
+    return os.path.join(FILE_DIR, "uploads", f"{safe}-{hashlib.sha1(job_id.encode()).hexdigest()[:8]}")
+
+def _output_options(output_format: str, compression: str) -> OutputOptions:
+    try:
+        return OutputOptions(format=output_format, compression=compression)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+
+def _query_spec(query: Optional[str]) -> QuerySpec:
+    """Parse the JSON query spec sent with a job; without one, sales are totalled per department."""
+    if not query:
+        return QuerySpec()
+    try:
+        return QuerySpec.model_validate_json(query)
+    except ValidationError as e:
+        raise HTTPException(status_code=400, detail=f"Invalid query: {e}")
+
+def _accepts_encoding(accept_encoding: str, encoding: str) -> bool:
+    """Whether an Accept-Encoding header allows ``encoding`` (q=0 refuses it)."""
+    for item in accept_encoding.split(","):
+        name, _, params = item.strip().partition(";")
+        if name.strip().lower() not in (encoding, "*"):
+            continue
+        q = params.strip()
+        try:
+            return not q.startswith("q=") or float(q[2:]) > 0
+        except ValueError:
+            return True
+    return False
+
+def _preview_fraction(preview: float, spec: QuerySpec) -> float:
+    if not 0 <= preview <= 1:
+        raise HTTPException(status_code=400, detail="preview must be a fraction between 0 and 1.")
+    if preview:
+        # Imported here, like the other modules only some requests need, to keep startup short
+        from app.service.preview import check_previewable
+        try:
+            check_previewable(spec)
+        except ValueError as e:
+            raise HTTPException(status_code=400, detail=str(e))
+    return preview
+
+async def _compute_preview(job_id: str, file_path: str, spec: QuerySpec, fraction: float, logger: Logger) -> None:
+    """Estimate a queued job's result from a sample and store it on the job, unless the exact one came first."""
+    from app.service.preview import sample_preview
+    try:
+        preview = await asyncio.to_thread(sample_preview, file_path, spec, fraction)
+    except Exception as e:
+        logger.warning("Preview for job %s failed: %s", job_id, e)
+        preview = {"error": str(e)}
+    job = jobs.get(job_id)
+    if job is None or job.get("status") in TERMINAL_STATUSES:
+        return
+    jobs.update(job_id, preview=preview)
+    logger.info("Preview for job %s stored.", job_id)
+
+async def _enqueue(job: Dict[str, Any], record: Dict[str, Any], size: int, priority: int, logger: Logger) -> None:
+    """Queue a job, storing its record once the queue admits it; a full queue answers 429."""
+    job_id = job["job_id"]
+
+    def admit() -> None:
+        # Checked again here, atomically with the put: another request may have
+        # claimed the ID while this one's body was streaming
+        _check_job_id(job_id, logger)
+        used_job_ids.add(job_id)
+        jobs[job_id] = record
+        if isinstance(job_queue, SpoolQueue):
+            # A worker daemon may claim the job at once and must find its record in the database
+            jobs.flush()
+
+    try:
+        await job_queue.put(job, size=size, priority=priority, on_admit=admit)
+    except QueueFull as e:
+        logger.warning("Rejecting job %s: %s", job_id, e)
+        for path in record.get("owned_files", []):
+            shutil.rmtree(path, ignore_errors=True)
+        raise HTTPException(status_code=429, detail=str(e), headers={"Retry-After": str(e.retry_after)})
+
+def _check_job_id(job_id: str, logger: Logger) -> None:
+    # Enforce job_id uniqueness even after completion and eviction, including
+    # IDs recorded by other processes sharing the job store
+    jobs.refresh_used_ids()
     if job_id in used_job_ids:
-        logger.error(f"Job ID {job_id} has been used before.")
+        logger.error("Job ID %s has been used before.", job_id)
         raise HTTPException(status_code=400, detail="Job ID has been used before and cannot be reused.")
-    used_job_ids.add(job_id)
     if job_id in jobs:
-        logger.error(f"Job ID {job_id} already exists.")
+        logger.error("Job ID %s already exists.", job_id)
         raise HTTPException(status_code=400, detail="Job ID already exists.")
-    jobs[job_id] = {"status": JobStatus.WAITING, "result": None, "error": None, "processing_time": {"start": None, "end": None}}
-    await job_queue.put({"job_id": job_id, "file_path": file_path})
-    logger.info(f"Job {job_id} queued for processing.")
+
+@app.post("/process")
+async def process_csv_endpoint(
+    background_tasks: BackgroundTasks,
+    job_id: str,
+    csv_file: UploadFile = File(...),
+    priority: int = 0,
+    output_format: str = "csv",
+    compression: str = "none",
+    query: Optional[str] = Form(None),
+    preview: float = 0,
+    dataset: Optional[str] = None
+):
+    logger = Logger()
+    output = _output_options(output_format, compression)
+    spec = _query_spec(query)
+    preview = _preview_fraction(preview, spec)
+    if dataset is not None and not dataset:
+        raise HTTPException(status_code=400, detail="dataset needs a name.")
+    # The upload hashes the part of the file the dataset's state covers, to check it is unchanged
+    dataset_state = Dataset(dataset).state() if dataset else None
+    _check_job_id(job_id, logger)
+    upload_dir = _job_upload_dir(job_id)
+    os.makedirs(upload_dir, exist_ok=True)
+    file_path = os.path.join(upload_dir, os.path.basename(csv_file.filename))
+    # Validate the header from the first chunk, then stream the rest to disk off the
+    # event loop, fingerprinting it so repeated exports can reuse results
+    upload_start = time.perf_counter()
+    try:
+        upload = await stream_upload(
+            csv_file, file_path, chunk_size=UPLOAD_CHUNK_SIZE, prefix_offset=dataset_state.offset if dataset_state else None
+        )
+    except UploadRejected as e:
+        logger.error("Rejected upload %s for job %s: %s", csv_file.filename, job_id, e)
+        shutil.rmtree(upload_dir, ignore_errors=True)
+        raise HTTPException(status_code=400, detail=f"CSV validation error: {e}")
+    observe_stage("upload", time.perf_counter() - upload_start)
+    logger.info("Received file %s for job %s, saved to %s", csv_file.filename, job_id, file_path)
+    record = {"status": JobStatus.WAITING, "result": None, "error": None, "processing_time": {"start": None, "end": None}, "fingerprint": upload.fingerprint, "owned_files": [upload_dir], "output": output.to_dict(), "query": spec.to_dict()}
+    job = {"job_id": job_id, "file_path": file_path, "fingerprint": upload.fingerprint, "output": output.to_dict(), "query": spec.to_dict(), "queued_at": time.time()}
+    if dataset:
+        record["dataset"] = dataset
+        job["dataset"] = dataset
+        if dataset_state and upload.prefix_sha256:
+            job["prefix"] = [dataset_state.offset, upload.prefix_sha256]
+        if upload.records_sha256:
+            job["records"] = [upload.records_end, upload.records_sha256]
+    await _enqueue(job, record, size=upload.size, priority=priority, logger=logger)
+    logger.info("Job %s queued for processing.", job_id)
+    if preview and upload.compression:
+        jobs.update(job_id, preview={"error": "Previews are not available for compressed uploads."})
+    elif preview:
+        # Runs once the response is sent, alongside the queued job
+        background_tasks.add_task(_compute_preview, job_id, file_path, spec, preview, logger)
     return {"job_id": job_id, "status": JobStatus.WAITING}
 
+def _resolve_pattern(pattern: str) -> List[str]:
+    """Files under FILE_DIR matching a glob.
+
+    Anything resolving outside FILE_DIR is ignored, and so are other jobs'
+    uploads under FILE_DIR/uploads, which are private to those jobs.
+    """
+    root = os.path.realpath(FILE_DIR)
+    uploads = os.path.join(root, "uploads") + os.sep
+    matches = sorted(glob.glob(os.path.join(root, pattern), recursive=True))
+    return [
+        p for p in matches
+        if os.path.isfile(p)
+        and os.path.realpath(p).startswith(root + os.sep)
+        and not os.path.realpath(p).startswith(uploads)
+    ]
+
+@app.post("/process_batch")
+async def process_batch_endpoint(
+    job_id: str,
+    pattern: Optional[str] = None,
+    csv_files: Optional[List[UploadFile]] = File(None),
+    priority: int = 0,
+    output_format: str = "csv",
+    compression: str = "none",
+    query: Optional[str] = Form(None)
+):
+    """Aggregate several shards (uploaded, or matched by ``pattern`` under FILE_DIR) into one result."""
+    logger = Logger()
+    output = _output_options(output_format, compression)
+    spec = _query_spec(query)
+    _check_job_id(job_id, logger)
+    if bool(pattern) == bool(csv_files):
+        raise HTTPException(status_code=400, detail="Provide either csv_files or pattern, not both.")
+    fingerprint = None
+    owned_files = []
+    try:
+        if pattern:
+            file_paths = _resolve_pattern(pattern)
+            shard_root = os.path.realpath(FILE_DIR)
+            if not file_paths:
+                raise HTTPException(status_code=400, detail="No files under FILE_DIR match the pattern.")
+            for path in file_paths:
+                try:
+                    check_required_columns(await asyncio.to_thread(read_file_header, path))
+                except UploadRejected as e:
+                    raise UploadRejected(f"{os.path.basename(path)}: {e}")
+        else:
+            names = [os.path.basename(f.filename) for f in csv_files]
+            if len(set(names)) != len(names):
+                raise HTTPException(status_code=400, detail="Batch contains duplicate file names.")
+            owned_files = [_job_upload_dir(job_id)]
+            shard_root = owned_files[0]
+            os.makedirs(owned_files[0], exist_ok=True)
+            uploads = []
+            upload_start = time.perf_counter()
+            for csv_file, name in zip(csv_files, names):
+                try:
+                    uploads.append(await stream_upload(csv_file, os.path.join(owned_files[0], name), chunk_size=UPLOAD_CHUNK_SIZE))
+                except UploadRejected as e:
+                    shutil.rmtree(owned_files[0], ignore_errors=True)
+                    raise UploadRejected(f"{name}: {e}")
+            observe_stage("upload", time.perf_counter() - upload_start)
+            file_paths = [u.path for u in uploads]
+            # Merged sums do not depend on shard order
+            fingerprint = hashlib.sha256(",".join(sorted(u.fingerprint for u in uploads)).encode()).hexdigest()
+    except UploadRejected as e:
+        logger.error("Rejected batch for job %s: %s", job_id, e)
+        raise HTTPException(status_code=400, detail=f"CSV validation error: {e}")
+    size = sum(os.path.getsize(p) for p in file_paths)
+    # Shards are named by their path under FILE_DIR (or the upload directory), which is
+    # unique where basenames from different directories may not be
+    shards = {os.path.relpath(p, shard_root): {"status": JobStatus.WAITING, "error": None} for p in file_paths}
+    record = {"status": JobStatus.WAITING, "result": None, "error": None, "processing_time": {"start": None, "end": None}, "fingerprint": fingerprint, "shards": shards, "owned_files": owned_files, "output": output.to_dict(), "query": spec.to_dict()}
+    await _enqueue({"job_id": job_id, "file_paths": file_paths, "shard_root": shard_root, "fingerprint": fingerprint, "output": output.to_dict(), "query": spec.to_dict(), "queued_at": time.time()}, record, size=size, priority=priority, logger=logger)
+    logger.info("Batch job %s with %s shards queued for processing.", job_id, len(file_paths))
+    return {"job_id": job_id, "status": JobStatus.WAITING, "shards": list(shards)}
+
+def _download_urls(job_id: str, job: Dict[str, Any]):
+    """Named and direct download links of a finished job, or Nones."""
+    if job.get("status") == JobStatus.FINISHED and job.get("result"):
+        return f"/download/{job_id}/{os.path.basename(job['result'])}", f"/download/{job_id}"
+    return None, None
+
+async def _wait_for_change(job_id: str, job: Dict[str, Any], since: Optional[str], timeout: float) -> Optional[Dict[str, Any]]:
+    """The job once its version differs from ``since`` (default: its current one), or as it is after ``timeout``."""
+    baseline = since or job_version(job)
+    deadline = time.monotonic() + timeout
+    with job_events.subscribe([job_id]) as subscription:
+        while job is not None and job_version(job) == baseline:
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                break
+            await subscription.wait(min(remaining, JOB_EVENTS_POLL_INTERVAL))
+            job = jobs.get(job_id)
+    return job
+
 @app.get("/job_status/{job_id}")
-async def job_status(job_id: str):
+async def job_status(job_id: str, inline: bool = False, wait: float = 0, since: Optional[str] = None):
+    """Job record plus download links; with ``inline`` a small result is included as rows.
+
+    With ``wait`` (seconds, capped at ``MAX_LONG_POLL_SECONDS``) this is a long
+    poll: it answers once the job's ``version`` differs from ``since`` (or,
+    without ``since``, from the version at the time of the request), or when
+    the wait runs out, whichever comes first.
+    """
     logger = Logger()
     job = jobs.get(job_id)
+    if job and wait > 0:
+        job = await _wait_for_change(job_id, job, since, min(wait, MAX_LONG_POLL_SECONDS))
     if not job:
-        logger.error(f"Job {job_id} not found in status query.")
+        logger.error("Job %s not found in status query.", job_id)
         raise HTTPException(status_code=404, detail="Job not found.")
     # Calculate processing_time in seconds if possible
     processing_time = None
@@ -65,35 +367,142 @@ async def job_status(job_id: str):
         end = pt["end"] if pt["end"] else time.time()
         processing_time = end - pt["start"]
     # Add download links for finished jobs with result files
-    download_url = None
-    direct_download_url = None
-    if job.get("status") == JobStatus.FINISHED and job.get("result"):
-        file_path = job.get("result")
-        file_name = os.path.basename(file_path)
-        download_url = f"/download/{job_id}/{file_name}"
-        direct_download_url = f"/download/{job_id}"
-    logger.info(f"Status for job {job_id} queried: {job}")
-    return {**job, "processing_time": processing_time, "download_url": download_url, "direct_download_url": direct_download_url}
+    download_url, direct_download_url = _download_urls(job_id, job)
+    inline_result = None
+    file_path = job.get("result")
+    if inline and download_url and os.path.exists(file_path) and os.path.getsize(file_path) <= INLINE_RESULT_MAX_BYTES:
+        output = OutputOptions(**job.get("output", {}))
+        inline_result = (await asyncio.to_thread(read_result, file_path, output)).to_dicts()
+    logger.debug("Status for job %s queried: %s", job_id, job.get("status"))
+    status = {
+        **job,
+        "processing_time": processing_time,
+        "download_url": download_url,
+        "direct_download_url": direct_download_url,
+        "version": job_version(job),
+    }
+    if inline:
+        status["inline_result"] = inline_result
+    return status
+
+def _job_event(job_id: str, job: Optional[Dict[str, Any]]) -> Dict[str, Any]:
+    if job is None:
+        return {"job_id": job_id, "status": None, "error": "Job not found."}
+    download_url, _ = _download_urls(job_id, job)
+    event = {
+        "job_id": job_id,
+        "status": job.get("status"),
+        "progress": job.get("progress"),
+        "error": job.get("error"),
+        "download_url": download_url,
+        "version": job_version(job),
+    }
+    if "shards" in job:
+        event["shards"] = job["shards"]
+    if job.get("preview"):
+        event["preview"] = job["preview"]
+    return event
+
+async def _job_event_stream(job_ids: List[str]):
+    """SSE ``status`` events for each job as it changes, ending once every job is finished, failed or gone."""
+    sent: Dict[str, Optional[str]] = {}
+    open_jobs = set(job_ids)
+    last_write = time.monotonic()
+    with job_events.subscribe(job_ids) as subscription:
+        while open_jobs:
+            for job_id in sorted(open_jobs):
+                job = jobs.get(job_id)
+                version = job_version(job) if job else None
+                if job_id in sent and sent[job_id] == version:
+                    continue
+                sent[job_id] = version
+                yield f"event: status\ndata: {json.dumps(_job_event(job_id, job), default=str)}\n\n"
+                last_write = time.monotonic()
+                if job is None or job.get("status") in TERMINAL_STATUSES:
+                    open_jobs.discard(job_id)
+            if not open_jobs:
+                break
+            if time.monotonic() - last_write >= JOB_EVENTS_HEARTBEAT:
+                yield ": keepalive\n\n"
+                last_write = time.monotonic()
+            await subscription.wait(min(JOB_EVENTS_POLL_INTERVAL, JOB_EVENTS_HEARTBEAT))
+
+@app.get("/job_events")
+async def job_event_stream(job_id: List[str] = Query(...)):
+    """Server-Sent Events stream of status and progress changes for one or more jobs."""
+    job_ids = list(dict.fromkeys(job_id))
+    Logger().debug("Streaming events for %s jobs.", len(job_ids))
+    return StreamingResponse(
+        _job_event_stream(job_ids),
+        media_type="text/event-stream",
+        # Keep proxies from caching or buffering the stream
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"},
+    )
 
 @app.get("/download/{job_id}")
-async def download_file_by_id(job_id: str):
+async def download_file_by_id(job_id: str, request: Request):
+    """Serve a job's result; compressed text results are decoded for clients that do not accept the encoding."""
     logger = Logger()
     job = jobs.get(job_id)
     if not job:
-        logger.error(f"Job {job_id} not found in download request.")
+        logger.error("Job %s not found in download request.", job_id)
         raise HTTPException(status_code=404, detail="Job not found.")
     if job.get("status") != JobStatus.FINISHED or not job.get("result"):
-        logger.error(f"Job {job_id} is not finished or has no result for download.")
+        logger.error("Job %s is not finished or has no result for download.", job_id)
         raise HTTPException(status_code=400, detail="Job not finished or has no result file.")
     file_path = job.get("result")
     if not os.path.exists(file_path):
-        logger.error(f"Result file {file_path} not found for job {job_id}.")
+        logger.error("Result file %s not found for job %s.", file_path, job_id)
         raise HTTPException(status_code=404, detail="Result file not found.")
+    output = OutputOptions(**job.get("output", {}))
     file_name = os.path.basename(file_path)
-    logger.info(f"Serving download for job {job_id}, file: {file_path}")
-    return FileResponse(path=file_path, filename=file_name, media_type="text/csv")
+    logger.info("Serving download for job %s, file: %s", job_id, file_path)
+    encoding = output.content_encoding
+    if encoding is None:
+        return ZeroCopyFileResponse(path=file_path, filename=file_name, media_type=output.media_type)
+    headers = {"Vary": "Accept-Encoding"}
+    if _accepts_encoding(request.headers.get("accept-encoding", ""), encoding):
+        # Sent as stored; the client undoes the compression
+        headers["Content-Encoding"] = encoding
+        return ZeroCopyFileResponse(path=file_path, filename=os.path.splitext(file_name)[0], media_type=output.media_type, headers=headers)
+    headers["Content-Disposition"] = f'attachment; filename="{os.path.splitext(file_name)[0]}"'
+    return StreamingResponse(_iter_decoded(file_path, output), media_type=output.media_type, headers=headers)
+
+async def _iter_decoded(file_path: str, output: OutputOptions):
+    with open_decoded(file_path, output) as f:
+        while chunk := await asyncio.to_thread(f.read, UPLOAD_CHUNK_SIZE):
+            yield chunk
+
+@app.get("/queue_stats")
+async def queue_stats():
+    """Depth, queued bytes and wait-time statistics of the job scheduler."""
+    # The spool reads its stats from SQLite
+    return await asyncio.to_thread(job_queue.stats)
+
+@app.get("/cache_stats")
+async def cache_stats():
+    """Hit/miss counters and size of the shared result cache."""
+    # Takes the cache's file lock and reads its index, so off the event loop
+    return await asyncio.to_thread(result_cache.stats)
+
+@app.get("/metrics")
+async def metrics():
+    """Latency histograms, queue depth, active workers and throughput in Prometheus text format."""
+    # Off the event loop: the queue gauges may read the spool
+    return PlainTextResponse(await asyncio.to_thread(REGISTRY.render), media_type="text/plain; version=0.0.4")
 
 @app.get("/health")
 async def health_check():
     """Health check endpoint for service monitoring."""
     return {"status": "ok"}
+
+@app.get("/ready")
+async def readiness_check():
+    """Readiness endpoint: 503 until the startup warm-up has finished, with startup timings."""
+    body = {
+        "status": "ready" if readiness["ready"] else "starting",
+        "startup_seconds": STARTUP_SECONDS.value() or None,
+        "warmup_seconds": WARMUP_SECONDS.value() or None,
+        "time_to_first_result_seconds": FIRST_RESULT_SECONDS.value() or None,
+    }
+    return JSONResponse(body, status_code=200 if readiness["ready"] else 503)
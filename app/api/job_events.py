@@ -0,0 +1,86 @@
+"""
+Waiting for job changes
+
+Status streams and long polls register a ``Subscription`` for the jobs they
+watch; the job store calls ``JobEvents.notify`` after every write, which
+wakes them at once. Writes made by another process sharing the SQLite
+store do not reach this process, so a subscriber also re-reads its jobs
+every ``JOB_EVENTS_POLL_INTERVAL`` seconds. A change is detected by
+comparing ``job_version`` of the record, not by counting notifications.
+"""
+import asyncio
+import hashlib
+import json
+import os
+from contextlib import contextmanager
+from threading import Lock
+from typing import Any, Dict, Iterable, Iterator, Set
+
+JOB_EVENTS_POLL_INTERVAL = float(os.getenv("JOB_EVENTS_POLL_INTERVAL", 1.0))
+# SSE comment sent on an idle stream so proxies keep the connection open
+JOB_EVENTS_HEARTBEAT = float(os.getenv("JOB_EVENTS_HEARTBEAT", 15))
+# Upper bound on /job_status?wait=
+MAX_LONG_POLL_SECONDS = float(os.getenv("MAX_LONG_POLL_SECONDS", 60))
+
+
+def job_version(record: Dict[str, Any]) -> str:
+    """Short digest of a job record; it changes whenever the record does."""
+    data = json.dumps(record, sort_keys=True, default=str).encode()
+    return hashlib.sha1(data).hexdigest()[:16]
+
+
+class Subscription:
+    """Wake-up flag of one waiting request, set from any thread."""
+
+    def __init__(self):
+        self._loop = asyncio.get_running_loop()
+        self._changed = asyncio.Event()
+
+    def wake(self) -> None:
+        try:
+            self._loop.call_soon_threadsafe(self._changed.set)
+        except RuntimeError:
+            pass  # The request's event loop is gone
+
+    async def wait(self, timeout: float) -> None:
+        """Return once a watched job was written to since the last wait, or after ``timeout``."""
+        try:
+            await asyncio.wait_for(self._changed.wait(), timeout)
+        except asyncio.TimeoutError:
+            pass
+        self._changed.clear()
+
+
+class JobEvents:
+    def __init__(self):
+        self._subscriptions: Dict[str, Set[Subscription]] = {}
+        self._lock = Lock()
+
+    def notify(self, job_id: str) -> None:
+        with self._lock:
+            subscriptions = list(self._subscriptions.get(job_id, ()))
+        for subscription in subscriptions:
+            subscription.wake()
+
+    @contextmanager
+    def subscribe(self, job_ids: Iterable[str]) -> Iterator[Subscription]:
+        """Watch ``job_ids`` for the duration of the block; must be entered on an event loop."""
+        job_ids = set(job_ids)
+        subscription = Subscription()
+        with self._lock:
+            for job_id in job_ids:
+                self._subscriptions.setdefault(job_id, set()).add(subscription)
+        try:
+            yield subscription
+        finally:
+            with self._lock:
+                for job_id in job_ids:
+                    watchers = self._subscriptions.get(job_id)
+                    if watchers is not None:
+                        watchers.discard(subscription)
+                        if not watchers:
+                            del self._subscriptions[job_id]
+
+    def subscribers(self) -> int:
+        with self._lock:
+            return len({s for watchers in self._subscriptions.values() for s in watchers})
@@ -0,0 +1,406 @@
+import copy
+import json
+import os
+import shutil
+import sqlite3
+import time
+from abc import ABC, abstractmethod
+from threading import Lock, Timer
+from typing import Any, Callable, Dict, Iterable, List, Optional
+from app.utils.bloom import BloomFilter
+from app.utils.logger import Logger
+
+JOB_STORES = ("memory", "sqlite")
+DEFAULT_JOB_STORE = os.getenv("JOB_STORE", "memory")
+DEFAULT_JOB_STORE_PATH = os.getenv(
+    "JOB_STORE_PATH", os.path.abspath(os.path.join(os.path.dirname(__file__), '../../jobs.sqlite3'))
+)
+DEFAULT_JOB_TTL = float(os.getenv("JOB_TTL_SECONDS", 24 * 3600))
+DEFAULT_BATCH_SIZE = int(os.getenv("JOB_STORE_BATCH_SIZE", 64))
+DEFAULT_FLUSH_INTERVAL = float(os.getenv("JOB_STORE_FLUSH_INTERVAL", 0.5))
+# Only jobs in these states are eligible for TTL eviction
+TERMINAL_STATUSES = ("FINISHED", "FAILED")
+
+JobRecord = Dict[str, Any]
+
+
+class JobStore(ABC):
+    """Storage for job records, indexed by job ID and by status.
+
+    Records are plain dicts; ``get`` returns a copy, so changes must be
+    written back with ``update`` (shallow merge) or item assignment. Every ID
+    ever stored is remembered in ``used_ids``, a Bloom filter that outlives
+    eviction: a previously used ID is always rejected, and a fresh one is
+    wrongly rejected with negligible probability.
+
+    Callables in ``listeners`` are called with the job ID after each write
+    or delete made through this store, from the writing thread.
+    """
+
+    def __init__(self):
+        self.used_ids = BloomFilter()
+        self.listeners: List[Callable[[str], None]] = []
+
+    @abstractmethod
+    def get(self, job_id: str) -> Optional[JobRecord]:
+        ...
+
+    @abstractmethod
+    def __setitem__(self, job_id: str, record: JobRecord) -> None:
+        ...
+
+    @abstractmethod
+    def update(self, job_id: str, **fields: Any) -> JobRecord:
+        ...
+
+    @abstractmethod
+    def ids_by_status(self, status: str) -> List[str]:
+        ...
+
+    @abstractmethod
+    def expired(self, ttl: float, now: Optional[float] = None) -> List[str]:
+        """IDs of terminal jobs last updated more than ``ttl`` seconds ago."""
+
+    @abstractmethod
+    def delete(self, job_ids: Iterable[str]) -> None:
+        ...
+
+    @abstractmethod
+    def clear(self) -> None:
+        ...
+
+    def flush(self) -> None:
+        """Write out any buffered changes."""
+
+    def close(self) -> None:
+        self.flush()
+
+    def __contains__(self, job_id: str) -> bool:
+        return self.get(job_id) is not None
+
+    def __getitem__(self, job_id: str) -> JobRecord:
+        record = self.get(job_id)
+        if record is None:
+            raise KeyError(job_id)
+        return record
+
+    def refresh_used_ids(self) -> None:
+        """Pick up IDs other processes sharing this store have recorded."""
+
+    def was_used(self, job_id: str) -> bool:
+        self.refresh_used_ids()
+        return job_id in self.used_ids or job_id in self
+
+    def _notify(self, job_ids: Iterable[str]) -> None:
+        for job_id in job_ids:
+            for listener in self.listeners:
+                listener(job_id)
+
+
+class InMemoryJobStore(JobStore):
+    def __init__(self):
+        super().__init__()
+        self._records: Dict[str, JobRecord] = {}
+        self._updated: Dict[str, float] = {}
+        self._by_status: Dict[str, set] = {}
+        self._lock = Lock()
+
+    def get(self, job_id: str) -> Optional[JobRecord]:
+        with self._lock:
+            record = self._records.get(job_id)
+            return copy.deepcopy(record) if record is not None else None
+
+    def __setitem__(self, job_id: str, record: JobRecord) -> None:
+        with self._lock:
+            self._put(job_id, copy.deepcopy(record))
+        self.used_ids.add(job_id)
+        self._notify([job_id])
+
+    def update(self, job_id: str, **fields: Any) -> JobRecord:
+        with self._lock:
+            record = {**self._records[job_id], **copy.deepcopy(fields)}
+            self._put(job_id, record)
+            record = copy.deepcopy(record)
+        self._notify([job_id])
+        return record
+
+    def ids_by_status(self, status: str) -> List[str]:
+        with self._lock:
+            return list(self._by_status.get(str(status), ()))
+
+    def expired(self, ttl: float, now: Optional[float] = None) -> List[str]:
+        cutoff = (now or time.time()) - ttl
+        with self._lock:
+            return [
+                job_id
+                for status in TERMINAL_STATUSES
+                for job_id in self._by_status.get(status, ())
+                if self._updated[job_id] < cutoff
+            ]
+
+    def delete(self, job_ids: Iterable[str]) -> None:
+        job_ids = list(job_ids)
+        with self._lock:
+            for job_id in job_ids:
+                record = self._records.pop(job_id, None)
+                if record is not None:
+                    self._by_status[str(record.get("status"))].discard(job_id)
+                    del self._updated[job_id]
+        self._notify(job_ids)
+
+    def clear(self) -> None:
+        with self._lock:
+            self._records.clear()
+            self._updated.clear()
+            self._by_status.clear()
+
+    def _put(self, job_id: str, record: JobRecord) -> None:
+        previous = self._records.get(job_id)
+        if previous is not None:
+            self._by_status[str(previous.get("status"))].discard(job_id)
+        self._records[job_id] = record
+        self._updated[job_id] = time.time()
+        self._by_status.setdefault(str(record.get("status")), set()).add(job_id)
+
+
+class SQLiteJobStore(JobStore):
+    """Job store in an embedded SQLite database, shareable between processes.
+
+    Writes are buffered and committed in batches (every ``batch_size`` changes
+    or, from a timer, ``flush_interval`` seconds after the first buffered one,
+    whichever comes first); reads see buffered changes immediately. ``update``
+    is written as a change to the given fields only, so processes sharing
+    the database do not overwrite each other's fields with stale copies. The
+    used-ID filter is persisted one Bloom layer per row: a flush OR-merges
+    and writes back only the layers that gained IDs, and bumps a version
+    counter that ``refresh_used_ids`` checks before re-reading the layers.
+    """
+
+    def __init__(
+        self,
+        path: str = DEFAULT_JOB_STORE_PATH,
+        batch_size: int = DEFAULT_BATCH_SIZE,
+        flush_interval: float = DEFAULT_FLUSH_INTERVAL
+    ):
+        super().__init__()
+        self.path = path
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self._pending: Dict[str, Optional[JobRecord]] = {}  # None marks a delete
+        self._patches: Dict[str, JobRecord] = {}  # Fields updated in records already in the database
+        self._pending_used = False
+        self._used_version = None
+        self._timer: Optional[Timer] = None
+        self._closed = False
+        self._lock = Lock()
+        os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+        self._conn = sqlite3.connect(path, check_same_thread=False, isolation_level=None)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("PRAGMA synchronous=NORMAL")
+        self._conn.executescript(
+            """
+            CREATE TABLE IF NOT EXISTS jobs (
+                job_id TEXT PRIMARY KEY,
+                status TEXT NOT NULL,
+                updated REAL NOT NULL,
+                record TEXT NOT NULL
+            );
+            CREATE INDEX IF NOT EXISTS jobs_status_updated ON jobs (status, updated);
+            CREATE TABLE IF NOT EXISTS meta (key TEXT PRIMARY KEY, value BLOB NOT NULL);
+            """
+        )
+        self.refresh_used_ids()
+
+    def get(self, job_id: str) -> Optional[JobRecord]:
+        with self._lock:
+            record = self._get(job_id)
+            return copy.deepcopy(record) if record is not None else None
+
+    def __setitem__(self, job_id: str, record: JobRecord) -> None:
+        self.used_ids.add(job_id)
+        with self._lock:
+            self._pending[job_id] = copy.deepcopy(record)
+            self._patches.pop(job_id, None)
+            self._pending_used = True
+            self._maybe_flush()
+        self._notify([job_id])
+
+    def update(self, job_id: str, **fields: Any) -> JobRecord:
+        fields = copy.deepcopy(fields)
+        with self._lock:
+            record = self._get(job_id)
+            if record is None:
+                raise KeyError(job_id)
+            # A record still buffered whole is written whole; one in the database only gets the fields
+            record.update(fields)
+            if job_id not in self._pending:
+                self._patches.setdefault(job_id, {}).update(fields)
+            self._maybe_flush()
+            record = copy.deepcopy(record)
+        self._notify([job_id])
+        return record
+
+    def ids_by_status(self, status: str) -> List[str]:
+        with self._lock:
+            self._flush()
+            rows = self._conn.execute("SELECT job_id FROM jobs WHERE status = ?", (str(status),)).fetchall()
+        return [r[0] for r in rows]
+
+    def expired(self, ttl: float, now: Optional[float] = None) -> List[str]:
+        cutoff = (now or time.time()) - ttl
+        placeholders = ",".join("?" for _ in TERMINAL_STATUSES)
+        with self._lock:
+            self._flush()
+            rows = self._conn.execute(
+                f"SELECT job_id FROM jobs WHERE status IN ({placeholders}) AND updated < ?",
+                (*TERMINAL_STATUSES, cutoff),
+            ).fetchall()
+        return [r[0] for r in rows]
+
+    def delete(self, job_ids: Iterable[str]) -> None:
+        job_ids = list(job_ids)
+        with self._lock:
+            for job_id in job_ids:
+                self._pending[job_id] = None
+                self._patches.pop(job_id, None)
+            self._maybe_flush()
+        self._notify(job_ids)
+
+    def clear(self) -> None:
+        with self._lock:
+            self._pending.clear()
+            self._patches.clear()
+            self._conn.execute("DELETE FROM jobs")
+            self._conn.execute("DELETE FROM meta WHERE key LIKE 'used_ids%'")
+            self._used_version = None
+
+    def flush(self) -> None:
+        with self._lock:
+            self._flush()
+
+    def close(self) -> None:
+        with self._lock:
+            self._flush()
+            self._closed = True
+            self._conn.close()
+
+    def refresh_used_ids(self) -> None:
+        with self._lock:
+            if self._closed:
+                return
+            row = self._conn.execute("SELECT value FROM meta WHERE key = 'used_ids_version'").fetchone()
+            version = row[0] if row else None
+            if version is None or version == self._used_version:
+                return
+            for key, value in self._conn.execute("SELECT key, value FROM meta WHERE key LIKE 'used_ids:%'"):
+                self.used_ids.merge_layer_bytes(int(key.split(":")[1]), value)
+            self._used_version = version
+
+    def _get(self, job_id: str) -> Optional[JobRecord]:
+        if job_id in self._pending:
+            return self._pending[job_id]
+        row = self._conn.execute("SELECT record FROM jobs WHERE job_id = ?", (job_id,)).fetchone()
+        if row is None:
+            return None
+        return {**json.loads(row[0]), **self._patches.get(job_id, {})}
+
+    def _maybe_flush(self) -> None:
+        if len(self._pending) + len(self._patches) >= self.batch_size:
+            self._flush()
+        elif self._timer is None and (self._pending or self._patches or self._pending_used):
+            self._timer = Timer(self.flush_interval, self._timed_flush)
+            self._timer.daemon = True
+            self._timer.start()
+
+    def _timed_flush(self) -> None:
+        with self._lock:
+            self._timer = None
+            if not self._closed:
+                self._flush()
+
+    def _flush(self) -> None:
+        if self._timer is not None:
+            self._timer.cancel()
+            self._timer = None
+        if not self._pending and not self._patches and not self._pending_used:
+            return
+        now = time.time()
+        upserts = [
+            (job_id, str(record.get("status")), now, json.dumps(record))
+            for job_id, record in self._pending.items() if record is not None
+        ]
+        deletes = [(job_id,) for job_id, record in self._pending.items() if record is None]
+        self._conn.execute("BEGIN IMMEDIATE")
+        try:
+            self._conn.executemany(
+                "INSERT INTO jobs (job_id, status, updated, record) VALUES (?, ?, ?, ?) "
+                "ON CONFLICT(job_id) DO UPDATE SET status = excluded.status, "
+                "updated = excluded.updated, record = excluded.record",
+                upserts,
+            )
+            self._conn.executemany("DELETE FROM jobs WHERE job_id = ?", deletes)
+            for job_id, fields in self._patches.items():
+                # Set inside the stored JSON, so fields written meanwhile by other processes are kept
+                paths = [arg for key, value in fields.items() for arg in (f'$."{key}"', json.dumps(value))]
+                self._conn.execute(
+                    f"UPDATE jobs SET record = json_set(record{', ?, json(?)' * len(fields)}), "
+                    "status = COALESCE(?, status), updated = ? WHERE job_id = ?",
+                    (*paths, str(fields["status"]) if "status" in fields else None, now, job_id),
+                )
+            dirty = self.used_ids.dirty_layers() if self._pending_used else []
+            for index in dirty:
+                key = f"used_ids:{index}"
+                row = self._conn.execute("SELECT value FROM meta WHERE key = ?", (key,)).fetchone()
+                if row:
+                    self.used_ids.merge_layer_bytes(index, row[0])
+                self._conn.execute(
+                    "INSERT OR REPLACE INTO meta (key, value) VALUES (?, ?)", (key, self.used_ids.layer_bytes(index))
+                )
+            if dirty:
+                row = self._conn.execute("SELECT value FROM meta WHERE key = 'used_ids_version'").fetchone()
+                version = (row[0] if row else 0) + 1
+                self._conn.execute("INSERT OR REPLACE INTO meta (key, value) VALUES ('used_ids_version', ?)", (version,))
+                # Nobody else wrote since our last refresh, so the local filter is already current
+                if row and row[0] == self._used_version:
+                    self._used_version = version
+            self._conn.execute("COMMIT")
+        except BaseException:
+            self._conn.execute("ROLLBACK")
+            raise
+        self.used_ids.mark_clean(dirty)
+        self._pending.clear()
+        self._patches.clear()
+        self._pending_used = False
+
+
+def create_job_store(kind: str = DEFAULT_JOB_STORE, path: str = DEFAULT_JOB_STORE_PATH) -> JobStore:
+    if kind == "memory":
+        return InMemoryJobStore()
+    if kind == "sqlite":
+        return SQLiteJobStore(path)
+    raise ValueError(f"Unknown job store '{kind}', expected one of {JOB_STORES}")
+
+
+def evict_expired_jobs(store: JobStore, ttl: float = DEFAULT_JOB_TTL, logger: Optional[Logger] = None) -> int:
+    """Remove terminal jobs older than ``ttl`` together with the files they own.
+
+    A job owns the paths listed in its ``owned_files`` (its upload directory
+    in FILE_DIR and its result in OUTPUT_DIR); inputs picked up from FILE_DIR
+    by a batch pattern are not owned and are left alone.
+    """
+    logger = logger or Logger()
+    job_ids = store.expired(ttl)
+    for job_id in job_ids:
+        record = store.get(job_id) or {}
+        for path in record.get("owned_files", []) + ([record["result"]] if record.get("result") else []):
+            try:
+                if os.path.isdir(path):
+                    shutil.rmtree(path)
+                elif os.path.exists(path):
+                    os.remove(path)
+            except OSError as e:
+                logger.warning("Could not remove %s for evicted job %s: %s", path, job_id, e)
+    store.delete(job_ids)
+    if job_ids:
+        logger.info("Evicted %s jobs older than %s seconds.", len(job_ids), ttl)
+    return len(job_ids)
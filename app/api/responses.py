@@ -0,0 +1,29 @@
+import os
+from starlette.responses import FileResponse
+from starlette.types import Receive, Scope, Send
+
+# Used when the server cannot hand the file to the OS; larger than Starlette's 64 KB default
+DOWNLOAD_CHUNK_SIZE = int(os.getenv("DOWNLOAD_CHUNK_SIZE", 1024 * 1024))
+
+
+class ZeroCopyFileResponse(FileResponse):
+    """File download that lets the server send the file itself when it can.
+
+    Servers offering the ASGI ``http.response.pathsend`` extension copy the
+    file to the socket without it passing through Python (sendfile). Others
+    get the regular chunked read with a bigger chunk. Range requests and
+    HEAD are handled by ``FileResponse`` as before.
+    """
+
+    chunk_size = DOWNLOAD_CHUNK_SIZE
+
+    async def __call__(self, scope: Scope, receive: Receive, send: Send) -> None:
+        self._pathsend = "http.response.pathsend" in scope.get("extensions", {})
+        await super().__call__(scope, receive, send)
+
+    async def _handle_simple(self, send: Send, send_header_only: bool) -> None:
+        if send_header_only or not self._pathsend:
+            await super()._handle_simple(send, send_header_only)
+            return
+        await send({"type": "http.response.start", "status": self.status_code, "headers": self.raw_headers})
+        await send({"type": "http.response.pathsend", "path": os.path.abspath(self.path)})
@@ -1,12 +1,66 @@
+"""
+Worker entry points
+
+``run_workers`` drains the in-process queue. ``run_daemon`` is the
+standalone worker process for ``JOB_QUEUE=spool``: it claims jobs from the
+spool shared with the API, records them in the shared SQLite job store
+(``JOB_STORE=sqlite``), and runs ``--concurrency`` of them at a time.
+
+    JOB_QUEUE=spool JOB_STORE=sqlite python -m app.api.runners --concurrency 8
+"""
+import argparse
 import asyncio
+import os
+import signal
+from app.api.job_store import SQLiteJobStore
+from app.api.spool import SpoolQueue
 from app.api.state import jobs, job_queue
 from app.api.worker import worker
+from app.service.executor import default_job_slots, get_execution_backend
+from app.service.warmup import DEFAULT_PREWARM, warm_up
+from app.utils.logger import Logger
+
+# Jobs one daemon runs at a time, by default as many as the host has job slots
+DEFAULT_WORKER_CONCURRENCY = int(os.getenv("WORKER_CONCURRENCY") or default_job_slots())
 
 async def run_workers(num_workers: int = 4):
     for _ in range(num_workers):
         asyncio.create_task(worker())
     await job_queue.join()  # Wait for all jobs to be processed
 
-# Optional: CLI entry point for running workers directly
+async def run_daemon(concurrency: int = DEFAULT_WORKER_CONCURRENCY):
+    """Run spool workers until SIGINT/SIGTERM.
+
+    On the way out, the leases of jobs still running are released so other
+    daemons pick them up at once instead of when the leases expire.
+    """
+    logger = Logger()
+    if not isinstance(job_queue, SpoolQueue) or not isinstance(jobs, SQLiteJobStore):
+        raise SystemExit("The worker daemon needs JOB_QUEUE=spool and JOB_STORE=sqlite, shared with the API.")
+    stop = asyncio.Event()
+    loop = asyncio.get_running_loop()
+    for sig in (signal.SIGINT, signal.SIGTERM):
+        try:
+            loop.add_signal_handler(sig, stop.set)
+        except NotImplementedError:  # pragma: no cover - Windows
+            pass
+    if DEFAULT_PREWARM:
+        # Before claiming jobs, so the first one does not start cold
+        await warm_up(get_execution_backend(), logger)
+    tasks = [asyncio.create_task(worker(logger=logger)) for _ in range(concurrency)]
+    logger.info("Worker daemon %s running %s workers on %s", job_queue.owner, concurrency, job_queue.path)
+    try:
+        await stop.wait()
+    finally:
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+        job_queue.close()
+        jobs.close()
+        get_execution_backend().shutdown(wait=False)
+        logger.info("Worker daemon %s stopped.", job_queue.owner)
+
 if __name__ == "__main__":
-    asyncio.run(run_workers())
\ No newline at end of file
+    parser = argparse.ArgumentParser(description="Run jobs from the shared spool.")
+    parser.add_argument("--concurrency", type=int, default=DEFAULT_WORKER_CONCURRENCY, help="jobs run at a time")
+    asyncio.run(run_daemon(parser.parse_args().concurrency))
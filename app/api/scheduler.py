@@ -0,0 +1,213 @@
+import asyncio
+import math
+import os
+import threading
+import time
+from collections import deque
+from dataclasses import dataclass, field
+from typing import Any, Callable, Deque, Dict, List, Optional
+
+DEFAULT_MAX_DEPTH = int(os.getenv("QUEUE_MAX_DEPTH", 1000))
+DEFAULT_MAX_BYTES = int(os.getenv("QUEUE_MAX_BYTES", 100 * 1024 ** 3))
+# A job waiting longer than this is served ahead of smaller, newer jobs of any priority
+DEFAULT_STARVATION_SECONDS = float(os.getenv("QUEUE_STARVATION_SECONDS", 300))
+WAIT_SAMPLES = 256
+
+
+def refusal(depth: int, queued_bytes: int, size: int, max_depth: int, max_bytes: int) -> Optional[str]:
+    """Why a job of ``size`` bytes is not admitted to a queue in this state, or None if it is."""
+    if depth >= max_depth:
+        return f"Queue is full ({max_depth} jobs waiting)."
+    if depth and queued_bytes + size > max_bytes:
+        return f"Queue byte budget exceeded ({max_bytes} bytes waiting)."
+    return None
+
+
+class QueueFull(Exception):
+    """Admission refused; ``retry_after`` is a hint in whole seconds."""
+
+    def __init__(self, reason: str, retry_after: int):
+        super().__init__(reason)
+        self.retry_after = retry_after
+
+
+@dataclass
+class _Entry:
+    job: Dict[str, Any]
+    size: int
+    priority: int
+    seq: int
+    enqueued: float = field(default_factory=time.monotonic)
+
+
+class JobScheduler:
+    """Job queue ordered by priority, then shortest job first, with admission control.
+
+    Drop-in replacement for the FIFO ``asyncio.Queue`` (``put``/``get``/
+    ``task_done``/``join``). Higher ``priority`` runs first; within a priority
+    the smallest input runs first, except that any job that has waited longer
+    than ``starvation_seconds`` jumps ahead (by priority, then arrival), so
+    large jobs are delayed but never starved. ``put`` decides admission and
+    queues the job in one step under the scheduler's lock, raising
+    ``QueueFull`` when the queue already holds ``max_depth`` jobs or
+    ``max_bytes`` of input (a job larger than the whole budget is still
+    admitted into an empty queue).
+    """
+
+    def __init__(
+        self,
+        max_depth: int = DEFAULT_MAX_DEPTH,
+        max_bytes: int = DEFAULT_MAX_BYTES,
+        starvation_seconds: float = DEFAULT_STARVATION_SECONDS
+    ):
+        self.max_depth = max_depth
+        self.max_bytes = max_bytes
+        self.starvation_seconds = starvation_seconds
+        self._entries: List[_Entry] = []
+        self._bytes = 0
+        self._seq = 0
+        self._unfinished = 0
+        self._getters: Deque[asyncio.Future] = deque()
+        self._joiners: List[asyncio.Future] = []
+        self._waits: Deque[float] = deque(maxlen=WAIT_SAMPLES)
+        self._lock = threading.Lock()
+        self.admitted = 0
+        self.rejected = 0
+
+    def put_nowait(
+        self,
+        job: Dict[str, Any],
+        size: int = 0,
+        priority: int = 0,
+        on_admit: Optional[Callable[[], None]] = None
+    ) -> None:
+        """Admit and queue a job, or raise ``QueueFull``.
+
+        ``on_admit`` runs once the job is admitted, before any worker can
+        get it; it is where the caller records the job.
+        """
+        with self._lock:
+            reason = refusal(len(self._entries), self._bytes, size, self.max_depth, self.max_bytes)
+            if reason is None:
+                if on_admit is not None:
+                    on_admit()
+                self._seq += 1
+                self._entries.append(_Entry(job=job, size=size, priority=priority, seq=self._seq))
+                self._bytes += size
+                self._unfinished += 1
+                self.admitted += 1
+        if reason is not None:
+            self._reject(reason)
+        self._wakeup_next_getter()
+
+    async def put(
+        self,
+        job: Dict[str, Any],
+        size: int = 0,
+        priority: int = 0,
+        on_admit: Optional[Callable[[], None]] = None
+    ) -> None:
+        self.put_nowait(job, size=size, priority=priority, on_admit=on_admit)
+
+    async def get(self) -> Dict[str, Any]:
+        while not self._entries:
+            getter = asyncio.get_running_loop().create_future()
+            self._getters.append(getter)
+            try:
+                await getter
+            except asyncio.CancelledError:
+                getter.cancel()
+                try:
+                    self._getters.remove(getter)
+                except ValueError:
+                    pass
+                # This getter was woken but will not take the entry; pass the wakeup on
+                if self._entries and not getter.cancelled():
+                    self._wakeup_next_getter()
+                raise
+        return self.get_nowait()
+
+    def get_nowait(self) -> Dict[str, Any]:
+        if not self._entries:
+            raise asyncio.QueueEmpty
+        now = time.monotonic()
+        with self._lock:
+            entry = min(self._entries, key=lambda e: self._rank(e, now))
+            self._entries.remove(entry)
+            self._bytes -= entry.size
+        self._waits.append(now - entry.enqueued)
+        return entry.job
+
+    async def complete(self, job: Optional[Dict[str, Any]] = None) -> None:
+        """``task_done`` as a coroutine, as ``SpoolQueue`` needs it on an event loop."""
+        self.task_done(job)
+
+    def task_done(self, job: Optional[Dict[str, Any]] = None) -> None:
+        """Mark a job from ``get`` as completed; ``job`` is only needed by ``SpoolQueue``."""
+        if self._unfinished <= 0:
+            raise ValueError("task_done() called too many times")
+        self._unfinished -= 1
+        if self._unfinished == 0:
+            self._wakeup_joiners()
+
+    async def join(self) -> None:
+        if self._unfinished:
+            joiner = asyncio.get_running_loop().create_future()
+            self._joiners.append(joiner)
+            await joiner
+
+    def qsize(self) -> int:
+        return len(self._entries)
+
+    def empty(self) -> bool:
+        return not self._entries
+
+    def stats(self) -> Dict[str, Any]:
+        now = time.monotonic()
+        waits = sorted(self._waits)
+        return {
+            "depth": len(self._entries),
+            "queued_bytes": self._bytes,
+            "in_progress": self._unfinished - len(self._entries),
+            "max_depth": self.max_depth,
+            "max_bytes": self.max_bytes,
+            "admitted": self.admitted,
+            "rejected": self.rejected,
+            "oldest_wait_seconds": max((now - e.enqueued for e in self._entries), default=0.0),
+            "mean_wait_seconds": sum(waits) / len(waits) if waits else 0.0,
+            "p95_wait_seconds": waits[int(0.95 * (len(waits) - 1))] if waits else 0.0,
+        }
+
+    def clear(self) -> None:
+        self._entries.clear()
+        self._bytes = 0
+        self._unfinished = 0
+        self._wakeup_joiners()
+
+    def _wakeup_next_getter(self) -> None:
+        while self._getters:
+            getter = self._getters.popleft()
+            if not getter.done():
+                getter.set_result(None)
+                break
+
+    def _wakeup_joiners(self) -> None:
+        for joiner in self._joiners:
+            if not joiner.done():
+                joiner.set_result(None)
+        self._joiners.clear()
+
+    def _rank(self, entry: _Entry, now: float):
+        starved = now - entry.enqueued >= self.starvation_seconds
+        if starved:
+            return (0, -entry.priority, 0, entry.seq)
+        return (1, -entry.priority, entry.size, entry.seq)
+
+    def _reject(self, reason: str) -> None:
+        self.rejected += 1
+        raise QueueFull(reason, self._retry_after())
+
+    def _retry_after(self) -> int:
+        # Recent mean wait is a fair guess at how long until a slot frees up
+        mean_wait = sum(self._waits) / len(self._waits) if self._waits else 1.0
+        return max(1, min(300, math.ceil(mean_wait)))
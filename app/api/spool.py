@@ -0,0 +1,302 @@
+"""
+Durable job queue shared between processes
+
+``SpoolQueue`` keeps queued jobs in a SQLite file, so the API can enqueue
+and worker daemons on other processes (or other hosts sharing the
+filesystem) can claim them. A claimed job is leased to its worker for
+``SPOOL_LEASE_SECONDS`` and the lease is renewed by a heartbeat while the
+job runs. When a worker dies, its lease runs out and the job is delivered
+again; after ``SPOOL_MAX_DELIVERIES`` deliveries the worker records it as
+failed instead of running it once more. It orders jobs like
+``JobScheduler``: starved jobs first, then priority, then smallest input.
+Admission is decided in the same transaction that inserts the job.
+"""
+import asyncio
+import json
+import math
+import os
+import socket
+import sqlite3
+import time
+import uuid
+from threading import Lock
+from typing import Any, Callable, Dict, Optional, Tuple, Union
+from app.api.scheduler import (
+    DEFAULT_MAX_BYTES, DEFAULT_MAX_DEPTH, DEFAULT_STARVATION_SECONDS, JobScheduler, QueueFull, refusal
+)
+from app.utils.logger import Logger
+
+JOB_QUEUES = ("memory", "spool")
+DEFAULT_JOB_QUEUE = os.getenv("JOB_QUEUE", "memory")
+DEFAULT_SPOOL_PATH = os.getenv(
+    "SPOOL_PATH", os.path.abspath(os.path.join(os.path.dirname(__file__), '../../spool.sqlite3'))
+)
+DEFAULT_LEASE_SECONDS = float(os.getenv("SPOOL_LEASE_SECONDS", 30))
+# How often an idle worker looks for new jobs
+DEFAULT_POLL_INTERVAL = float(os.getenv("SPOOL_POLL_INTERVAL", 0.2))
+MAX_DELIVERIES = int(os.getenv("SPOOL_MAX_DELIVERIES", 3))
+
+
+class SpoolQueue:
+    """Job queue in a SQLite file with leased claims.
+
+    Offers the ``JobScheduler`` methods the API and workers use; ``get``
+    polls every ``poll_interval`` seconds while the spool is empty. The job
+    returned by ``get`` carries its ``deliveries`` count, and must be passed
+    back to ``complete`` (or ``task_done``) to remove it from the spool. The
+    coroutines run their SQLite work, which may wait on other processes'
+    locks, in a thread so the event loop is not blocked.
+    """
+
+    def __init__(
+        self,
+        path: str = DEFAULT_SPOOL_PATH,
+        max_depth: int = DEFAULT_MAX_DEPTH,
+        max_bytes: int = DEFAULT_MAX_BYTES,
+        starvation_seconds: float = DEFAULT_STARVATION_SECONDS,
+        lease_seconds: float = DEFAULT_LEASE_SECONDS,
+        poll_interval: float = DEFAULT_POLL_INTERVAL,
+        logger: Optional[Logger] = None
+    ):
+        self.path = path
+        self.max_depth = max_depth
+        self.max_bytes = max_bytes
+        self.starvation_seconds = starvation_seconds
+        self.lease_seconds = lease_seconds
+        self.poll_interval = poll_interval
+        self.logger = logger or Logger()
+        self.owner = f"{socket.gethostname()}:{os.getpid()}:{uuid.uuid4().hex[:8]}"
+        self.admitted = 0
+        self.rejected = 0
+        # job_id -> (spool row, heartbeat task) of the jobs this process holds
+        self._leases: Dict[str, Tuple[int, Optional[asyncio.Task]]] = {}
+        self._lock = Lock()
+        os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+        self._conn = sqlite3.connect(path, check_same_thread=False, isolation_level=None, timeout=30)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("PRAGMA synchronous=NORMAL")
+        self._conn.executescript(
+            """
+            CREATE TABLE IF NOT EXISTS spool (
+                seq INTEGER PRIMARY KEY AUTOINCREMENT,
+                job_id TEXT NOT NULL,
+                job TEXT NOT NULL,
+                size INTEGER NOT NULL,
+                priority INTEGER NOT NULL,
+                enqueued REAL NOT NULL,
+                deliveries INTEGER NOT NULL DEFAULT 0,
+                owner TEXT,
+                lease_until REAL,
+                claimed REAL
+            );
+            CREATE INDEX IF NOT EXISTS spool_lease ON spool (lease_until);
+            """
+        )
+
+    def put_nowait(
+        self,
+        job: Dict[str, Any],
+        size: int = 0,
+        priority: int = 0,
+        on_admit: Optional[Callable[[], None]] = None
+    ) -> None:
+        """Admit and queue a job, or raise ``QueueFull``; see ``JobScheduler.put_nowait``."""
+        with self._lock:
+            self._conn.execute("BEGIN IMMEDIATE")
+            try:
+                now = time.time()
+                depth, queued_bytes = self._conn.execute(
+                    "SELECT COUNT(*), COALESCE(SUM(size), 0) FROM spool WHERE lease_until IS NULL OR lease_until < ?",
+                    (now,),
+                ).fetchone()
+                reason = refusal(depth, queued_bytes, size, self.max_depth, self.max_bytes)
+                if reason is None:
+                    if on_admit is not None:
+                        on_admit()
+                    # Not visible to other workers until the commit, so after on_admit
+                    self._conn.execute(
+                        "INSERT INTO spool (job_id, job, size, priority, enqueued) VALUES (?, ?, ?, ?, ?)",
+                        (job["job_id"], json.dumps(job), size, priority, now),
+                    )
+                self._conn.execute("COMMIT")
+            except BaseException:
+                self._conn.execute("ROLLBACK")
+                raise
+        if reason is not None:
+            self._reject(reason)
+        self.admitted += 1
+
+    async def put(
+        self,
+        job: Dict[str, Any],
+        size: int = 0,
+        priority: int = 0,
+        on_admit: Optional[Callable[[], None]] = None
+    ) -> None:
+        await asyncio.to_thread(self.put_nowait, job, size, priority, on_admit)
+
+    async def get(self) -> Dict[str, Any]:
+        while True:
+            claimed = await asyncio.to_thread(self._claim)
+            if claimed is not None:
+                return self._lease(*claimed)
+            await asyncio.sleep(self.poll_interval)
+
+    def get_nowait(self) -> Dict[str, Any]:
+        """Claim the next job; its lease is kept alive while an event loop is running."""
+        claimed = self._claim()
+        if claimed is None:
+            raise asyncio.QueueEmpty
+        return self._lease(*claimed)
+
+    def task_done(self, job: Optional[Dict[str, Any]] = None) -> None:
+        self._delete(self._release_lease(job))
+
+    async def complete(self, job: Optional[Dict[str, Any]] = None) -> None:
+        """``task_done`` for workers on an event loop."""
+        await asyncio.to_thread(self._delete, self._release_lease(job))
+
+    def release_all(self) -> None:
+        """Give up this process's leases so their jobs are delivered again right away."""
+        for seq, heartbeat in self._leases.values():
+            if heartbeat is not None:
+                heartbeat.cancel()
+            with self._lock:
+                self._conn.execute(
+                    "UPDATE spool SET owner = NULL, lease_until = NULL WHERE seq = ? AND owner = ?", (seq, self.owner)
+                )
+        self._leases.clear()
+
+    async def join(self) -> None:
+        """Wait until every job in the spool, from any process, has been completed."""
+        while await asyncio.to_thread(self._remaining):
+            await asyncio.sleep(self.poll_interval)
+
+    def qsize(self) -> int:
+        return self._queued()[0]
+
+    def empty(self) -> bool:
+        return self.qsize() == 0
+
+    def stats(self) -> Dict[str, Any]:
+        now = time.time()
+        depth, queued_bytes = self._queued(now)
+        with self._lock:
+            oldest = self._conn.execute(
+                "SELECT MIN(enqueued) FROM spool WHERE lease_until IS NULL OR lease_until < ?", (now,)
+            ).fetchone()[0]
+            waits = sorted(w for (w,) in self._conn.execute(
+                "SELECT claimed - enqueued FROM spool WHERE lease_until >= ?", (now,)
+            ))
+        return {
+            "depth": depth,
+            "queued_bytes": queued_bytes,
+            "in_progress": len(waits),
+            "max_depth": self.max_depth,
+            "max_bytes": self.max_bytes,
+            "admitted": self.admitted,
+            "rejected": self.rejected,
+            "oldest_wait_seconds": now - oldest if oldest is not None else 0.0,
+            "mean_wait_seconds": sum(waits) / len(waits) if waits else 0.0,
+            "p95_wait_seconds": waits[int(0.95 * (len(waits) - 1))] if waits else 0.0,
+        }
+
+    def clear(self) -> None:
+        for _, heartbeat in self._leases.values():
+            if heartbeat is not None:
+                heartbeat.cancel()
+        self._leases.clear()
+        with self._lock:
+            self._conn.execute("DELETE FROM spool")
+
+    def close(self) -> None:
+        self.release_all()
+        with self._lock:
+            self._conn.close()
+
+    def _claim(self) -> Optional[Tuple[int, Dict[str, Any]]]:
+        now = time.time()
+        starved = now - self.starvation_seconds
+        with self._lock:
+            self._conn.execute("BEGIN IMMEDIATE")
+            try:
+                row = self._conn.execute(
+                    "SELECT seq, job, deliveries FROM spool WHERE lease_until IS NULL OR lease_until < ? "
+                    "ORDER BY enqueued > ?, -priority, CASE WHEN enqueued > ? THEN size ELSE 0 END, seq LIMIT 1",
+                    (now, starved, starved),
+                ).fetchone()
+                if row is not None:
+                    self._conn.execute(
+                        "UPDATE spool SET owner = ?, lease_until = ?, claimed = ?, deliveries = deliveries + 1 WHERE seq = ?",
+                        (self.owner, now + self.lease_seconds, now, row[0]),
+                    )
+                self._conn.execute("COMMIT")
+            except BaseException:
+                self._conn.execute("ROLLBACK")
+                raise
+        if row is None:
+            return None
+        seq, job, deliveries = row
+        return seq, {**json.loads(job), "deliveries": deliveries + 1}
+
+    def _lease(self, seq: int, job: Dict[str, Any]) -> Dict[str, Any]:
+        """Record a claimed job as held, renewing its lease while an event loop is running."""
+        try:
+            heartbeat = asyncio.get_running_loop().create_task(self._heartbeat(seq))
+        except RuntimeError:
+            heartbeat = None
+        self._leases[job["job_id"]] = (seq, heartbeat)
+        return job
+
+    def _release_lease(self, job: Optional[Dict[str, Any]]) -> int:
+        if job is None or job["job_id"] not in self._leases:
+            raise ValueError("task_done() needs a job claimed from this spool")
+        seq, heartbeat = self._leases.pop(job["job_id"])
+        if heartbeat is not None:
+            heartbeat.cancel()
+        return seq
+
+    def _delete(self, seq: int) -> None:
+        with self._lock:
+            self._conn.execute("DELETE FROM spool WHERE seq = ? AND owner = ?", (seq, self.owner))
+
+    def _remaining(self) -> int:
+        with self._lock:
+            return self._conn.execute("SELECT COUNT(*) FROM spool").fetchone()[0]
+
+    def _renew(self, seq: int) -> bool:
+        with self._lock:
+            return self._conn.execute(
+                "UPDATE spool SET lease_until = ? WHERE seq = ? AND owner = ?",
+                (time.time() + self.lease_seconds, seq, self.owner),
+            ).rowcount > 0
+
+    async def _heartbeat(self, seq: int) -> None:
+        while True:
+            await asyncio.sleep(self.lease_seconds / 3)
+            if not await asyncio.to_thread(self._renew, seq):
+                # Held up past the lease; another worker may be running the job too
+                self.logger.warning("Lost the spool lease on entry %s.", seq)
+                return
+
+    def _queued(self, now: Optional[float] = None) -> Tuple[int, int]:
+        with self._lock:
+            depth, queued_bytes = self._conn.execute(
+                "SELECT COUNT(*), COALESCE(SUM(size), 0) FROM spool WHERE lease_until IS NULL OR lease_until < ?",
+                (now or time.time(),),
+            ).fetchone()
+        return depth, queued_bytes
+
+    def _reject(self, reason: str) -> None:
+        self.rejected += 1
+        with self._lock:
+            mean_wait = self._conn.execute("SELECT AVG(claimed - enqueued) FROM spool WHERE claimed IS NOT NULL").fetchone()[0]
+        raise QueueFull(reason, max(1, min(300, math.ceil(mean_wait or 1.0))))
+
+
+def create_job_queue(kind: str = DEFAULT_JOB_QUEUE, path: str = DEFAULT_SPOOL_PATH) -> Union[JobScheduler, SpoolQueue]:
+    if kind == "memory":
+        return JobScheduler()
+    if kind == "spool":
+        return SpoolQueue(path)
+    raise ValueError(f"Unknown job queue '{kind}', expected one of {JOB_QUEUES}")
@@ -1,12 +1,24 @@
 # Global state for jobs and queue
-import asyncio
-from typing import Dict, Any
+import os
 from enum import Enum
+from app.api.job_events import JobEvents
+from app.api.job_store import JobStore, create_job_store
+from app.api.spool import create_job_queue
+from app.service.reader_service import OUTPUT_DIR
+from app.service.result_cache import ResultCache
 
-jobs: Dict[str, Dict[str, Any]] = {}
-job_queue: asyncio.Queue = asyncio.Queue()
-# Track all used job IDs to prevent reuse
-used_job_ids = set()
+# Job records, in memory or in SQLite depending on JOB_STORE
+jobs: JobStore = create_job_store()
+# Priority / shortest-job-first queue with admission control, in memory or in a
+# SQLite spool shared with worker daemons depending on JOB_QUEUE
+job_queue = create_job_queue()
+# Track all used job IDs to prevent reuse, including IDs of evicted jobs
+used_job_ids = jobs.used_ids
+# Wakes status streams and long polls when a job record changes
+job_events = JobEvents()
+jobs.listeners.append(job_events.notify)
+# Finished results keyed by upload content hash, shared by all workers
+result_cache = ResultCache(os.path.join(OUTPUT_DIR, "cache"))
 
 class JobStatus(str, Enum):
     WAITING = "WAITING"
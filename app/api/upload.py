@@ -0,0 +1,146 @@
+import asyncio
+import csv
+import io
+import os
+import time
+from dataclasses import dataclass
+from typing import BinaryIO, List, Optional, Set
+from fastapi import UploadFile
+from app.service.compression import MAGIC_BYTES, check_supported, decompress_head, detect_compression, open_decompressed
+from app.service.datasets import PrefixHashes
+from app.utils.metrics import observe_stage
+
+REQUIRED_COLUMNS = {"Department Name", "Date", "Number of Sales"}
+DEFAULT_CHUNK_SIZE = int(os.getenv("UPLOAD_CHUNK_SIZE", 1024 * 1024))
+# A header line longer than this is treated as malformed
+MAX_HEADER_BYTES = 64 * 1024
+# Compressed bytes read to find the header (bz2 emits nothing before a whole block)
+MAX_COMPRESSED_HEADER_BYTES = 2 * 1024 * 1024
+
+
+class UploadRejected(Exception):
+    """The upload failed validation; nothing was written to the destination."""
+
+
+@dataclass
+class UploadResult:
+    path: str
+    size: int
+    fingerprint: str
+    columns: List[str]
+    # Stored as uploaded; None for plain CSV
+    compression: Optional[str] = None
+    # For plain CSV: SHA-256 of the first ``prefix_offset`` bytes (None if shorter),
+    # and of the bytes up to the end of the last complete record
+    prefix_sha256: Optional[str] = None
+    records_end: Optional[int] = None
+    records_sha256: Optional[str] = None
+
+
+def parse_header(data: bytes) -> List[str]:
+    """Column names from the first line of ``data`` (which must contain a full line)."""
+    line = data.split(b"\n", 1)[0].rstrip(b"\r")
+    try:
+        text = line.decode("utf-8-sig")
+    except UnicodeDecodeError as e:
+        raise UploadRejected(f"CSV header is not valid UTF-8: {e}")
+    return next(csv.reader(io.StringIO(text)), [])
+
+
+def read_file_header(path: str) -> List[str]:
+    """Column names of a CSV already on disk (plain or compressed), reading only its first line."""
+    with open(path, "rb") as f:
+        compression = detect_compression(f.read(MAGIC_BYTES))
+    try:
+        with open_decompressed(path, compression) as f:
+            head = f.read(MAX_HEADER_BYTES)
+    except (OSError, EOFError, ValueError) as e:
+        raise UploadRejected(f"Cannot read compressed CSV: {e}")
+    if b"\n" not in head and len(head) >= MAX_HEADER_BYTES:
+        raise UploadRejected("CSV header line is too long.")
+    return parse_header(head)
+
+
+def check_required_columns(columns: List[str], required: Set[str] = REQUIRED_COLUMNS) -> None:
+    missing = required - set(columns)
+    if missing:
+        raise UploadRejected(f"Missing required columns: {', '.join(sorted(missing))}")
+
+
+async def stream_upload(
+    upload: UploadFile,
+    dest_path: str,
+    chunk_size: int = DEFAULT_CHUNK_SIZE,
+    required_columns: Set[str] = REQUIRED_COLUMNS,
+    prefix_offset: Optional[int] = None
+) -> UploadResult:
+    """Copy ``upload`` to ``dest_path`` chunk by chunk without blocking the event loop.
+
+    The header is validated from the first chunk(s) before the destination is
+    created, so a bad file is rejected without writing anything. gzip, zstd
+    and bz2 uploads are recognised by their magic bytes and stored as they
+    are; their header is found by decompressing just the start. The body is
+    hashed as it is written; the file only appears at ``dest_path`` once it is
+    complete. The same pass hashes the prefixes an incremental dataset job
+    checks (see ``app.service.datasets``).
+    """
+    head = b""
+    text = b""
+    compression = None
+    eof = False
+    while b"\n" not in text and len(text) < MAX_HEADER_BYTES:
+        chunk = await upload.read(chunk_size)
+        if not chunk:
+            eof = True
+        head += chunk
+        if len(head) < MAGIC_BYTES and not eof:
+            continue
+        compression = detect_compression(head)
+        if compression is None:
+            text = head
+        else:
+            if len(head) > MAX_COMPRESSED_HEADER_BYTES:
+                break
+            try:
+                check_supported(compression)
+                text = await asyncio.to_thread(decompress_head, head, compression, MAX_HEADER_BYTES)
+            except ValueError as e:
+                raise UploadRejected(str(e))
+        if eof:
+            break
+    validation_start = time.perf_counter()
+    if b"\n" not in text and (len(text) >= MAX_HEADER_BYTES or len(head) > MAX_COMPRESSED_HEADER_BYTES):
+        raise UploadRejected("CSV header line is too long.")
+    columns = parse_header(text)
+    check_required_columns(columns, required_columns)
+    observe_stage("header_validation", time.perf_counter() - validation_start)
+
+    hasher = PrefixHashes(prefix_offset)
+    part_path = dest_path + ".part"
+    buffer = await asyncio.to_thread(open, part_path, "wb")
+    size = 0
+    try:
+        chunk = head
+        while chunk:
+            await asyncio.to_thread(_write_chunk, buffer, hasher, chunk)
+            size += len(chunk)
+            chunk = await upload.read(chunk_size)
+        await asyncio.to_thread(buffer.close)
+        await asyncio.to_thread(os.replace, part_path, dest_path)
+    except BaseException:
+        buffer.close()
+        if os.path.exists(part_path):
+            os.remove(part_path)
+        raise
+    result = UploadResult(path=dest_path, size=size, fingerprint=hasher.hexdigest(), columns=columns, compression=compression)
+    if compression is None:
+        result.prefix_sha256 = hasher.prefix_sha256
+        result.records_end = hasher.records_end
+        result.records_sha256 = hasher.records_sha256
+    return result
+
+
+def _write_chunk(buffer: BinaryIO, hasher, chunk: bytes) -> None:
+    # hashlib releases the GIL for large buffers, so both run off the loop
+    hasher.update(chunk)
+    buffer.write(chunk)
@@ -1,46 +1,161 @@
-from app.api.state import jobs, job_queue, JobStatus
-from app.service.reader_service import AsyncCSVReaderService
+from app.api.spool import MAX_DELIVERIES
+from app.api.state import jobs, job_queue, JobStatus, result_cache
+from app.service.datasets import Dataset
+from app.service.query import QuerySpec
+from app.service.reader_service import AsyncCSVReaderService, OUTPUT_DIR, new_result_path
+from app.service.result_formats import OutputOptions
+from app.service.retry import is_retryable
 import os
-from app.utils.logger import Logger
+from app.utils.logger import Logger, log_context
+from app.utils.metrics import ACTIVE_WORKERS, JOB_SECONDS, JOBS_TOTAL, JobTrace, record_first_result
 import time
-import polars as pl
 
-async def worker(logger=None):
+def _shard_status_updater(job_id, shard_root):
+    def update(path, status, error=None):
+        record = jobs.get(job_id)
+        if record is None:
+            return
+        shards = record["shards"]
+        shards[os.path.relpath(path, shard_root)] = {"status": JobStatus(status), "error": error}
+        jobs.update(job_id, shards=shards)
+    return update
+
+def _progress_updater(job_id, start):
+    def update(done, total):
+        # Linear estimate from the bytes completed so far
+        eta = (time.time() - start) * (total - done) / done if done else None
+        progress = {"bytes_done": done, "bytes_total": total, "eta_seconds": eta}
+        try:
+            jobs.update(job_id, progress=progress)
+        except KeyError:
+            pass  # Cleared or evicted while running
+    return update
+
+def _record_job(trace, status, seconds):
+    trace.publish()
+    JOBS_TOTAL.inc(status=status)
+    JOB_SECONDS.observe(seconds, status=status)
+    if status == "FINISHED":
+        first = record_first_result()
+        if first is not None:
+            Logger().info("First result %.2fs after process start.", first)
+
+async def worker(logger=None, queue=None):
     logger = logger or Logger()
+    queue = queue or job_queue
     while True:
-        job = await job_queue.get()
-        job_id = job["job_id"]
-        file_path = job["file_path"]
-        try:
-            logger.info(f"Worker started job {job_id} for file {file_path}")
-            # Validate CSV columns before processing
-            required_columns = {"Department Name", "Date", "Number of Sales"}
+        job = await queue.get()
+        with log_context(job_id=job["job_id"]):
+            await _run_job(job, logger)
+        # Not reached when the worker is cancelled mid-job: a spooled job then stays
+        # leased to this process until it is released or the lease expires
+        await queue.complete(job)
+        logger.debug("Worker marked job %s as done in queue.", job["job_id"])
+
+async def _run_job(job, logger):
+    job_id = job["job_id"]
+    file_path = job.get("file_path")
+    file_paths = job.get("file_paths")
+    fingerprint = job.get("fingerprint")
+    trace = JobTrace()
+    start = time.time()
+    if job.get("deliveries", 1) > MAX_DELIVERIES:
+        # Every earlier delivery ended with its worker gone before the job finished
+        error = f"Job abandoned by {job['deliveries'] - 1} workers; not retried again."
+        logger.error("Worker gave up on job %s: %s", job_id, error)
+        if job_id in jobs:
+            jobs.update(job_id, status=JobStatus.FAILED, error=error)
+        _record_job(trace, "FAILED", 0.0)
+        return
+    if job.get("queued_at"):
+        trace.add_stage("queue_wait", max(0.0, start - job["queued_at"]))
+    ACTIVE_WORKERS.inc()
+    try:
+        logger.info("Worker started job %s for file %s", job_id, file_path or file_paths)
+        output = OutputOptions(**job.get("output", {}))
+        query = QuerySpec.model_validate(job.get("query", {}))
+        # The same input queried differently or written in another format is a different cache entry
+        cache_spec = {**query.to_dict(), "output": output.to_dict()}
+        if fingerprint:
+            with trace.stage("cache_lookup"):
+                cached_path = result_cache.get(fingerprint, cache_spec, new_result_path(OUTPUT_DIR, output.extension))
+            if cached_path:
+                now = time.time()
+                jobs.update(
+                    job_id,
+                    status=JobStatus.FINISHED,
+                    result=cached_path,
+                    cache_hit=True,
+                    preview=None,
+                    processing_time={"start": now, "end": now},
+                    metrics=trace.to_dict(),
+                )
+                _record_job(trace, "FINISHED", 0.0)
+                logger.info("Worker served job %s from result cache: %s", job_id, cached_path)
+                return
+        # Columns were validated from the header when the file was uploaded
+        jobs.update(job_id, status=JobStatus.STARTED, processing_time={"start": start, "end": None})
+        service = AsyncCSVReaderService(logger=logger, trace=trace, output=output, query=query)
+        with trace.stage("aggregate"):
+            if job.get("dataset"):
+                result_path = await service.aggregate_dataset(
+                    file_path,
+                    Dataset(job["dataset"]),
+                    OUTPUT_DIR,
+                    prefix=tuple(job["prefix"]) if job.get("prefix") else None,
+                    records=tuple(job["records"]) if job.get("records") else None,
+                    on_progress=_progress_updater(job_id, start)
+                )
+            elif file_paths:
+                result_path = await service.aggregate_sales_by_department_batch(
+                    file_paths,
+                    OUTPUT_DIR,
+                    on_shard_status=_shard_status_updater(job_id, job["shard_root"]),
+                    on_progress=_progress_updater(job_id, start)
+                )
+            else:
+                result_path = await service.aggregate_sales_by_department(
+                    file_path, OUTPUT_DIR, on_progress=_progress_updater(job_id, start), fingerprint=fingerprint
+                )
+        if fingerprint:
             try:
-                df = pl.read_csv(file_path, n_rows=0)
-                csv_columns = set(df.columns)
-                missing = required_columns - csv_columns
-                if missing:
-                    raise ValueError(f"Missing required columns: {', '.join(missing)}")
-            except Exception as e:
-                logger.error(f"Validation failed for job {job_id}: {e}")
-                jobs[job_id]["status"] = JobStatus.FAILED
-                jobs[job_id]["error"] = f"CSV validation error: {e}"
-                continue
-                
-            jobs[job_id]["status"] = JobStatus.STARTED
-            jobs[job_id]["processing_time"] = {"start": time.time(), "end": None}
-            service = AsyncCSVReaderService(logger=logger)
-            result_path = await service.aggregate_sales_by_department(file_path)
-            jobs[job_id]["status"] = JobStatus.FINISHED
-            jobs[job_id]["result"] = result_path
-            jobs[job_id]["processing_time"]["end"] = time.time()
-            logger.info(f"Worker finished job {job_id}, result at {result_path}")
-        except Exception as e:
-            jobs[job_id]["status"] = JobStatus.FAILED
-            jobs[job_id]["error"] = str(e)
-            if "processing_time" in jobs[job_id] and jobs[job_id]["processing_time"]["end"] is None:
-                jobs[job_id]["processing_time"]["end"] = time.time()
-            logger.error(f"Worker failed job {job_id}: {e}")
-        finally:
-            job_queue.task_done()
-            logger.debug(f"Worker marked job {job_id} as done in queue.")
\ No newline at end of file
+                with trace.stage("cache_store"):
+                    result_cache.put(fingerprint, cache_spec, result_path)
+            except OSError as e:
+                logger.warning("Could not cache result for job %s: %s", job_id, e)
+        end = time.time()
+        jobs.update(
+            job_id,
+            status=JobStatus.FINISHED,
+            result=result_path,
+            cache_hit=False,
+            preview=None,
+            processing_time={"start": start, "end": end},
+            metrics=trace.to_dict(),
+        )
+        _record_job(trace, "FINISHED", end - start)
+        logger.info("Worker finished job %s, result at %s", job_id, result_path)
+    except Exception as e:
+        logger.error("Worker failed job %s: %s", job_id, e)
+        _record_job(trace, "FAILED", time.time() - start)
+        record = jobs.get(job_id)
+        if record is None:
+            # Cleared or evicted while running; nothing left to record the failure on
+            return
+        processing_time = record.get("processing_time")
+        if processing_time and processing_time["end"] is None:
+            processing_time["end"] = time.time()
+        try:
+            jobs.update(
+                job_id,
+                status=JobStatus.FAILED,
+                error=str(e),
+                # False when resubmitting the same input and query cannot succeed either
+                retryable=is_retryable(e),
+                processing_time=processing_time,
+                metrics=trace.to_dict(),
+            )
+        except KeyError:
+            logger.warning("Job %s disappeared before its failure could be recorded.", job_id)
+    finally:
+        ACTIVE_WORKERS.dec()
\ No newline at end of file
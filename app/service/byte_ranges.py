@@ -0,0 +1,165 @@
+import os
+from typing import BinaryIO, Iterator, List, Tuple
+
+BLOCK_SIZE = 8 * 1024 * 1024
+
+
+def split_byte_ranges(path: str, num_ranges: int) -> Tuple[bytes, List[Tuple[int, int]]]:
+    """Split a CSV file into at most ``num_ranges`` record-aligned byte ranges.
+
+    Returns the header line (including its newline) and ``(start, end)``
+    offsets covering every data row exactly once. Boundaries always fall just
+    after a newline that is outside a quoted field: the quote parity at each
+    nominal cut point is derived from a count of quote characters before it
+    (escaped ``""`` pairs leave the parity unchanged), and the cut is then
+    moved forward to the first record terminator.
+
+    This runs every step in the calling thread; callers with a pool can run
+    ``plan_cuts``, ``count_quotes`` per segment and ``align_cuts`` themselves
+    so the quote count, a full read of the file, is spread across workers.
+    """
+    header, cuts = plan_cuts(path, num_ranges)
+    data_start = len(header)
+    counts = [count_quotes(path, a, b) for a, b in zip([data_start] + cuts, cuts)]
+    return header, align_cuts(path, data_start, cuts, counts)
+
+
+def plan_cuts(path: str, num_ranges: int) -> Tuple[bytes, List[int]]:
+    """Header line and the evenly spaced nominal cut points after it."""
+    size = os.path.getsize(path)
+    with open(path, "rb") as f:
+        data_start = _next_record_start(f, 0, in_quotes=False, limit=size)
+        f.seek(0)
+        header = f.read(data_start)
+    if num_ranges <= 1 or size - data_start <= num_ranges:
+        return header, []
+    step = (size - data_start) // num_ranges
+    return header, [data_start + i * step for i in range(1, num_ranges)]
+
+
+def count_quotes(path: str, start: int, end: int) -> int:
+    with open(path, "rb") as f:
+        return _count_quotes(f, start, end)
+
+
+def align_cuts(path: str, data_start: int, cuts: List[int], quote_counts: List[int]) -> List[Tuple[int, int]]:
+    """Move each cut to the next record start; ``quote_counts[i]`` covers the segment ending at ``cuts[i]``."""
+    size = os.path.getsize(path)
+    boundaries = [data_start]
+    quotes = 0
+    with open(path, "rb") as f:
+        for cut, count in zip(cuts, quote_counts):
+            quotes += count
+            boundary = _next_record_start(f, cut, in_quotes=quotes % 2 == 1, limit=size)
+            if boundary > boundaries[-1]:
+                boundaries.append(boundary)
+    if boundaries[-1] < size:
+        boundaries.append(size)
+    return [(a, b) for a, b in zip(boundaries, boundaries[1:]) if b > a]
+
+
+def read_range(path: str, start: int, end: int) -> bytes:
+    with open(path, "rb") as f:
+        f.seek(start)
+        return f.read(end - start)
+
+
+def iter_record_blocks(path: str, start: int, end: int, block_size: int = BLOCK_SIZE) -> Iterator[bytes]:
+    """Yield the records in ``[start, end)`` as blocks of about ``block_size`` bytes.
+
+    ``start`` must be a record boundary. Each block ends on a record
+    terminator, so every block parses on its own once the header is prepended.
+    """
+    with open(path, "rb") as f:
+        position = start
+        while position < end:
+            f.seek(position)
+            block = f.read(min(block_size, end - position))
+            if not block:
+                break
+            tail_start = position + len(block)
+            if tail_start < end:
+                boundary = _next_record_start(f, tail_start, in_quotes=block.count(b'"') % 2 == 1, limit=end)
+                f.seek(tail_start)
+                block += f.read(boundary - tail_start)
+            yield block
+            position += len(block)
+
+
+def iter_stream_blocks(stream: BinaryIO, block_size: int = BLOCK_SIZE) -> Iterator[bytes]:
+    """Yield a forward-only stream (header included) as record-aligned blocks of about ``block_size`` bytes.
+
+    Used where offsets cannot be seeked to, such as decompressed input. A
+    record longer than a block is carried into the next read.
+    """
+    pending = b""
+    while True:
+        chunk = stream.read(block_size)
+        if not chunk:
+            break
+        data = pending + chunk if pending else chunk
+        end = _last_record_end(data)
+        if end:
+            yield data[:end]
+        pending = data[end:]
+    if pending:
+        yield pending
+
+
+def _last_record_end(data: bytes) -> int:
+    """Offset just past the last newline in ``data`` outside quotes, or 0; ``data`` starts at a record."""
+    total = data.count(b'"')
+    after = 0
+    end = len(data)
+    while True:
+        newline = data.rfind(b"\n", 0, end)
+        if newline == -1:
+            return 0
+        after += data.count(b'"', newline, end)
+        if (total - after) % 2 == 0:
+            return newline + 1
+        end = newline
+
+
+def _count_quotes(f, start: int, end: int) -> int:
+    f.seek(start)
+    count = 0
+    remaining = end - start
+    while remaining > 0:
+        block = f.read(min(BLOCK_SIZE, remaining))
+        if not block:
+            break
+        count += block.count(b'"')
+        remaining -= len(block)
+    return count
+
+
+def _next_record_start(f, offset: int, in_quotes: bool, limit: int) -> int:
+    """Offset just past the first newline at or after ``offset`` that ends a record."""
+    f.seek(offset)
+    position = offset
+    while position < limit:
+        block = f.read(min(BLOCK_SIZE, limit - position))
+        if not block:
+            break
+        i = 0
+        newline = -1
+        while True:
+            quote = block.find(b'"', i)
+            if in_quotes:
+                if quote == -1:
+                    break
+                in_quotes = False
+            else:
+                if newline < i:
+                    newline = block.find(b"\n", i)
+                    if newline == -1:
+                        newline = len(block) + 1  # none left in this block
+                if newline < len(block) and (quote == -1 or newline < quote):
+                    return position + newline + 1
+                if quote == -1:
+                    break
+                in_quotes = True
+            i = quote + 1
+        position += len(block)
+    return limit
@@ -0,0 +1,83 @@
+"""
+Checkpoints of partial aggregation state
+
+Work split into pieces (the byte ranges of a large file, the shards of a
+batch) saves each finished piece's per-group partial state as a small
+Arrow IPC file. Checkpoints are keyed by the input's path, size and
+modification time plus the query, so a retry, a re-delivered job or a
+resubmission of the same input picks up the finished pieces instead of
+reading those bytes again, and a changed file never reuses stale state.
+A job removes its checkpoints once its result is written; abandoned ones
+are pruned after ``CSV_CHECKPOINT_MAX_AGE`` seconds.
+"""
+import hashlib
+import json
+import os
+import shutil
+import time
+from typing import Optional, Union
+import polars as pl
+from app.service.query import QuerySpec
+
+DEFAULT_CHECKPOINT_DIR = os.getenv(
+    "CSV_CHECKPOINT_DIR", os.path.abspath(os.path.join(os.path.dirname(__file__), '../../OUTPUT_DIR/checkpoints'))
+)
+# "on" or "off"
+DEFAULT_CHECKPOINTS = os.getenv("CSV_CHECKPOINTS", "on") == "on"
+CHECKPOINT_MAX_AGE = float(os.getenv("CSV_CHECKPOINT_MAX_AGE", 24 * 3600))
+
+
+class Checkpoint:
+    """Finished pieces of one input under one query, stored by byte range."""
+
+    def __init__(self, directory: str):
+        self.directory = directory
+
+    def load(self, start: int, end: int) -> Optional[pl.DataFrame]:
+        try:
+            return pl.read_ipc(self._path(start, end), memory_map=False)
+        except (OSError, pl.exceptions.ComputeError):
+            return None
+
+    def save(self, start: int, end: int, partial: pl.DataFrame) -> None:
+        os.makedirs(self.directory, exist_ok=True)
+        path = self._path(start, end)
+        # Written aside and renamed, so a crash never leaves a torn checkpoint
+        partial.write_ipc(path + ".tmp")
+        os.replace(path + ".tmp", path)
+
+    def discard(self) -> None:
+        shutil.rmtree(self.directory, ignore_errors=True)
+
+    def _path(self, start: int, end: int) -> str:
+        return os.path.join(self.directory, f"{start}-{end}.arrow")
+
+
+def checkpoint_for(
+    input_path: Union[str, bytes],
+    query: QuerySpec,
+    root: str = DEFAULT_CHECKPOINT_DIR
+) -> Checkpoint:
+    path = os.path.realpath(os.fsdecode(input_path))
+    stat = os.stat(path)
+    identity = {"path": path, "size": stat.st_size, "mtime_ns": stat.st_mtime_ns, "query": query.to_dict()}
+    key = hashlib.sha256(json.dumps(identity, sort_keys=True).encode()).hexdigest()
+    return Checkpoint(os.path.join(root, key))
+
+
+def prune_checkpoints(root: str = DEFAULT_CHECKPOINT_DIR, max_age: float = CHECKPOINT_MAX_AGE) -> int:
+    """Remove checkpoints untouched for ``max_age`` seconds; returns how many were removed."""
+    cutoff = time.time() - max_age
+    removed = 0
+    try:
+        entries = list(os.scandir(root))
+    except FileNotFoundError:
+        return 0
+    for entry in entries:
+        try:
+            if entry.is_dir() and entry.stat().st_mtime < cutoff:
+                shutil.rmtree(entry.path, ignore_errors=True)
+                removed += 1
+        except OSError:
+            continue
+    return removed
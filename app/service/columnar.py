@@ -0,0 +1,261 @@
+"""
+Persisted columnar copies of CSV inputs
+
+An input aggregated with the Parquet engine (or with any engine when
+``CSV_COLUMNAR_COPIES=always``) keeps its conversion. The copy holds every
+row with "Number of Sales" already cleaned, sorted by date, in Parquet row
+groups of ``COLUMNAR_ROW_GROUP_ROWS`` rows. Its JSON sidecar is a zone map:
+each row group's first and last date and, when there are few of them, its
+departments. Later jobs on the same input (the same content fingerprint,
+when the upload's is known, or else the same path, size and modification
+time) scan the copy instead of parsing the CSV, and read only the row
+groups the query's date and department filters can match. Copies are
+evicted least recently used first once together they exceed
+``COLUMNAR_MAX_BYTES``.
+"""
+import datetime
+import hashlib
+import json
+import os
+import threading
+import time
+from contextlib import contextmanager
+from typing import Any, Dict, List, Optional, Sequence, Tuple, Union, get_args
+import polars as pl
+from app.service.query import Column, Filter, SALES_STATE
+
+try:  # POSIX only; on other platforms the store is only safe within one process
+    import fcntl
+except ImportError:  # pragma: no cover
+    fcntl = None
+
+DEFAULT_COLUMNAR_DIR = os.getenv(
+    "CSV_COLUMNAR_DIR", os.path.abspath(os.path.join(os.path.dirname(__file__), '../../OUTPUT_DIR/columnar'))
+)
+# "off", "on" (the Parquet engine keeps its copies; every engine uses them) or
+# "always" (the streaming engine builds copies too)
+COLUMNAR_MODES = ("off", "on", "always")
+DEFAULT_COLUMNAR = os.getenv("CSV_COLUMNAR_COPIES", "on")
+COLUMNAR_MAX_BYTES = int(os.getenv("CSV_COLUMNAR_MAX_BYTES", 10 * 1024 * 1024 * 1024))
+COLUMNAR_ROW_GROUP_ROWS = int(os.getenv("CSV_COLUMNAR_ROW_GROUP_ROWS", 128 * 1024))
+# Row groups with more distinct departments than this do not list them
+ZONE_MAP_MAX_DEPARTMENTS = 64
+
+DEPARTMENT = "Department Name"
+INDEX_FILE = "index.json"
+LOCK_FILE = ".lock"
+
+
+class ColumnarCopy:
+    """A Parquet copy of one input and the zone map of its row groups."""
+
+    def __init__(self, path: str, zone_map: Dict[str, Any]):
+        self.path = path
+        self.rows = zone_map["rows"]
+        self.row_group_rows = zone_map["row_group_rows"]
+        self.row_groups = zone_map["row_groups"]
+
+    def runs(self, filters: Sequence[Filter]) -> List[Tuple[int, int]]:
+        """``(offset, length)`` row spans of the consecutive row groups ``filters`` may match."""
+        runs: List[Tuple[int, int]] = []
+        for i, group in enumerate(self.row_groups):
+            if not all(_may_match(group, f) for f in filters):
+                continue
+            offset = i * self.row_group_rows
+            length = min(self.row_group_rows, self.rows - offset)
+            if runs and sum(runs[-1]) == offset:
+                runs[-1] = (runs[-1][0], runs[-1][1] + length)
+            else:
+                runs.append((offset, length))
+        return runs
+
+    def scan(self, offset: int = 0, length: Optional[int] = None) -> pl.LazyFrame:
+        # One slice per scan: Polars reads only the row groups a slice covers,
+        # but not once several slices of the same file are concatenated
+        return pl.scan_parquet(self.path, low_memory=True).slice(offset, length)
+
+
+class ColumnarStore:
+    """Directory of columnar copies with a shared LRU index, like ``ResultCache``."""
+
+    def __init__(
+        self,
+        root: str = DEFAULT_COLUMNAR_DIR,
+        max_bytes: int = COLUMNAR_MAX_BYTES,
+        row_group_rows: int = COLUMNAR_ROW_GROUP_ROWS
+    ):
+        self.root = root
+        self.max_bytes = max_bytes
+        self.row_group_rows = row_group_rows
+        self._lock = threading.Lock()
+
+    def get(self, input_path: Union[str, bytes], fingerprint: Optional[str] = None) -> Optional[ColumnarCopy]:
+        """The copy of the input as it is now, or None; see ``_input_key`` for ``fingerprint``."""
+        key = _input_key(input_path, fingerprint)
+        if not os.path.exists(self._path(key, ".json")):
+            # The common miss, answered without taking the lock
+            return None
+        with self._locked() as index:
+            entry = index.get(key)
+            if entry is None:
+                return None
+            try:
+                with open(self._path(key, ".json")) as f:
+                    zone_map = json.load(f)
+                if not os.path.exists(self._path(key, ".parquet")):
+                    raise FileNotFoundError(self._path(key, ".parquet"))
+            except (OSError, json.JSONDecodeError):
+                self._drop(index, key)
+                return None
+            entry["last_access"] = time.time()
+        return ColumnarCopy(self._path(key, ".parquet"), zone_map)
+
+    def build(
+        self, input_path: Union[str, bytes], cleaned: pl.LazyFrame, fingerprint: Optional[str] = None
+    ) -> ColumnarCopy:
+        """Write ``cleaned``, the input's rows with sales cleaned, as the input's copy."""
+        key = _input_key(input_path, fingerprint)
+        os.makedirs(self.root, exist_ok=True)
+        path = self._path(key, ".parquet")
+        tmp_path = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+        try:
+            cleaned.select(*get_args(Column), SALES_STATE).sort("Date", nulls_last=True).sink_parquet(
+                tmp_path, row_group_size=self.row_group_rows, statistics=True
+            )
+            zone_map = self._zone_map(tmp_path)
+            with open(tmp_path + ".json", "w") as f:
+                json.dump(zone_map, f)
+            # Renamed into place so a reader never sees a partial copy
+            os.replace(tmp_path, path)
+            os.replace(tmp_path + ".json", self._path(key, ".json"))
+        finally:
+            for leftover in (tmp_path, tmp_path + ".json"):
+                if os.path.exists(leftover):
+                    os.remove(leftover)
+        with self._locked() as index:
+            now = time.time()
+            index[key] = {"size": os.path.getsize(path), "created": now, "last_access": now}
+            self._evict(index, keep=key)
+        return ColumnarCopy(path, zone_map)
+
+    def stats(self) -> Dict[str, Any]:
+        with self._locked(write=False) as index:
+            return {"copies": len(index), "bytes": sum(e["size"] for e in index.values())}
+
+    def _zone_map(self, path: str) -> Dict[str, Any]:
+        departments = pl.col(DEPARTMENT).drop_nulls()
+        groups = (
+            pl.scan_parquet(path)
+            .with_row_index("_row")
+            .group_by((pl.col("_row") // self.row_group_rows).alias("_group"))
+            .agg(
+                pl.col("Date").min().alias("date_min"),
+                pl.col("Date").max().alias("date_max"),
+                departments.unique().sort().head(ZONE_MAP_MAX_DEPARTMENTS + 1).alias("departments"),
+                pl.len().alias("rows"),
+            )
+            .sort("_group")
+            .collect(engine="streaming")
+        )
+        row_groups = [
+            {
+                "date_min": g["date_min"].isoformat() if g["date_min"] else None,
+                "date_max": g["date_max"].isoformat() if g["date_max"] else None,
+                "departments": g["departments"] if len(g["departments"]) <= ZONE_MAP_MAX_DEPARTMENTS else None,
+            }
+            for g in groups.iter_rows(named=True)
+        ]
+        return {"rows": int(groups["rows"].sum() or 0), "row_group_rows": self.row_group_rows, "row_groups": row_groups}
+
+    def _evict(self, index: Dict[str, Dict[str, Any]], keep: str) -> None:
+        total = sum(e["size"] for e in index.values())
+        # Least recently used copies go first; the one just written stays even if it alone is too big
+        for key in sorted(index, key=lambda k: index[k]["last_access"]):
+            if total <= self.max_bytes:
+                break
+            if key != keep:
+                total -= index[key]["size"]
+                self._drop(index, key)
+
+    def _drop(self, index: Dict[str, Dict[str, Any]], key: str) -> None:
+        index.pop(key, None)
+        for extension in (".parquet", ".json"):
+            try:
+                os.remove(self._path(key, extension))
+            except FileNotFoundError:
+                pass
+
+    def _path(self, key: str, extension: str) -> str:
+        return os.path.join(self.root, key + extension)
+
+    @contextmanager
+    def _locked(self, write: bool = True):
+        """Yield the index under the lock; with ``write`` it is saved back afterwards."""
+        os.makedirs(self.root, exist_ok=True)
+        with self._lock, open(os.path.join(self.root, LOCK_FILE), "a") as lock_file:
+            if fcntl:
+                fcntl.flock(lock_file, fcntl.LOCK_EX if write else fcntl.LOCK_SH)
+            try:
+                try:
+                    with open(os.path.join(self.root, INDEX_FILE)) as f:
+                        index = json.load(f)
+                except (FileNotFoundError, json.JSONDecodeError):
+                    index = {}
+                yield index
+                if write:
+                    path = os.path.join(self.root, INDEX_FILE)
+                    tmp_path = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+                    with open(tmp_path, "w") as f:
+                        json.dump(index, f)
+                    os.replace(tmp_path, path)
+            finally:
+                if fcntl:
+                    fcntl.flock(lock_file, fcntl.LOCK_UN)
+
+
+def _input_key(input_path: Union[str, bytes], fingerprint: Optional[str] = None) -> str:
+    """Key of the input as it is now: a changed file gets a new copy.
+
+    With the content ``fingerprint`` taken at upload, the same data uploaded
+    again (to another job's directory) maps to the same copy.
+    """
+    if fingerprint:
+        return hashlib.sha256(json.dumps({"fingerprint": fingerprint}).encode()).hexdigest()
+    path = os.path.realpath(os.fsdecode(input_path))
+    stat = os.stat(path)
+    identity = {"path": path, "size": stat.st_size, "mtime_ns": stat.st_mtime_ns}
+    return hashlib.sha256(json.dumps(identity, sort_keys=True).encode()).hexdigest()
+
+
+def _may_match(group: Dict[str, Any], f: Filter) -> bool:
+    """Whether some row of a row group can pass ``f``, judging by its zone map."""
+    values = f.values()
+    if f.column == "Date":
+        if group["date_min"] is None:
+            # Every date in the group is null, and a null date fails any date filter
+            return False
+        low = datetime.date.fromisoformat(group["date_min"])
+        high = datetime.date.fromisoformat(group["date_max"])
+        if f.op == "eq":
+            return low <= values[0] <= high
+        if f.op == "in":
+            return any(low <= v <= high for v in values)
+        if f.op == "between":
+            return values[0] <= high and low <= values[1]
+        if f.op == "lt":
+            return low < values[0]
+        if f.op == "le":
+            return low <= values[0]
+        if f.op == "gt":
+            return high > values[0]
+        if f.op == "ge":
+            return high >= values[0]
+    elif f.column == DEPARTMENT and group["departments"] is not None:
+        names = set(group["departments"])
+        if f.op == "eq":
+            return values[0] in names
+        if f.op == "in":
+            return bool(names & set(values))
+        if f.op == "ne":
+            return bool(names - {values[0]})
+    return True
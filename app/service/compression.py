@@ -0,0 +1,76 @@
+"""
+Compressed CSV inputs
+
+Files compressed with gzip, zstd or bz2 are recognised by their magic bytes
+(never by their name) and kept compressed on disk. ``open_decompressed``
+gives a stream of the CSV text, so a decompressed copy is never written.
+A compressed stream can only be read from its start, so these files are
+aggregated serially: they are never split into byte ranges. Multi-member
+gzip, concatenated zstd frames and multi-stream bz2 are read to the end.
+"""
+import bz2
+import gzip
+import zlib
+from typing import BinaryIO, Optional
+
+try:  # Optional: only needed for zstd-compressed inputs
+    import zstandard
+except ImportError:  # pragma: no cover
+    zstandard = None
+
+MAGIC_NUMBERS = {
+    b"\x1f\x8b": "gzip",
+    b"\x28\xb5\x2f\xfd": "zstd",
+    b"BZh": "bz2",
+}
+MAGIC_BYTES = max(len(m) for m in MAGIC_NUMBERS)
+
+
+def detect_compression(head: bytes) -> Optional[str]:
+    """Compression of a stream starting with ``head``, or None for plain text."""
+    for magic, compression in MAGIC_NUMBERS.items():
+        if head.startswith(magic):
+            return compression
+    return None
+
+
+def file_compression(path: str) -> Optional[str]:
+    with open(path, "rb") as f:
+        return detect_compression(f.read(MAGIC_BYTES))
+
+
+def check_supported(compression: Optional[str]) -> None:
+    if compression == "zstd" and zstandard is None:
+        raise ValueError("zstd-compressed input requires the 'zstandard' package")
+
+
+def open_decompressed(path: str, compression: Optional[str]) -> BinaryIO:
+    """The file's CSV text as a stream; ``compression=None`` opens it as is."""
+    check_supported(compression)
+    if compression == "gzip":
+        return gzip.open(path, "rb")
+    if compression == "bz2":
+        return bz2.open(path, "rb")
+    if compression == "zstd":
+        return zstandard.ZstdDecompressor().stream_reader(open(path, "rb"), read_across_frames=True, closefd=True)
+    return open(path, "rb")
+
+
+def decompress_head(data: bytes, compression: str, limit: int) -> bytes:
+    """Decompressed start of a possibly truncated compressed stream, about ``limit`` bytes at most.
+
+    Raises ``ValueError`` when ``data`` is not a valid stream of that kind.
+    """
+    check_supported(compression)
+    try:
+        if compression == "gzip":
+            return zlib.decompressobj(wbits=31).decompress(data, limit)
+        if compression == "bz2":
+            return bz2.BZ2Decompressor().decompress(data, max_length=limit)
+        return zstandard.ZstdDecompressor().decompressobj().decompress(data)[:limit]
+    except (OSError, EOFError, zlib.error) as e:
+        raise ValueError(f"Invalid {compression} data: {e}")
+    except Exception as e:
+        if zstandard is not None and isinstance(e, zstandard.ZstdError):
+            raise ValueError(f"Invalid {compression} data: {e}")
+        raise
@@ -0,0 +1,174 @@
+"""
+State of incrementally aggregated datasets
+
+A dataset is a file that keeps growing by appends and is resubmitted under
+a stable name. After each job its per-group partial state is saved with the
+byte offset it covers (the end of the last complete record) and the
+SHA-256 of the file up to that offset. The next submission checks that its
+file still starts with exactly those bytes. If it does, only the bytes
+after the offset are aggregated and merged into the saved state. If the
+prefix changed (the file was rewritten or truncated) or the query is a
+different one, the file is aggregated from the start and the state
+replaced. Jobs on the same dataset take a file lock, so they run one at a
+time even across worker daemons.
+"""
+import asyncio
+import hashlib
+import json
+import os
+import re
+from contextlib import asynccontextmanager
+from dataclasses import asdict, dataclass
+from typing import Any, Dict, Optional, Tuple
+import polars as pl
+
+try:  # POSIX only; on other platforms jobs on one dataset are not serialised
+    import fcntl
+except ImportError:  # pragma: no cover
+    fcntl = None
+
+DEFAULT_DATASET_DIR = os.getenv(
+    "CSV_DATASET_DIR", os.path.abspath(os.path.join(os.path.dirname(__file__), '../../OUTPUT_DIR/datasets'))
+)
+LOCK_POLL_INTERVAL = 0.05
+READ_SIZE = 1024 * 1024
+
+
+@dataclass
+class DatasetState:
+    # Bytes of the file covered by the saved partial state, always a record boundary
+    offset: int
+    prefix_sha256: str
+    query: Dict[str, Any]
+    updated_at: float
+
+
+class Dataset:
+    """The saved state of one named dataset."""
+
+    def __init__(self, name: str, root: str = DEFAULT_DATASET_DIR):
+        if not name:
+            raise ValueError("A dataset needs a name")
+        self.name = name
+        safe = re.sub(r"[^A-Za-z0-9_.-]", "_", name).lstrip(".")
+        self.directory = os.path.join(root, f"{safe}-{hashlib.sha1(name.encode()).hexdigest()[:8]}")
+
+    def state(self) -> Optional[DatasetState]:
+        try:
+            with open(os.path.join(self.directory, "state.json")) as f:
+                return DatasetState(**json.load(f))
+        except (FileNotFoundError, json.JSONDecodeError, TypeError):
+            return None
+
+    def load(self) -> Optional[Tuple[DatasetState, pl.DataFrame]]:
+        state = self.state()
+        if state is None:
+            return None
+        try:
+            return state, pl.read_ipc(self._partial_path(state), memory_map=False)
+        except (OSError, pl.exceptions.ComputeError):
+            return None
+
+    def save(self, state: DatasetState, partial: pl.DataFrame) -> None:
+        os.makedirs(self.directory, exist_ok=True)
+        previous = self.state()
+        path = self._partial_path(state)
+        # The partial is in place before the state naming it, so a crash leaves the old pair intact
+        partial.write_ipc(path + ".tmp")
+        os.replace(path + ".tmp", path)
+        state_path = os.path.join(self.directory, "state.json")
+        with open(state_path + ".tmp", "w") as f:
+            json.dump(asdict(state), f)
+        os.replace(state_path + ".tmp", state_path)
+        if previous and self._partial_path(previous) != path:
+            try:
+                os.remove(self._partial_path(previous))
+            except FileNotFoundError:
+                pass
+
+    @asynccontextmanager
+    async def locked(self):
+        """Hold the dataset's lock; waits without blocking the event loop."""
+        os.makedirs(self.directory, exist_ok=True)
+        with open(os.path.join(self.directory, ".lock"), "a") as lock_file:
+            while fcntl:
+                try:
+                    fcntl.flock(lock_file, fcntl.LOCK_EX | fcntl.LOCK_NB)
+                    break
+                except BlockingIOError:
+                    await asyncio.sleep(LOCK_POLL_INTERVAL)
+            try:
+                yield
+            finally:
+                if fcntl:
+                    fcntl.flock(lock_file, fcntl.LOCK_UN)
+
+    def _partial_path(self, state: DatasetState) -> str:
+        return os.path.join(self.directory, f"{state.offset}-{state.prefix_sha256[:16]}.arrow")
+
+
+def file_prefix_sha256(path: str, length: int) -> Optional[str]:
+    """SHA-256 of the first ``length`` bytes of a file; None if it is shorter."""
+    hasher = hashlib.sha256()
+    remaining = length
+    with open(path, "rb") as f:
+        while remaining:
+            chunk = f.read(min(READ_SIZE, remaining))
+            if not chunk:
+                return None
+            hasher.update(chunk)
+            remaining -= len(chunk)
+    return hasher.hexdigest()
+
+
+def records_prefix(path: str) -> Tuple[int, str]:
+    """End of the last complete record of a file, and the SHA-256 of the file up to there."""
+    hashes = PrefixHashes()
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(READ_SIZE), b""):
+            hashes.update(chunk)
+    return hashes.records_end, hashes.records_sha256
+
+
+class PrefixHashes:
+    """SHA-256 of a byte stream, noting it at two prefixes on the way.
+
+    ``prefix_sha256`` covers the first ``prefix_offset`` bytes (None until
+    that many bytes were seen). ``records_sha256`` covers the stream up to
+    ``records_end``, just after its last newline outside a quoted field:
+    bytes after it may be a record still being appended.
+    """
+
+    def __init__(self, prefix_offset: Optional[int] = None):
+        self.hasher = hashlib.sha256()
+        self.position = 0
+        self.quotes = 0
+        self.prefix_offset = prefix_offset
+        self.prefix_sha256: Optional[str] = None
+        self.records_end = 0
+        self.records_sha256 = self.hasher.hexdigest()
+
+    def update(self, chunk: bytes) -> None:
+        cuts = []
+        if self.prefix_offset is not None and self.position <= self.prefix_offset <= self.position + len(chunk):
+            cuts.append((self.prefix_offset - self.position, "prefix"))
+        newline = chunk.rfind(b"\n")
+        if newline >= 0 and (self.quotes + chunk.count(b'"', 0, newline)) % 2 == 0:
+            cuts.append((newline + 1, "records"))
+        # Hashed through a view, so splitting the chunk copies nothing
+        view = memoryview(chunk)
+        done = 0
+        for cut, kind in sorted(cuts):
+            self.hasher.update(view[done:cut])
+            done = cut
+            if kind == "prefix" and self.prefix_sha256 is None:
+                self.prefix_sha256 = self.hasher.hexdigest()
+            elif kind == "records":
+                self.records_end = self.position + cut
+                self.records_sha256 = self.hasher.hexdigest()
+        self.hasher.update(view[done:])
+        self.quotes += chunk.count(b'"')
+        self.position += len(chunk)
+
+    def hexdigest(self) -> str:
+        return self.hasher.hexdigest()
@@ -0,0 +1,147 @@
+import asyncio
+import contextvars
+import functools
+import multiprocessing
+import os
+from concurrent.futures import Executor, ProcessPoolExecutor, ThreadPoolExecutor
+from threading import Lock
+from typing import Any, Callable, Optional
+
+# Memory budgeted for one concurrent job when sizing the pool from the host
+JOB_MEMORY_BYTES = int(os.getenv("CSV_JOB_MEMORY_BYTES", 1024 * 1024 * 1024))
+
+
+def available_cpus() -> int:
+    """CPUs this process may use: its affinity mask, capped by a cgroup CPU quota."""
+    try:
+        cpus = len(os.sched_getaffinity(0))
+    except AttributeError:  # pragma: no cover - not available on macOS/Windows
+        cpus = os.cpu_count() or 1
+    # cgroup v2 writes "<quota> <period>" ("max" when unlimited); v1 splits them, with -1 as unlimited
+    v2 = (_read_cgroup("/sys/fs/cgroup/cpu.max") or "max").split()
+    quota, period = v2 if len(v2) == 2 else (None, None)
+    if quota in (None, "max"):
+        quota = _read_cgroup("/sys/fs/cgroup/cpu/cpu.cfs_quota_us")
+        period = _read_cgroup("/sys/fs/cgroup/cpu/cpu.cfs_period_us")
+    if quota and period and int(quota) > 0:
+        # A fractional quota rounds up: 1.5 CPUs still keep two jobs busy
+        cpus = min(cpus, -(-int(quota) // int(period)))
+    return max(1, cpus)
+
+
+def available_memory() -> Optional[int]:
+    """Bytes of memory this process may use: physical memory, capped by a cgroup limit; None if unknown."""
+    try:
+        memory = os.sysconf("SC_PAGE_SIZE") * os.sysconf("SC_PHYS_PAGES")
+    except (AttributeError, ValueError, OSError):  # pragma: no cover - Windows
+        memory = None
+    for path in ("/sys/fs/cgroup/memory.max", "/sys/fs/cgroup/memory/memory.limit_in_bytes"):
+        limit = _read_cgroup(path)
+        # v2 writes "max" when unlimited; v1 a number near 2**63
+        if limit and limit.isdigit() and (memory is None or int(limit) < memory):
+            memory = int(limit)
+    return memory
+
+
+def default_job_slots(job_memory: int = JOB_MEMORY_BYTES) -> int:
+    """Jobs the host can run at once: one per CPU, as long as each gets ``job_memory`` bytes."""
+    slots = available_cpus()
+    memory = available_memory()
+    if memory is not None:
+        slots = min(slots, memory // job_memory)
+    return max(1, slots)
+
+
+def _read_cgroup(path: str) -> Optional[str]:
+    try:
+        with open(path) as f:
+            return f.read().strip()
+    except OSError:
+        return None
+
+
+# Where blocking aggregation work runs:
+# - "thread": a dedicated thread pool (Polars releases the GIL while it computes)
+# - "process": a pool of spawned processes, each with its own Polars thread pool
+# - "inline": directly on the calling thread (debugging and tests)
+BACKENDS = ("thread", "process", "inline")
+DEFAULT_BACKEND = os.getenv("CSV_EXECUTOR_BACKEND", "thread")
+DEFAULT_POOL_SIZE = int(os.getenv("CSV_EXECUTOR_WORKERS", 0)) or default_job_slots()
+DEFAULT_POLARS_THREADS = int(os.getenv("CSV_POLARS_THREADS", 0)) or None
+
+
+def _init_process(polars_threads: int) -> None:
+    # Must run before Polars is imported in the child to size its thread pool
+    os.environ["POLARS_MAX_THREADS"] = str(polars_threads)
+
+
+class ExecutionBackend:
+    """Runs blocking job functions off the event loop on a configurable pool.
+
+    With the process backend every job gets its own Polars runtime limited to
+    ``polars_threads`` threads, so ``pool_size`` concurrent jobs share the
+    machine's cores instead of each spawning one thread per core. Functions
+    submitted to it must be module-level (picklable).
+    """
+
+    def __init__(
+        self,
+        backend: str = DEFAULT_BACKEND,
+        pool_size: int = DEFAULT_POOL_SIZE,
+        polars_threads: Optional[int] = DEFAULT_POLARS_THREADS
+    ):
+        if backend not in BACKENDS:
+            raise ValueError(f"Unknown executor backend '{backend}', expected one of {BACKENDS}")
+        if pool_size < 1:
+            raise ValueError("pool_size must be at least 1")
+        self.backend = backend
+        self.pool_size = pool_size
+        self.polars_threads = polars_threads or max(1, available_cpus() // pool_size)
+        self._executor: Optional[Executor] = None
+        self._lock = Lock()
+
+    async def run(self, fn: Callable[..., Any], *args: Any) -> Any:
+        if self.backend == "inline":
+            return fn(*args)
+        loop = asyncio.get_running_loop()
+        if self.backend == "thread":
+            # Keep context variables (the job's log context) in the pool thread, as asyncio.to_thread does
+            fn = functools.partial(contextvars.copy_context().run, fn)
+        return await loop.run_in_executor(self._get_executor(), fn, *args)
+
+    def shutdown(self, wait: bool = True) -> None:
+        with self._lock:
+            if self._executor is not None:
+                self._executor.shutdown(wait=wait)
+                self._executor = None
+
+    def _get_executor(self) -> Executor:
+        with self._lock:
+            if self._executor is None:
+                if self.backend == "process":
+                    # Spawn rather than fork: forking a process with a live Polars
+                    # thread pool can deadlock the child.
+                    self._executor = ProcessPoolExecutor(
+                        max_workers=self.pool_size,
+                        mp_context=multiprocessing.get_context("spawn"),
+                        initializer=_init_process,
+                        initargs=(self.polars_threads,),
+                    )
+                else:
+                    self._executor = ThreadPoolExecutor(
+                        max_workers=self.pool_size, thread_name_prefix="csv-job"
+                    )
+            return self._executor
+
+
+_default_backend: Optional[ExecutionBackend] = None
+_default_lock = Lock()
+
+
+def get_execution_backend() -> ExecutionBackend:
+    """Process-wide backend shared by all workers, configured from the environment."""
+    global _default_backend
+    with _default_lock:
+        if _default_backend is None:
+            _default_backend = ExecutionBackend()
+        return _default_backend
@@ -0,0 +1,148 @@
+"""
+Approximate results from a sample of the input
+
+The data part of a file is cut into fixed-size byte blocks and a random
+subset of them is aggregated with the job's query. A record belongs to the
+block its first byte falls in, so every record is in exactly one block
+(quoted fields spanning lines are the exception; the preview treats every
+newline as a record end). Per-group sums and counts are then extrapolated
+with a ratio estimator, values per sampled byte times the bytes in the
+file, and a mean is estimated as the ratio of its sum and count.
+
+Confidence intervals use the normal approximation of the ratio estimator
+under sampling without replacement:
+
+    se(R) = sqrt((1 - k/N) / k * s_d^2) / x_bar,   d_i = y_i - R * x_i
+
+over the ``k`` sampled of ``N`` blocks. Sampling every block gives the
+exact answer with zero-width intervals. A group that does not appear in
+any sampled block is missing from the preview.
+"""
+import math
+import os
+import random
+from statistics import NormalDist
+from typing import Any, Dict, List, Optional, Union
+import polars as pl
+from app.service.query import CompiledQuery, QuerySpec
+from app.service.reader_service import AsyncCSVReaderService
+
+PREVIEW_BLOCK_BYTES = int(os.getenv("PREVIEW_BLOCK_BYTES", 256 * 1024))
+# Fewer blocks than this make the normal approximation unreliable
+PREVIEW_MIN_BLOCKS = int(os.getenv("PREVIEW_MIN_BLOCKS", 30))
+PREVIEW_CONFIDENCE = float(os.getenv("PREVIEW_CONFIDENCE", 0.95))
+# Aggregations a sample can estimate; min, max and distinct counts cannot be extrapolated
+PREVIEW_OPS = ("sum", "count", "mean")
+READ_SIZE = 64 * 1024
+
+
+def check_previewable(query: QuerySpec) -> None:
+    unsupported = sorted({a.op for a in query.aggregations if a.op not in PREVIEW_OPS})
+    if unsupported:
+        raise ValueError(f"A preview can only estimate {PREVIEW_OPS}, not {unsupported}")
+
+
+def sample_preview(
+    path: Union[str, bytes],
+    query: Optional[QuerySpec] = None,
+    fraction: float = 0.01,
+    block_bytes: int = PREVIEW_BLOCK_BYTES,
+    min_blocks: int = PREVIEW_MIN_BLOCKS,
+    confidence: float = PREVIEW_CONFIDENCE,
+    seed: Optional[int] = None
+) -> Dict[str, Any]:
+    """Estimate the query's result from about ``fraction`` of the file's bytes.
+
+    Returns the estimates per group as ``rows``: the group keys, then for
+    each aggregation an ``estimate`` with its ``low`` and ``high`` bounds.
+    """
+    query = query or QuerySpec()
+    check_previewable(query)
+    if not 0 < fraction <= 1:
+        raise ValueError("The preview fraction must be in (0, 1]")
+    compiled = CompiledQuery(query)
+    size = os.path.getsize(path)
+    with open(path, "rb") as f:
+        header = f.readline()
+        data_start = len(header)
+        total_bytes = size - data_start
+        starts = list(range(data_start, size, block_bytes))
+        count = min(len(starts), max(min_blocks, math.ceil(fraction * len(starts))))
+        chosen = sorted(random.Random(seed).sample(starts, count))
+        partials = []
+        for start in chosen:
+            end = min(start + block_bytes, size)
+            partial = AsyncCSVReaderService._partial_aggregate_bytes(header + _read_block(f, start, end), compiled)
+            partials.append(partial.with_columns(pl.lit(end - start, pl.Int64).alias("_bytes")))
+    sizes = [min(s + block_bytes, size) - s for s in chosen]
+    z = NormalDist().inv_cdf(0.5 + confidence / 2)
+    rows = _estimate(compiled, partials, sizes, len(starts), total_bytes, z) if partials else []
+    return {
+        "sampled_fraction": sum(sizes) / total_bytes if total_bytes else 1.0,
+        "sampled_blocks": count,
+        "confidence": confidence,
+        "rows": rows,
+    }
+
+
+def _read_block(f, start: int, end: int) -> bytes:
+    """The records starting in ``[start, end)``, read through to the end of the last one."""
+    # The byte before ``start`` tells whether a record starts exactly there
+    f.seek(start - 1)
+    chunk = f.read(end - start + 1)
+    first = chunk.find(b"\n")
+    if first < 0 or first == len(chunk) - 1:
+        return b""
+    body = chunk[first + 1:]
+    while not body.endswith(b"\n"):
+        more = f.read(READ_SIZE)
+        if not more:
+            break
+        cut = more.find(b"\n")
+        body += more if cut < 0 else more[:cut + 1]
+    return body
+
+
+def _estimate(
+    compiled: CompiledQuery,
+    partials: List[pl.DataFrame],
+    sizes: List[int],
+    n: int,
+    total_bytes: int,
+    z: float
+) -> List[Dict[str, Any]]:
+    keys = compiled.keys
+    aggregations = compiled.spec.aggregations
+    # A group's per-block values are zero in the blocks it is absent from, so
+    # sums of products over the blocks it appears in are sums over all k blocks
+    exprs = []
+    for i, agg in enumerate(aggregations):
+        y = pl.col(f"_p{i}_count" if agg.op == "count" else f"_p{i}_sum").cast(pl.Float64)
+        x = pl.col(f"_p{i}_count").cast(pl.Float64) if agg.op == "mean" else pl.col("_bytes").cast(pl.Float64)
+        exprs += [y.sum().alias(f"_y{i}"), (y * y).sum().alias(f"_yy{i}"), (x * y).sum().alias(f"_xy{i}")]
+        if agg.op == "mean":
+            exprs += [x.sum().alias(f"_x{i}"), (x * x).sum().alias(f"_xx{i}")]
+    sums = pl.concat(partials, how="diagonal_relaxed").group_by(keys).agg(exprs).sort(keys)
+    k = len(sizes)
+    sampled_bytes = float(sum(sizes))
+    bytes_sq = float(sum(s * s for s in sizes))
+    shrink = (1 - k / n) / k
+    rows = []
+    for group in sums.iter_rows(named=True):
+        row = {key: group[key] for key in keys}
+        for i, agg in enumerate(aggregations):
+            if agg.op == "mean":
+                sx, sxx, scale = group[f"_x{i}"], group[f"_xx{i}"], 1.0
+            else:
+                sx, sxx, scale = sampled_bytes, bytes_sq, float(total_bytes)
+            sy, syy, sxy = group[f"_y{i}"], group[f"_yy{i}"], group[f"_xy{i}"]
+            if not sx:
+                row[agg.name] = {"estimate": None, "low": None, "high": None}
+                continue
+            ratio = sy / sx
+            spread = max(0.0, syy - 2 * ratio * sxy + ratio * ratio * sxx) / (k - 1) if k > 1 else 0.0
+            error = z * math.sqrt(shrink * spread) / (sx / k) * scale
+            estimate = ratio * scale
+            row[agg.name] = {"estimate": estimate, "low": estimate - error, "high": estimate + error}
+        rows.append(row)
+    return rows
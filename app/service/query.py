@@ -0,0 +1,305 @@
+"""
+Declarative aggregation queries
+
+A ``QuerySpec`` lists group-by keys (``Date`` can be truncated to a day,
+week, month or year), aggregations and filters. ``CompiledQuery`` turns it
+into Polars lazy expressions in steps, so that the single-pass plan and the
+split/merge paths (byte ranges, batch shards) share one definition:
+
+- ``prepare``: keep only the referenced columns, clean them, filter and
+  derive the keys. The projection and filters are pushed into the scan.
+  Input that was cleaned already (a columnar copy) skips the cleaning.
+- ``group``: per-group partial states (sums, counts, min/max, and a KMV
+  sketch for approximate distinct counts) plus a row count.
+- ``merge``: combine partial states from several inputs.
+- ``finalize``: turn partial states into the requested output columns.
+"""
+import datetime
+import os
+from typing import Any, Dict, List, Literal, Optional, Sequence, get_args
+import polars as pl
+from pydantic import BaseModel, ConfigDict, Field, field_validator, model_validator
+
+# Per-group row count carried alongside the partial states; dropped before writing
+ROWS_COLUMN = "_rows"
+# Per-group counts of "Number of Sales" values that were not clean integers, by outcome;
+# also carried alongside the partial states and dropped before writing
+CLEANING_COLUMNS = {"repaired": "_repaired", "defaulted": "_defaulted", "dropped": "_dropped"}
+BOOKKEEPING_COLUMNS = [ROWS_COLUMN, *CLEANING_COLUMNS.values()]
+SALES = "Number of Sales"
+# Outcome of cleaning one "Number of Sales" value, kept per row in SALES_STATE
+CLEAN, REPAIRED, DEFAULTED, DROPPED = range(4)
+SALES_STATE = "_sales_state"
+# Hashes kept per group by approx_distinct; counts up to this size are exact
+DISTINCT_SKETCH_SIZE = int(os.getenv("QUERY_DISTINCT_SKETCH_SIZE", 1024))
+
+Column = Literal["Department Name", "Date", "Number of Sales"]
+NUMERIC_COLUMNS = (SALES,)
+TRUNCATIONS = {"day": "1d", "week": "1w", "month": "1mo", "year": "1y"}
+
+
+def clean_sales(lf: pl.LazyFrame) -> pl.LazyFrame:
+    """Replace "Number of Sales" by its cleaned Int64 value and add its SALES_STATE.
+
+    A strict integer parse handles clean values. Only values it rejects go
+    through the regex repair, which keeps their digits. Values with no
+    digits, or none at all, default to 0. A value whose digits overflow
+    Int64 is dropped (null): aggregations skip it, and the row still counts.
+    """
+    raw = pl.col(SALES).cast(pl.Utf8)
+    strict = raw.str.to_integer(strict=False)
+    # Negative numbers are not clean: the repair drops their sign
+    clean = (strict >= 0).fill_null(False)
+    lf = lf.with_columns(
+        strict.alias("_strict"),
+        clean.alias("_clean"),
+        # Null for clean values, so the regex does no work on them
+        pl.when(~clean).then(raw).str.replace_all(r"[^0-9]", "").alias("_digits"),
+    )
+    digits = pl.col("_digits")
+    repaired = digits.cast(pl.Int64, strict=False)
+    defaulted = (digits.is_null() | (digits == "")).fill_null(True)
+    return lf.with_columns(
+        pl.when("_clean").then("_strict").when(defaulted).then(0).otherwise(repaired).alias(SALES),
+        pl.when("_clean").then(CLEAN).when(defaulted).then(DEFAULTED)
+        .when(repaired.is_null()).then(DROPPED).otherwise(REPAIRED)
+        .cast(pl.Int8).alias(SALES_STATE),
+    ).drop("_strict", "_clean", "_digits")
+
+
+class GroupKey(BaseModel):
+    model_config = ConfigDict(frozen=True, extra="forbid")
+
+    column: Column
+    truncate: Optional[Literal["day", "week", "month", "year"]] = None
+    alias: Optional[str] = None
+
+    @model_validator(mode="after")
+    def _check_key(self):
+        if self.truncate and self.column != "Date":
+            raise ValueError(f"Only 'Date' can be truncated, not '{self.column}'")
+        if self.alias in get_args(Column):
+            raise ValueError(f"Group key alias '{self.alias}' is an input column name")
+        return self
+
+    @property
+    def name(self) -> str:
+        if self.alias:
+            return self.alias
+        return f"{self.column} ({self.truncate})" if self.truncate else self.column
+
+    def expr(self) -> pl.Expr:
+        if self.truncate:
+            return pl.col(self.column).dt.truncate(TRUNCATIONS[self.truncate]).alias(self.name)
+        return pl.col(self.column).alias(self.name)
+
+
+class Aggregation(BaseModel):
+    model_config = ConfigDict(frozen=True, extra="forbid")
+
+    op: Literal["sum", "count", "mean", "min", "max", "approx_distinct"]
+    # Only ``count`` may leave it out, meaning "count rows"
+    column: Optional[Column] = None
+    alias: Optional[str] = None
+
+    @model_validator(mode="after")
+    def _check_column(self):
+        if self.column is None and self.op != "count":
+            raise ValueError(f"Aggregation '{self.op}' needs a column")
+        if self.op in ("sum", "mean") and self.column not in NUMERIC_COLUMNS:
+            raise ValueError(f"Aggregation '{self.op}' needs a numeric column, not '{self.column}'")
+        return self
+
+    @property
+    def name(self) -> str:
+        return self.alias or f"{self.op}({self.column or '*'})"
+
+
+class Filter(BaseModel):
+    model_config = ConfigDict(frozen=True, extra="forbid")
+
+    column: Column
+    op: Literal["eq", "ne", "lt", "le", "gt", "ge", "in", "between"]
+    value: Any
+
+    @model_validator(mode="after")
+    def _check_value(self):
+        if self.op == "between":
+            if not isinstance(self.value, (list, tuple)) or len(self.value) != 2:
+                raise ValueError("'between' needs a [low, high] pair")
+        elif self.op == "in":
+            if not isinstance(self.value, (list, tuple)):
+                raise ValueError("'in' needs a list of values")
+        for value in self._values():
+            _literal(self.column, value)
+        return self
+
+    def _values(self) -> List[Any]:
+        return list(self.value) if self.op in ("in", "between") else [self.value]
+
+    def values(self) -> List[Any]:
+        """The filter's values converted to the column's cleaned type."""
+        return [_literal(self.column, v) for v in self._values()]
+
+    def expr(self) -> pl.Expr:
+        col = pl.col(self.column)
+        values = self.values()
+        if self.op == "between":
+            return col.is_between(values[0], values[1], closed="both")
+        if self.op == "in":
+            return col.is_in(values)
+        return getattr(col, self.op)(values[0])
+
+
+class QuerySpec(BaseModel):
+    """What a job computes. The default is total sales per department."""
+
+    model_config = ConfigDict(frozen=True, extra="forbid")
+
+    group_by: List[GroupKey] = Field(default_factory=lambda: [GroupKey(column="Department Name")], min_length=1)
+    aggregations: List[Aggregation] = Field(
+        default_factory=lambda: [Aggregation(op="sum", column="Number of Sales", alias="Total Number of Sales")],
+        min_length=1
+    )
+    filters: List[Filter] = Field(default_factory=list)
+
+    @field_validator("group_by", mode="before")
+    @classmethod
+    def _column_shorthand(cls, value):
+        # "Department Name" is short for {"column": "Department Name"}
+        if isinstance(value, list):
+            return [{"column": v} if isinstance(v, str) else v for v in value]
+        return value
+
+    @model_validator(mode="after")
+    def _check_names(self):
+        names = [k.name for k in self.group_by] + [a.name for a in self.aggregations]
+        duplicates = sorted({n for n in names if names.count(n) > 1})
+        if duplicates:
+            raise ValueError(f"Duplicate output columns: {duplicates}")
+        reserved = [n for n in names if n.startswith("_")]
+        if reserved:
+            raise ValueError(f"Output column names may not start with '_': {reserved}")
+        return self
+
+    def columns(self) -> List[str]:
+        """Input columns the query reads, in file order."""
+        used = {k.column for k in self.group_by} | {a.column for a in self.aggregations if a.column}
+        used |= {f.column for f in self.filters}
+        return [c for c in get_args(Column) if c in used]
+
+    def to_dict(self) -> Dict[str, Any]:
+        return self.model_dump(mode="json")
+
+
+class CompiledQuery:
+    """Lazy-plan building blocks for one ``QuerySpec``."""
+
+    def __init__(self, spec: Optional[QuerySpec] = None):
+        self.spec = spec or QuerySpec()
+        self.keys = [k.name for k in self.spec.group_by]
+        self.output_columns = self.keys + [a.name for a in self.spec.aggregations]
+
+    def plan(self, lf: pl.LazyFrame) -> pl.LazyFrame:
+        """The whole query over raw input as one lazy plan."""
+        return self.finalize(self.group(self.prepare(lf)))
+
+    def prepare(self, lf: pl.LazyFrame, cleaned: bool = False) -> pl.LazyFrame:
+        # Department names are kept as read; unparsable dates are null
+        columns = self.spec.columns()
+        if SALES in columns and cleaned:
+            lf = lf.select(*columns, SALES_STATE)
+        else:
+            lf = lf.select(columns)
+            if SALES in columns:
+                lf = clean_sales(lf)
+        if self.spec.filters:
+            lf = lf.filter(pl.all_horizontal([f.expr() for f in self.spec.filters]))
+        return lf.with_columns([k.expr() for k in self.spec.group_by if k.truncate or k.alias])
+
+    def group(self, prepared: pl.LazyFrame) -> pl.LazyFrame:
+        exprs = [e for i, a in enumerate(self.spec.aggregations) for e in _partial_exprs(i, a)]
+        if SALES in self.spec.columns():
+            state = pl.col(SALES_STATE)
+            cleaning = [
+                (state == code).sum().cast(pl.Int64).alias(CLEANING_COLUMNS[outcome])
+                for outcome, code in (("repaired", REPAIRED), ("defaulted", DEFAULTED), ("dropped", DROPPED))
+            ]
+        else:
+            cleaning = [pl.lit(0, pl.Int64).alias(name) for name in CLEANING_COLUMNS.values()]
+        return prepared.group_by(self.keys).agg(*exprs, pl.len().cast(pl.Int64).alias(ROWS_COLUMN), *cleaning)
+
+    def combine(self, partials: Sequence[pl.DataFrame]) -> pl.DataFrame:
+        """Partial states of several inputs combined into one set of partial states."""
+        exprs = [e for i, a in enumerate(self.spec.aggregations) for e in _merge_exprs(i, a)]
+        counters = [pl.col(name).sum() for name in BOOKKEEPING_COLUMNS]
+        return pl.concat(partials).lazy().group_by(self.keys).agg(*exprs, *counters).collect()
+
+    def merge(self, partials: Sequence[pl.DataFrame]) -> pl.DataFrame:
+        """Combine partial states of several inputs and finalize them."""
+        return self.finalize(self.combine(partials).lazy()).collect()
+
+    def finalize(self, grouped: pl.LazyFrame) -> pl.LazyFrame:
+        exprs = [_final_expr(i, a).alias(a.name) for i, a in enumerate(self.spec.aggregations)]
+        return grouped.select(*self.keys, *exprs, *BOOKKEEPING_COLUMNS)
+
+    def partial(self, lf: pl.LazyFrame, cleaned: bool = False) -> pl.LazyFrame:
+        """Per-group partial states over raw (or ``cleaned``) input, for merging with other pieces."""
+        return self.group(self.prepare(lf, cleaned))
+
+
+def _partial_exprs(i: int, agg: Aggregation) -> List[pl.Expr]:
+    col = pl.col(agg.column) if agg.column else None
+    if agg.op == "sum":
+        return [col.sum().alias(f"_p{i}_sum")]
+    if agg.op == "count":
+        return [(col.count() if col is not None else pl.len()).cast(pl.Int64).alias(f"_p{i}_count")]
+    if agg.op == "mean":
+        return [col.sum().alias(f"_p{i}_sum"), col.count().cast(pl.Int64).alias(f"_p{i}_count")]
+    if agg.op in ("min", "max"):
+        return [getattr(col, agg.op)().alias(f"_p{i}_{agg.op}")]
+    # approx_distinct: the K smallest distinct hashes (a KMV sketch), which merge by union
+    return [col.drop_nulls().hash(seed=0).unique().bottom_k(DISTINCT_SKETCH_SIZE).alias(f"_p{i}_sketch")]
+
+
+def _merge_exprs(i: int, agg: Aggregation) -> List[pl.Expr]:
+    if agg.op == "sum":
+        return [pl.col(f"_p{i}_sum").sum()]
+    if agg.op == "count":
+        return [pl.col(f"_p{i}_count").sum()]
+    if agg.op == "mean":
+        return [pl.col(f"_p{i}_sum").sum(), pl.col(f"_p{i}_count").sum()]
+    if agg.op in ("min", "max"):
+        name = f"_p{i}_{agg.op}"
+        return [getattr(pl.col(name), agg.op)()]
+    name = f"_p{i}_sketch"
+    return [pl.col(name).flatten().unique().bottom_k(DISTINCT_SKETCH_SIZE).alias(name)]
+
+
+def _final_expr(i: int, agg: Aggregation) -> pl.Expr:
+    if agg.op == "sum":
+        return pl.col(f"_p{i}_sum")
+    if agg.op == "count":
+        return pl.col(f"_p{i}_count")
+    if agg.op == "mean":
+        return pl.col(f"_p{i}_sum") / pl.col(f"_p{i}_count")
+    if agg.op in ("min", "max"):
+        return pl.col(f"_p{i}_{agg.op}")
+    sketch = pl.col(f"_p{i}_sketch")
+    size = sketch.list.len()
+    # Below K hashes the sketch holds every distinct value; above, the Kth smallest
+    # hash as a fraction of the hash space estimates (K - 1) / n
+    estimate = ((DISTINCT_SKETCH_SIZE - 1) * 2.0 ** 64 / sketch.list.max().cast(pl.Float64)).round()
+    return pl.when(size < DISTINCT_SKETCH_SIZE).then(size).otherwise(estimate).cast(pl.Int64)
+
+
+def _literal(column: str, value: Any) -> Any:
+    """A filter value converted to the column's cleaned type."""
+    try:
+        if column == "Date":
+            return value if isinstance(value, datetime.date) else datetime.date.fromisoformat(str(value))
+        if column in NUMERIC_COLUMNS:
+            return int(value)
+    except (TypeError, ValueError):
+        raise ValueError(f"Invalid value {value!r} for column '{column}'")
+    return str(value)
@@ -1,116 +1,761 @@
 import polars as pl
 import asyncio
+import io
+import itertools
+import math
 import uuid
 import datetime
 import os
 import tempfile
 import time
-from typing import Union, Optional
+from typing import Any, Awaitable, Callable, Dict, Iterable, List, Optional, Sequence, Tuple, TypeVar, Union
 from app.utils.logger import Logger
+from app.service.executor import ExecutionBackend, get_execution_backend
+from app.service.checkpoints import DEFAULT_CHECKPOINT_DIR, DEFAULT_CHECKPOINTS, Checkpoint, checkpoint_for
+from app.service.columnar import COLUMNAR_MODES, DEFAULT_COLUMNAR, DEFAULT_COLUMNAR_DIR, ColumnarCopy, ColumnarStore
+from app.service.byte_ranges import align_cuts, count_quotes, iter_record_blocks, iter_stream_blocks, plan_cuts
+from app.service.compression import file_compression, open_decompressed
+from app.service.datasets import Dataset, DatasetState, file_prefix_sha256, records_prefix
+from app.service.query import BOOKKEEPING_COLUMNS, CLEANING_COLUMNS, CompiledQuery, QuerySpec, ROWS_COLUMN, clean_sales
+from app.service.result_formats import OutputOptions, write_result
+from app.service.retry import backoff_delay, is_retryable
+from app.utils.metrics import JobTrace, PeakRSS, RETRIES_TOTAL
 
 OUTPUT_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), '../../OUTPUT_DIR')
 
+T = TypeVar("T")
+ShardStatusCallback = Callable[..., None]
+# Called with (bytes_done, bytes_total) as the input is worked through
+ProgressCallback = Callable[[int, int], None]
+
+# Execution engines: "streaming" runs the whole job as one bounded-memory plan,
+# "parquet" converts the input to Parquet first, kept as its columnar copy.
+ENGINES = ("streaming", "parquet")
+DEFAULT_ENGINE = os.getenv("CSV_AGGREGATION_ENGINE", "streaming")
+
+# Intra-file parallelism: "auto" splits files larger than the threshold into
+# byte ranges aggregated in parallel, "on"/"off" force it either way. Only the
+# streaming engine supports it.
+PARALLEL_MODES = ("auto", "on", "off")
+DEFAULT_PARALLEL = os.getenv("CSV_PARALLEL_MODE", "auto")
+DEFAULT_PARALLEL_THRESHOLD = int(os.getenv("CSV_PARALLEL_THRESHOLD", 512 * 1024 * 1024))
+# Upper bound on one range, so the work spreads evenly and a retry stays cheap
+MAX_RANGE_BYTES = int(os.getenv("CSV_MAX_RANGE_BYTES", 128 * 1024 * 1024))
+# A range is parsed in record-aligned blocks of this size, bounding its memory
+RANGE_BLOCK_BYTES = int(os.getenv("CSV_RANGE_BLOCK_BYTES", 8 * 1024 * 1024))
+# Ceiling (bytes) on the rows one job holds parsed at a time. With a limit,
+# every input is parsed in blocks sized to fit it; 0 leaves serial files to the
+# streaming engine, whose memory follows its thread count instead
+DEFAULT_MEMORY_LIMIT = int(os.getenv("CSV_MEMORY_LIMIT", 0))
+# A block takes about this many times its CSV bytes while it is parsed: the
+# copy with the header, the parsed columns and Polars' buffers (measured on
+# generated sales files)
+PARSED_BYTES_FACTOR = 12
+MIN_BLOCK_BYTES = 64 * 1024
+
+CSV_SCHEMA = {
+    "Department Name": pl.Utf8,
+    "Date": pl.Date,
+    "Number of Sales": pl.Utf8,  # Read as string for cleaning
+}
+
+
+def new_result_path(output_dir: Union[str, bytes] = OUTPUT_DIR, extension: str = ".csv") -> str:
+    """Fresh, unique path for a result file inside ``output_dir``."""
+    unique_id = uuid.uuid1().hex
+    timestamp = datetime.datetime.now().strftime('%Y%m%dT%H%M%S')
+    return os.path.join(str(output_dir), f"department_sales_{timestamp}_{unique_id}{extension}")
+
+
+def _run_partial_aggregation(
+    input_csv_path: Union[str, bytes],
+    engine: str,
+    query: QuerySpec,
+    columnar: str = DEFAULT_COLUMNAR,
+    columnar_dir: str = DEFAULT_COLUMNAR_DIR,
+    memory_limit: int = DEFAULT_MEMORY_LIMIT
+) -> Tuple[pl.DataFrame, Dict[str, Any]]:
+    trace = JobTrace()
+    with PeakRSS() as rss:
+        service = AsyncCSVReaderService(
+            engine=engine,
+            trace=trace,
+            query=query,
+            columnar=columnar,
+            columnar_dir=columnar_dir,
+            memory_limit=memory_limit
+        )
+        partial = service._partial_aggregate(input_csv_path)
+    trace.peak_rss_bytes = rss.peak
+    return partial, trace.to_dict()
+
+
+def _run_range_aggregation(
+    input_csv_path: str,
+    header: bytes,
+    start: int,
+    end: int,
+    query: QuerySpec,
+    block_bytes: Optional[int] = None
+) -> Tuple[pl.DataFrame, Dict[str, Any]]:
+    trace = JobTrace()
+    compiled = CompiledQuery(query)
+    with PeakRSS() as rss, trace.stage("scan_clean_group"):
+        blocks = iter_record_blocks(input_csv_path, start, end, block_bytes or RANGE_BLOCK_BYTES)
+        # Left unfinalized so it can be merged with the other ranges
+        partial = AsyncCSVReaderService._fold_blocks(header, blocks, compiled)
+    trace.bytes_read = end - start
+    trace.peak_rss_bytes = rss.peak
+    return partial, trace.to_dict()
+
+
+def _run_aggregation(
+    input_csv_path: Union[str, bytes],
+    output_dir: Union[str, bytes],
+    engine: str,
+    output: OutputOptions,
+    query: QuerySpec,
+    columnar: str = DEFAULT_COLUMNAR,
+    columnar_dir: str = DEFAULT_COLUMNAR_DIR,
+    memory_limit: int = DEFAULT_MEMORY_LIMIT,
+    fingerprint: Optional[str] = None
+) -> Tuple[str, Dict[str, Any]]:
+    """Module-level entry point so the job can be shipped to a worker process.
+
+    Returns the result path and the job's trace as a dict.
+    """
+    trace = JobTrace()
+    with PeakRSS() as rss:
+        service = AsyncCSVReaderService(
+            engine=engine,
+            trace=trace,
+            output=output,
+            query=query,
+            columnar=columnar,
+            columnar_dir=columnar_dir,
+            memory_limit=memory_limit
+        )
+        output_csv_path = service._aggregate_sales_by_department_dex(input_csv_path, output_dir, fingerprint)
+    trace.peak_rss_bytes = rss.peak
+    return output_csv_path, trace.to_dict()
+
+class _ProgressCounter:
+    """Running byte total of the pieces of one job, reported through a ``ProgressCallback``."""
+
+    def __init__(self, callback: Optional[ProgressCallback], total: int):
+        self.callback = callback or (lambda done, total: None)
+        self.total = total
+        self.done = 0
+        self.callback(0, total)
+
+    def add(self, size: int) -> None:
+        self.done += size
+        self.callback(self.done, self.total)
+
+
 class AsyncCSVReaderService:
-    def __init__(self, logger: Optional[Logger] = None):
+    def __init__(
+        self,
+        logger: Optional[Logger] = None,
+        engine: str = DEFAULT_ENGINE,
+        executor: Optional[ExecutionBackend] = None,
+        parallel: str = DEFAULT_PARALLEL,
+        parallel_threshold: int = DEFAULT_PARALLEL_THRESHOLD,
+        trace: Optional[JobTrace] = None,
+        output: Optional[OutputOptions] = None,
+        query: Optional[QuerySpec] = None,
+        checkpoints: bool = DEFAULT_CHECKPOINTS,
+        checkpoint_dir: str = DEFAULT_CHECKPOINT_DIR,
+        columnar: str = DEFAULT_COLUMNAR,
+        columnar_dir: str = DEFAULT_COLUMNAR_DIR,
+        memory_limit: int = DEFAULT_MEMORY_LIMIT
+    ):
+        if engine not in ENGINES:
+            raise ValueError(f"Unknown aggregation engine '{engine}', expected one of {ENGINES}")
+        if columnar not in COLUMNAR_MODES:
+            raise ValueError(f"Unknown columnar copy mode '{columnar}', expected one of {COLUMNAR_MODES}")
+        if parallel not in PARALLEL_MODES:
+            raise ValueError(f"Unknown parallel mode '{parallel}', expected one of {PARALLEL_MODES}")
+        if parallel == "on" and engine != "streaming":
+            raise ValueError(f"Parallel mode requires the streaming engine, not '{engine}'")
+        if memory_limit < 0:
+            raise ValueError("memory_limit must not be negative")
         self.logger = logger or Logger()
+        self.engine = engine
+        self.executor = executor or get_execution_backend()
+        self.parallel = parallel
+        self.parallel_threshold = parallel_threshold
+        # Stage timings, rows, bytes and peak RSS of the work done through this instance
+        self.trace = trace or JobTrace()
+        self.output = output or OutputOptions()
+        self.query = query or QuerySpec()
+        self.compiled = CompiledQuery(self.query)
+        # Finished ranges and shards are saved so a rerun of the job skips them
+        self.checkpoints = checkpoints
+        self.checkpoint_dir = checkpoint_dir
+        # Columnar copies of inputs, kept so later jobs on them skip the CSV parse
+        self.columnar = columnar
+        self.columnar_dir = columnar_dir
+        self.memory_limit = memory_limit
 
     async def aggregate_sales_by_department(
         self,
         input_csv_path: Union[str, bytes],
         output_dir: Union[str, bytes] = OUTPUT_DIR,
         retries: int = 3,
-        delay: float = 2.0
+        delay: float = 2.0,
+        on_progress: Optional[ProgressCallback] = None,
+        fingerprint: Optional[str] = None
+    ) -> str:
+        """Aggregate one file into a result file.
+
+        ``on_progress`` is called as byte ranges complete; a file aggregated
+        serially is one plan, so it only reports its start and its end. Only
+        byte ranges are checkpointed; a serial file is redone from the start.
+        ``fingerprint``, the upload's content hash, finds the columnar copy of
+        the same data uploaded by an earlier job.
+        """
+        if self._use_parallel(input_csv_path, fingerprint):
+            return await self._aggregate_parallel(input_csv_path, output_dir, retries, delay, on_progress)
+        size = os.path.getsize(input_csv_path)
+        progress = _ProgressCounter(on_progress, size)
+        output_csv_path, piece = await self._with_retries(
+            f"file: {input_csv_path}",
+            lambda: self.executor.run(
+                _run_aggregation,
+                input_csv_path,
+                output_dir,
+                self.engine,
+                self.output,
+                self.query,
+                self.columnar,
+                self.columnar_dir,
+                self.memory_limit,
+                fingerprint
+            ),
+            retries,
+            delay
+        )
+        self.trace.merge(piece)
+        progress.add(size)
+        self.logger.info("Aggregation complete. Output file: %s", output_csv_path)
+        return output_csv_path
+
+    async def aggregate_dataset(
+        self,
+        input_csv_path: Union[str, bytes],
+        dataset: Dataset,
+        output_dir: Union[str, bytes] = OUTPUT_DIR,
+        prefix: Optional[Tuple[int, str]] = None,
+        records: Optional[Tuple[int, str]] = None,
+        retries: int = 3,
+        delay: float = 2.0,
+        on_progress: Optional[ProgressCallback] = None
+    ) -> str:
+        """Aggregate the latest version of a growing file, reading only what was appended.
+
+        The dataset's saved state is used when the file still starts with the
+        bytes it covers; otherwise the file is aggregated from the start. The
+        state is then advanced to the file's last complete record. A trailing
+        record without its newline counts in this result but is left out of
+        the state, as it may still be being written.
+
+        ``prefix`` (an offset and the SHA-256 of the bytes before it) and
+        ``records`` (the end of the last complete record and the SHA-256 up
+        to there) are hashed while the file is uploaded. When they are
+        missing, or the state moved on since, they are computed from the file.
+        """
+        path = os.fsdecode(input_csv_path)
+        if file_compression(path):
+            # Appended bytes cannot be found inside a compressed stream
+            self.logger.warning("%s is compressed; aggregating it in full without dataset state.", path)
+            return await self.aggregate_sales_by_department(path, output_dir, retries, delay, on_progress)
+        size = os.path.getsize(path)
+        async with dataset.locked():
+            saved = await asyncio.to_thread(dataset.load)
+            header, _ = await asyncio.to_thread(plan_cuts, path, 1)
+            records_end, records_sha256 = records or await asyncio.to_thread(records_prefix, path)
+            start, state = len(header), None
+            if saved:
+                known = prefix[1] if prefix and prefix[0] == saved[0].offset else None
+                reason = await asyncio.to_thread(self._dataset_mismatch, path, saved[0], known)
+                if reason:
+                    self.logger.info("Recomputing dataset %s from the start: %s", dataset.name, reason)
+                else:
+                    start, state = saved[0].offset, saved[1]
+            end = max(start, records_end)
+            self.logger.info("Aggregating bytes %s-%s of %s for dataset %s", start, size, path, dataset.name)
+            progress = _ProgressCounter(on_progress, size - start)
+            partials = [state] if state is not None else []
+            partials += await self._aggregate_span(path, header, start, end, retries, delay, progress)
+            state = self.compiled.combine(partials) if partials else self._partial_aggregate_bytes(header, self.compiled)
+            if records_end >= len(header):
+                await asyncio.to_thread(
+                    dataset.save, DatasetState(end, records_sha256, self.query.to_dict(), time.time()), state
+                )
+            pending = await self._aggregate_span(path, header, end, size, retries, delay, progress)
+        output_csv_path = await self._write_merged([state, *pending], output_dir)
+        self.logger.info("Dataset %s aggregated. Output file: %s", dataset.name, output_csv_path)
+        return output_csv_path
+
+    async def aggregate_sales_by_department_batch(
+        self,
+        input_csv_paths: Sequence[Union[str, bytes]],
+        output_dir: Union[str, bytes] = OUTPUT_DIR,
+        retries: int = 3,
+        delay: float = 2.0,
+        on_shard_status: Optional[ShardStatusCallback] = None,
+        on_progress: Optional[ProgressCallback] = None
     ) -> str:
+        """Aggregate several shards in parallel and merge them into one result file.
+
+        Each shard is reduced to per-group partial states on the executor;
+        only those small frames are merged, so wall time tracks the slowest
+        shard. ``on_shard_status(path, status, error)`` is called as each shard
+        starts, finishes or fails, and ``on_progress`` as each one finishes.
+        Any failed shard fails the whole batch; the shards that finished are
+        checkpointed and skipped when the batch is run again.
+        """
+        notify = on_shard_status or (lambda path, status, error=None: None)
+        # A missing shard fails when it runs, like any other shard failure
+        sizes = {p: os.path.getsize(p) if os.path.exists(p) else 0 for p in input_csv_paths}
+        progress = _ProgressCounter(on_progress, sum(sizes.values()))
+        checkpoints = {p: self._checkpoint(p) for p in input_csv_paths}
+
+        async def run_shard(path):
+            notify(path, "STARTED")
+            try:
+                result = await self._checkpointed(
+                    checkpoints[path],
+                    0,
+                    sizes[path],
+                    lambda: self._with_retries(
+                        f"shard: {path}",
+                        lambda: self.executor.run(
+                            _run_partial_aggregation,
+                            path,
+                            self.engine,
+                            self.query,
+                            self.columnar,
+                            self.columnar_dir,
+                            self._memory_limit_per_task(len(input_csv_paths))
+                        ),
+                        retries,
+                        delay
+                    )
+                )
+            except Exception as e:
+                notify(path, "FAILED", str(e))
+                raise
+            notify(path, "FINISHED")
+            progress.add(sizes[path])
+            return result
+
+        with self.trace.stage("shards"):
+            results = await asyncio.gather(*(run_shard(p) for p in input_csv_paths), return_exceptions=True)
+        errors = [r for r in results if isinstance(r, BaseException)]
+        if errors:
+            raise errors[0]
+        for _, piece in results:
+            if piece is not None:
+                self.trace.merge(piece, stages=False)
+        output_csv_path = await self._write_merged([partial for partial, _ in results], output_dir)
+        await self._discard_checkpoints(checkpoints.values())
+        self.logger.info("Merged %s shards. Output file: %s", len(results), output_csv_path)
+        return output_csv_path
+
+    async def _aggregate_parallel(
+        self,
+        input_csv_path: Union[str, bytes],
+        output_dir: Union[str, bytes],
+        retries: int,
+        delay: float,
+        on_progress: Optional[ProgressCallback] = None
+    ) -> str:
+        """Aggregate one file as record-aligned byte ranges processed concurrently.
+
+        Placing the cuts needs the quote parity before each one, which means
+        reading the whole file once more; that count runs per segment on the
+        executor too, so the extra pass is parallel rather than a serial
+        prelude. Each finished range is checkpointed, so a rerun of the job
+        only aggregates the ranges that had not finished.
+        """
+        path = os.fsdecode(input_csv_path)
+        size = os.path.getsize(path)
+        num_ranges = max(self.executor.pool_size, math.ceil(size / MAX_RANGE_BYTES))
+        with self.trace.stage("split"):
+            header, cuts = await asyncio.to_thread(plan_cuts, path, num_ranges)
+            segments = zip([len(header)] + cuts, cuts)
+            quote_counts = await asyncio.gather(*(self.executor.run(count_quotes, path, a, b) for a, b in segments))
+            ranges = await asyncio.to_thread(align_cuts, path, len(header), cuts, list(quote_counts))
+        self.logger.info("Aggregating %s as %s parallel byte ranges", path, len(ranges))
+        progress = _ProgressCounter(on_progress, sum(end - start for start, end in ranges))
+        checkpoint = self._checkpoint(path)
+
+        async def run_range(start, end):
+            result = await self._checkpointed(
+                checkpoint,
+                start,
+                end,
+                lambda: self._with_retries(
+                    f"range {start}-{end} of {path}",
+                    lambda: self.executor.run(
+                        _run_range_aggregation, path, header, start, end, self.query, self._block_bytes(len(ranges))
+                    ),
+                    retries,
+                    delay
+                )
+            )
+            progress.add(end - start)
+            return result
+
+        with self.trace.stage("ranges"):
+            # The other ranges run to the end (and are checkpointed) even when one fails
+            results = await asyncio.gather(*(run_range(start, end) for start, end in ranges), return_exceptions=True)
+        errors = [r for r in results if isinstance(r, BaseException)]
+        if errors:
+            raise errors[0]
+        for _, piece in results:
+            if piece is not None:
+                self.trace.merge(piece, stages=False)
+        resumed = sum(1 for _, piece in results if piece is None)
+        if resumed:
+            self.logger.info("Resumed %s of %s ranges of %s from checkpoints", resumed, len(ranges), path)
+        partials = [partial for partial, _ in results] or [self._partial_aggregate_bytes(header, self.compiled)]
+        output_csv_path = await self._write_merged(partials, output_dir)
+        await self._discard_checkpoints([checkpoint])
+        self.logger.info("Aggregation complete. Output file: %s", output_csv_path)
+        return output_csv_path
+
+    async def _aggregate_span(
+        self,
+        path: str,
+        header: bytes,
+        start: int,
+        end: int,
+        retries: int,
+        delay: float,
+        progress: _ProgressCounter
+    ) -> List[pl.DataFrame]:
+        """Partial states of the records in ``[start, end)``, split into parallel ranges when large."""
+        if end <= start:
+            return []
+        parallel = self.parallel == "on" or (self.parallel == "auto" and end - start >= self.parallel_threshold)
+        num_ranges = max(self.executor.pool_size, math.ceil((end - start) / MAX_RANGE_BYTES)) if parallel else 1
+        step = (end - start) // num_ranges
+        cuts = [start + i * step for i in range(1, num_ranges)] if step else []
+        quote_counts = await asyncio.gather(*(self.executor.run(count_quotes, path, a, b) for a, b in zip([start] + cuts, cuts)))
+        ranges = await asyncio.to_thread(align_cuts, path, start, cuts, list(quote_counts))
+        # Cuts land on record starts, none of them past ``end``, itself a record start
+        ranges = [(a, min(b, end)) for a, b in ranges if a < end]
+
+        async def run_range(a, b):
+            partial, piece = await self._with_retries(
+                f"range {a}-{b} of {path}",
+                lambda: self.executor.run(
+                    _run_range_aggregation, path, header, a, b, self.query, self._block_bytes(len(ranges))
+                ),
+                retries,
+                delay
+            )
+            self.trace.merge(piece, stages=False)
+            progress.add(b - a)
+            return partial
+
+        with self.trace.stage("ranges"):
+            return list(await asyncio.gather(*(run_range(a, b) for a, b in ranges)))
+
+    def _dataset_mismatch(self, path: str, state: DatasetState, prefix_sha256: Optional[str]) -> Optional[str]:
+        """Why the saved state does not apply to the file, or None when it does."""
+        if state.query != self.query.to_dict():
+            return "the query changed"
+        if os.path.getsize(path) < state.offset:
+            return "the file is shorter than the part already aggregated"
+        if (prefix_sha256 or file_prefix_sha256(path, state.offset)) != state.prefix_sha256:
+            return "the part already aggregated has changed"
+        return None
+
+    async def _write_merged(self, partials: Sequence[pl.DataFrame], output_dir: Union[str, bytes]) -> str:
+        with self.trace.stage("merge"):
+            merged = await asyncio.to_thread(self.compiled.merge, partials)
+        os.makedirs(output_dir, exist_ok=True)
+        output_csv_path = new_result_path(output_dir, self.output.extension)
+        with self.trace.stage("write_result"):
+            await asyncio.to_thread(self._write_result, merged, output_csv_path)
+        return output_csv_path
+
+    def _memory_limit_per_task(self, tasks: int) -> int:
+        """Share of the job's memory limit for one of ``tasks`` pieces; at most a pool's worth run at once."""
+        if not self.memory_limit:
+            return 0
+        return max(PARSED_BYTES_FACTOR * MIN_BLOCK_BYTES, self.memory_limit // min(tasks, self.executor.pool_size))
+
+    def _block_bytes(self, tasks: int = 1) -> int:
+        """Bytes of CSV parsed at once by each of ``tasks`` pieces of the job."""
+        if not self.memory_limit:
+            return RANGE_BLOCK_BYTES
+        return self._memory_limit_per_task(tasks) // PARSED_BYTES_FACTOR
+
+    def _use_parallel(self, input_csv_path: Union[str, bytes], fingerprint: Optional[str] = None) -> bool:
+        if self.parallel != "off" and file_compression(input_csv_path):
+            # A compressed stream cannot be entered at a byte offset
+            if self.parallel == "on":
+                self.logger.warning("%s is compressed; aggregating it serially.", input_csv_path)
+            return False
+        if self.parallel == "auto":
+            if self.columnar == "always" or (self.columnar == "on" and ColumnarStore(self.columnar_dir).get(input_csv_path, fingerprint)):
+                # One scan of a columnar copy beats parsing the CSV in parallel ranges
+                return False
+            return self.engine == "streaming" and os.path.getsize(input_csv_path) >= self.parallel_threshold
+        return self.parallel == "on"
+
+    def _checkpoint(self, input_csv_path: Union[str, bytes]) -> Optional[Checkpoint]:
+        if not self.checkpoints or not os.path.exists(input_csv_path):
+            return None
+        return checkpoint_for(input_csv_path, self.query, self.checkpoint_dir)
+
+    async def _checkpointed(
+        self,
+        checkpoint: Optional[Checkpoint],
+        start: int,
+        end: int,
+        call: Callable[[], Awaitable[Tuple[pl.DataFrame, Dict[str, Any]]]]
+    ) -> Tuple[pl.DataFrame, Optional[Dict[str, Any]]]:
+        """Partial state of bytes ``start``-``end``: loaded from the checkpoint (with no trace), or computed and saved."""
+        if checkpoint is None:
+            return await call()
+        partial = await asyncio.to_thread(checkpoint.load, start, end)
+        if partial is not None:
+            return partial, None
+        partial, piece = await call()
+        try:
+            await asyncio.to_thread(checkpoint.save, start, end, partial)
+        except OSError as e:
+            self.logger.warning("Could not checkpoint bytes %s-%s: %s", start, end, e)
+        return partial, piece
+
+    async def _discard_checkpoints(self, checkpoints: Iterable[Optional[Checkpoint]]) -> None:
+        for checkpoint in checkpoints:
+            if checkpoint is not None:
+                await asyncio.to_thread(checkpoint.discard)
+
+    async def _with_retries(
+        self,
+        label: str,
+        call: Callable[[], Awaitable[T]],
+        retries: int,
+        delay: float
+    ) -> T:
+        """Run ``call`` up to ``retries`` times, backing off exponentially from ``delay``.
+
+        Fatal errors (see ``app.service.retry``) are raised after the first attempt.
+        """
         attempt = 0
         while attempt < retries:
             try:
-                self.logger.info(f"Starting aggregation for file: {input_csv_path} (Attempt {attempt+1}/{retries})")
-                loop = asyncio.get_event_loop()
-                output_csv_path = await loop.run_in_executor(
-                    None,
-                    self._aggregate_sales_by_department_dex,
-                    input_csv_path,
-                    output_dir
-                )
-                self.logger.info(f"Aggregation complete. Output file: {output_csv_path}")
-                return output_csv_path
+                self.logger.info("Starting aggregation for %s (Attempt %s/%s)", label, attempt + 1, retries)
+                return await call()
             except Exception as e:
                 attempt += 1
-                self.logger.error(f"Attempt {attempt} failed: {e}")
+                if not is_retryable(e):
+                    self.logger.error("Attempt %s failed with a fatal error, not retrying: %s", attempt, e)
+                    raise
+                self.logger.error("Attempt %s failed: %s", attempt, e)
                 if attempt < retries:
-                    self.logger.info(f"Retrying in {delay} seconds...")
-                    await asyncio.sleep(delay)
+                    RETRIES_TOTAL.inc()
+                    wait = backoff_delay(attempt, delay)
+                    self.logger.info("Retrying in %.2f seconds...", wait)
+                    await asyncio.sleep(wait)
                 else:
-                    self.logger.critical(f"All {retries} attempts failed. Giving up.")
+                    self.logger.critical("All %s attempts failed. Giving up.", retries)
                     raise
 
     def _aggregate_sales_by_department_dex(
         self,
         input_csv_path: Union[str, bytes],
-        output_dir: Union[str, bytes] = OUTPUT_DIR
+        output_dir: Union[str, bytes] = OUTPUT_DIR,
+        fingerprint: Optional[str] = None
     ) -> str:
         try:
             # Ensure output directory exists
             if not os.path.exists(output_dir):
                 os.makedirs(output_dir, exist_ok=True)
 
-            unique_id = uuid.uuid1().hex
-            timestamp = datetime.datetime.now().strftime('%Y%m%dT%H%M%S')
-            output_csv_path = os.path.join(
-                str(output_dir), f"department_sales_{timestamp}_{unique_id}.csv"
-            )
-            self.logger.info(f"Converting CSV to Parquet for file: {input_csv_path}")
-            with tempfile.NamedTemporaryFile(suffix='.parquet', delete=True) as tmp_parquet:
-                lf: pl.LazyFrame = pl.scan_csv(
-                    input_csv_path,
-                    dtypes={
-                        "Department Name": pl.Utf8,
-                        "Date": pl.Date,
-                        "Number of Sales": pl.Utf8,  # Read as string for cleaning
-                    },
-                    ignore_errors=True,
-                    low_memory=True,
-                    rechunk=False,
-                )                # Step 1: Force all columns to string for consistent processing
-                lf = lf.with_columns([
-                    pl.col("Number of Sales").cast(pl.Utf8).alias("Number of Sales"),
-                    pl.col("Department Name").cast(pl.Utf8).alias("Department Name"),
-                    pl.col("Date").cast(pl.Utf8).alias("Date")
-                ])
-                  # Step 2: Clean and convert 'Number of Sales' to integer
-                # - Replace empty strings with '0'
-                # - For non-numeric strings, extract just the digits or use '0'
-                # - Cast to Int64 and ensure no nulls
-                lf = lf.with_columns([
-                    pl.when(pl.col("Number of Sales") == "")
-                      .then(pl.lit("0"))
-                      .otherwise(pl.col("Number of Sales"))
-                      .alias("Number of Sales")
-                ])
-                
-                lf = lf.with_columns([
-                    pl.col("Number of Sales")
-                      .str.replace_all(r"[^0-9]", "")  # Remove all non-digits
-                      .str.replace_all(r"^$", "0")     # Empty string to "0"
-                      .cast(pl.Int64)                  # Cast to Int64
-                      .fill_null(0)                    # Fill any nulls with 0
-                      .alias("Number of Sales")
-                ])
-                  # Debug log the column type
-                self.logger.info(f"Number of Sales column type: {lf.select('Number of Sales').collect().dtypes}")
-                lf.collect().write_parquet(tmp_parquet.name)
-                self.logger.info(f"CSV converted to Parquet: {tmp_parquet.name}")
-                lf_parquet: pl.LazyFrame = pl.scan_parquet(tmp_parquet.name, low_memory=True)
-                result: pl.LazyFrame = (
-                    lf_parquet.group_by("Department Name")
-                    .agg(pl.col("Number of Sales").sum().alias("Total Number of Sales"))
-                    .select(["Department Name", "Total Number of Sales"])
-                )
-                self.logger.info("Aggregating sales by department using DEX engine.")
-                df: pl.DataFrame = result.collect()
-                df.write_csv(output_csv_path)
-                self.logger.info(f"Aggregation written to CSV: {output_csv_path}")
+            output_csv_path = new_result_path(output_dir, self.output.extension)
+            self.trace.bytes_read += os.path.getsize(input_csv_path)
+            compression = file_compression(input_csv_path)
+            partial = None if compression else self._columnar_partial(input_csv_path, fingerprint)
+            if compression:
+                self._aggregate_compressed(input_csv_path, compression, output_csv_path)
+            elif partial is not None:
+                df = self.compiled.finalize(partial.lazy()).collect()
+                with self.trace.stage("write_result"):
+                    self._write_result(df, output_csv_path)
+            elif self.engine == "parquet":
+                self._aggregate_via_parquet(input_csv_path, output_csv_path)
+            else:
+                self._aggregate_streaming(input_csv_path, output_csv_path)
+            self.logger.info("Aggregation written to %s: %s", self.output.format, output_csv_path)
             return output_csv_path
         except Exception as e:
-            self.logger.error(f"Error during aggregation: {e}")
+            self.logger.error("Error during aggregation: %s", e)
             raise
+
+    def _aggregate_streaming(self, input_csv_path: Union[str, bytes], output_csv_path: str) -> None:
+        """Run scan -> clean -> filter -> group_by as a single streaming plan, then write the result.
+
+        Rows are processed in morsels per Polars thread and only the
+        per-group states are kept, so peak memory follows the number of
+        Polars threads (``CSV_POLARS_THREADS``) rather than the file size.
+        With a ``memory_limit`` the file is parsed in blocks sized to it instead.
+        Only the columns the query uses are parsed. Scan, clean and group-by
+        are fused into one pipeline and are timed as one stage.
+        """
+        self.logger.info("Aggregating %s with streaming engine", input_csv_path)
+        if self.memory_limit:
+            df = self.compiled.finalize(self._partial_aggregate_blocks(input_csv_path).lazy()).collect()
+        else:
+            plan = self.compiled.plan(self._scan_csv(input_csv_path))
+            with self.trace.stage("scan_clean_group"):
+                df = plan.collect(engine="streaming")
+        with self.trace.stage("write_result"):
+            self._write_result(df, output_csv_path)
+
+    def _aggregate_compressed(self, input_csv_path: Union[str, bytes], compression: str, output_csv_path: str) -> None:
+        """Aggregate a compressed file from its decompressed stream, for either engine."""
+        self.logger.info("Aggregating %s-compressed %s as a stream", compression, input_csv_path)
+        partial = self._partial_aggregate_stream(input_csv_path, compression)
+        df = self.compiled.finalize(partial.lazy()).collect()
+        with self.trace.stage("write_result"):
+            self._write_result(df, output_csv_path)
+
+    def _partial_aggregate(self, input_csv_path: Union[str, bytes]) -> pl.DataFrame:
+        """Per-group partial states for one input, returned in memory for merging."""
+        self.trace.bytes_read += os.path.getsize(input_csv_path)
+        compression = file_compression(input_csv_path)
+        if compression:
+            return self._partial_aggregate_stream(input_csv_path, compression)
+        partial = self._columnar_partial(input_csv_path)
+        if partial is not None:
+            return partial
+        if self.memory_limit:
+            return self._partial_aggregate_blocks(input_csv_path)
+        plan = self.compiled.partial(self._scan_csv(input_csv_path))
+        with self.trace.stage("scan_clean_group"):
+            return plan.collect(engine="streaming")
+
+    def _partial_aggregate_stream(self, input_csv_path: Union[str, bytes], compression: str) -> pl.DataFrame:
+        """Per-group partial states of a compressed file, decompressed block by block.
+
+        Each record-aligned block is parsed with the header prepended and
+        folded into the running states, so memory holds one block plus the
+        groups, and nothing decompressed is written out.
+        """
+        with self.trace.stage("scan_clean_group"), open_decompressed(os.fsdecode(input_csv_path), compression) as stream:
+            blocks = iter_stream_blocks(stream, self._block_bytes())
+            first = next(blocks, b"")
+            header_end = first.find(b"\n") + 1 or len(first)
+            return self._fold_blocks(first[:header_end], itertools.chain([first[header_end:]], blocks), self.compiled)
+
+    def _partial_aggregate_blocks(self, input_csv_path: Union[str, bytes]) -> pl.DataFrame:
+        """Per-group partial states of a plain file parsed block by block, to stay within ``memory_limit``."""
+        path = os.fsdecode(input_csv_path)
+        with self.trace.stage("scan_clean_group"):
+            header, _ = plan_cuts(path, 1)
+            blocks = iter_record_blocks(path, len(header), os.path.getsize(path), self._block_bytes())
+            return self._fold_blocks(header, blocks, self.compiled)
+
+    @staticmethod
+    def _fold_blocks(header: bytes, blocks: Iterable[bytes], compiled: CompiledQuery) -> pl.DataFrame:
+        """Parse each block with the header prepended and fold it into the running states."""
+        state = None
+        for block in blocks:
+            partial = AsyncCSVReaderService._partial_aggregate_bytes(header + block, compiled)
+            state = partial if state is None else compiled.combine([state, partial])
+        return state if state is not None else AsyncCSVReaderService._partial_aggregate_bytes(header, compiled)
+
+    @staticmethod
+    def _partial_aggregate_bytes(data: bytes, compiled: CompiledQuery) -> pl.DataFrame:
+        """Per-group partial states for an in-memory CSV fragment (header included)."""
+        columns = compiled.spec.columns()
+        df = pl.read_csv(
+            io.BytesIO(data),
+            columns=columns,
+            schema_overrides={c: CSV_SCHEMA[c] for c in columns},
+            ignore_errors=True,
+            rechunk=False,
+        )
+        return compiled.partial(df.lazy()).collect()
+
+    def _columnar_partial(
+        self, input_csv_path: Union[str, bytes], fingerprint: Optional[str] = None
+    ) -> Optional[pl.DataFrame]:
+        """Per-group partial states read from the input's columnar copy; None when there is none.
+
+        The Parquet engine (or any engine with ``columnar="always"``) builds
+        the copy first. A copy that cannot be built or read is skipped, and
+        the CSV is aggregated instead.
+        """
+        if self.columnar == "off":
+            return None
+        store = ColumnarStore(self.columnar_dir)
+        try:
+            copy = store.get(input_csv_path, fingerprint)
+            if copy is None and (self.columnar == "always" or self.engine == "parquet"):
+                self.logger.info("Building columnar copy of %s", input_csv_path)
+                with self.trace.stage("columnar_build"):
+                    copy = store.build(input_csv_path, clean_sales(self._scan_csv(input_csv_path)), fingerprint)
+            return self._partial_aggregate_columnar(copy) if copy else None
+        except (OSError, pl.exceptions.ComputeError) as e:
+            self.logger.warning("Columnar copy of %s unusable, reading the CSV: %s", input_csv_path, e)
+            return None
+
+    def _partial_aggregate_columnar(self, copy: ColumnarCopy) -> pl.DataFrame:
+        """Per-group partial states of a columnar copy, skipping row groups the filters cannot match."""
+        runs = copy.runs(self.query.filters)
+        read = sum(math.ceil(length / copy.row_group_rows) for _, length in runs)
+        self.trace.row_groups["read"] += read
+        self.trace.row_groups["skipped"] += len(copy.row_groups) - read
+        self.logger.info("Scanning columnar copy %s: %s of %s row groups", copy.path, read, len(copy.row_groups))
+        with self.trace.stage("scan_clean_group"):
+            # Each run is its own scan so that its slice is pushed into the Parquet reader
+            partials = [
+                self.compiled.partial(copy.scan(offset, length), cleaned=True).collect(engine="streaming")
+                for offset, length in runs or [(0, 0)]
+            ]
+            return self.compiled.combine(partials) if len(partials) > 1 else partials[0]
+
+    def _aggregate_via_parquet(self, input_csv_path: Union[str, bytes], output_csv_path: str) -> None:
+        """Legacy path: spill the cleaned rows to a temporary Parquet file, then group.
+
+        Used by ``engine="parquet"`` when columnar copies are off; with them
+        on, the conversion is kept as the input's copy instead. It materialises
+        the whole cleaned file in memory before writing it out.
+        """
+        self.logger.info("Converting CSV to Parquet for file: %s", input_csv_path)
+        with tempfile.NamedTemporaryFile(suffix='.parquet', delete=True) as tmp_parquet:
+            lf = self.compiled.prepare(self._scan_csv(input_csv_path))
+            with self.trace.stage("parquet_spill"):
+                lf.collect().write_parquet(tmp_parquet.name)
+            self.logger.info("CSV converted to Parquet: %s", tmp_parquet.name)
+            lf_parquet: pl.LazyFrame = pl.scan_parquet(tmp_parquet.name, low_memory=True)
+            self.logger.info("Aggregating using DEX engine.")
+            with self.trace.stage("group_by"):
+                df: pl.DataFrame = self.compiled.finalize(self.compiled.group(lf_parquet)).collect()
+            with self.trace.stage("write_result"):
+                self._write_result(df, output_csv_path)
+
+    def _write_result(self, df: pl.DataFrame, output_path: str) -> None:
+        """Write the final result in the requested format; the row and cleaning counts only feed the trace."""
+        self.trace.rows = int(df[ROWS_COLUMN].sum() or 0)
+        self.trace.cleaning = {outcome: int(df[name].sum() or 0) for outcome, name in CLEANING_COLUMNS.items()}
+        write_result(df.drop(BOOKKEEPING_COLUMNS), output_path, self.output)
+
+    def _scan_csv(self, input_csv_path: Union[str, bytes]) -> pl.LazyFrame:
+        return pl.scan_csv(
+            input_csv_path,
+            schema_overrides=CSV_SCHEMA,
+            ignore_errors=True,
+            low_memory=True,
+            rechunk=False,
+        )
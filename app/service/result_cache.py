@@ -0,0 +1,166 @@
+import hashlib
+import json
+import os
+import shutil
+import threading
+import time
+from contextlib import contextmanager
+from typing import Any, Dict, Optional
+from app.utils.logger import Logger
+
+try:  # POSIX only; on other platforms the cache is only safe within one process
+    import fcntl
+except ImportError:  # pragma: no cover
+    fcntl = None
+
+DEFAULT_ENABLED = os.getenv("RESULT_CACHE_ENABLED", "1") != "0"
+DEFAULT_MAX_BYTES = int(os.getenv("RESULT_CACHE_MAX_BYTES", 1024 * 1024 * 1024))
+DEFAULT_MAX_ENTRIES = int(os.getenv("RESULT_CACHE_MAX_ENTRIES", 10_000))
+DEFAULT_MAX_AGE = float(os.getenv("RESULT_CACHE_MAX_AGE", 7 * 24 * 3600))
+
+INDEX_FILE = "index.json"
+LOCK_FILE = ".lock"
+
+
+def fingerprint_key(fingerprint: str, spec: Dict[str, Any]) -> str:
+    """Cache key for an input fingerprint combined with an aggregation spec."""
+    canonical = json.dumps(spec, sort_keys=True, separators=(",", ":"))
+    return hashlib.sha256(f"{fingerprint}:{canonical}".encode()).hexdigest()
+
+
+class ResultCache:
+    """Content-addressed store of finished aggregation results.
+
+    Entries are keyed by the upload's content hash plus the aggregation spec.
+    The cache owns its own hard-linked copy of every result, so evicting an
+    entry never removes a file a job still points at and vice versa. The
+    index lives next to the files and is guarded by a thread lock and, where
+    available, an advisory file lock so several workers can share it.
+    """
+
+    def __init__(
+        self,
+        cache_dir: str,
+        max_bytes: int = DEFAULT_MAX_BYTES,
+        max_entries: int = DEFAULT_MAX_ENTRIES,
+        max_age: float = DEFAULT_MAX_AGE,
+        logger: Optional[Logger] = None,
+        enabled: bool = DEFAULT_ENABLED
+    ):
+        self.cache_dir = cache_dir
+        self.enabled = enabled
+        self.max_bytes = max_bytes
+        self.max_entries = max_entries
+        self.max_age = max_age
+        self.logger = logger or Logger()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self._lock = threading.Lock()
+
+    def get(self, fingerprint: str, spec: Dict[str, Any], dest_path: str) -> Optional[str]:
+        """Materialise a cached result at ``dest_path``; returns it on a hit, else None."""
+        if not self.enabled:
+            return None
+        key = fingerprint_key(fingerprint, spec)
+        with self._locked() as index:
+            entry = index.get(key)
+            now = time.time()
+            if entry and now - entry["created"] <= self.max_age and os.path.exists(entry["path"]):
+                _link_or_copy(entry["path"], dest_path)
+                entry["last_access"] = now
+                self.hits += 1
+                self.logger.info("Result cache hit for %s", fingerprint[:12])
+                return dest_path
+            if entry:
+                self._drop(index, key)
+            self.misses += 1
+            return None
+
+    def put(self, fingerprint: str, spec: Dict[str, Any], result_path: str) -> None:
+        if not self.enabled:
+            return
+        key = fingerprint_key(fingerprint, spec)
+        cached_path = os.path.join(self.cache_dir, key + os.path.splitext(result_path)[1])
+        with self._locked() as index:
+            if key in index:
+                # A replacement, not an eviction
+                self._drop(index, key, evicted=False)
+            _link_or_copy(result_path, cached_path)
+            now = time.time()
+            index[key] = {
+                "path": cached_path,
+                "size": os.path.getsize(cached_path),
+                "created": now,
+                "last_access": now,
+            }
+            self._evict(index)
+
+    def stats(self) -> Dict[str, Any]:
+        with self._locked(write=False) as index:
+            return {
+                "hits": self.hits,
+                "misses": self.misses,
+                "evictions": self.evictions,
+                "entries": len(index),
+                "bytes": sum(e["size"] for e in index.values()),
+            }
+
+    def _evict(self, index: Dict[str, Dict[str, Any]]) -> None:
+        now = time.time()
+        for key in [k for k, e in index.items() if now - e["created"] > self.max_age]:
+            self._drop(index, key)
+        total = sum(e["size"] for e in index.values())
+        # Least recently used entries go first
+        for key in sorted(index, key=lambda k: index[k]["last_access"]):
+            if total <= self.max_bytes and len(index) <= self.max_entries:
+                break
+            total -= index[key]["size"]
+            self._drop(index, key)
+
+    def _drop(self, index: Dict[str, Dict[str, Any]], key: str, evicted: bool = True) -> None:
+        entry = index.pop(key)
+        if evicted:
+            self.evictions += 1
+        try:
+            os.remove(entry["path"])
+        except FileNotFoundError:
+            pass
+
+    @contextmanager
+    def _locked(self, write: bool = True):
+        """Yield the index under the lock; with ``write`` it is saved back afterwards."""
+        os.makedirs(self.cache_dir, exist_ok=True)
+        with self._lock, open(os.path.join(self.cache_dir, LOCK_FILE), "a") as lock_file:
+            if fcntl:
+                fcntl.flock(lock_file, fcntl.LOCK_EX if write else fcntl.LOCK_SH)
+            try:
+                index = self._load_index()
+                yield index
+                if write:
+                    self._save_index(index)
+            finally:
+                if fcntl:
+                    fcntl.flock(lock_file, fcntl.LOCK_UN)
+
+    def _load_index(self) -> Dict[str, Dict[str, Any]]:
+        try:
+            with open(os.path.join(self.cache_dir, INDEX_FILE)) as f:
+                return json.load(f)
+        except (FileNotFoundError, json.JSONDecodeError):
+            return {}
+
+    def _save_index(self, index: Dict[str, Dict[str, Any]]) -> None:
+        path = os.path.join(self.cache_dir, INDEX_FILE)
+        tmp_path = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+        with open(tmp_path, "w") as f:
+            json.dump(index, f)
+        os.replace(tmp_path, path)
+
+
+def _link_or_copy(src: str, dst: str) -> None:
+    """Hard-link ``src`` to ``dst`` (no data copied); fall back to a copy across devices."""
+    try:
+        os.link(src, dst)
+    except OSError:
+        shutil.copyfile(src, dst)
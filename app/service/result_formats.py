@@ -0,0 +1,103 @@
+import gzip
+import io
+from contextlib import nullcontext
+from dataclasses import dataclass
+from typing import Any, BinaryIO, Dict, Optional
+import polars as pl
+
+try:  # Optional: only needed to write zstd-compressed CSV/NDJSON
+    import zstandard
+except ImportError:  # pragma: no cover
+    zstandard = None
+
+OUTPUT_FORMATS = ("csv", "parquet", "ipc", "ndjson")
+COMPRESSIONS = ("none", "gzip", "zstd")
+EXTENSIONS = {"csv": ".csv", "parquet": ".parquet", "ipc": ".arrow", "ndjson": ".ndjson"}
+MEDIA_TYPES = {
+    "csv": "text/csv",
+    "parquet": "application/vnd.apache.parquet",
+    "ipc": "application/vnd.apache.arrow.file",
+    "ndjson": "application/x-ndjson",
+}
+# Text formats are wrapped in a compressed stream (served with Content-Encoding);
+# Parquet and Arrow IPC compress their own pages/buffers.
+STREAM_FORMATS = ("csv", "ndjson")
+STREAM_EXTENSIONS = {"gzip": ".gz", "zstd": ".zst"}
+
+
+@dataclass(frozen=True)
+class OutputOptions:
+    """How a job's result is written: file format plus optional compression."""
+
+    format: str = "csv"
+    compression: str = "none"
+
+    def __post_init__(self):
+        if self.format not in OUTPUT_FORMATS:
+            raise ValueError(f"Unknown output format '{self.format}', expected one of {OUTPUT_FORMATS}")
+        if self.compression not in COMPRESSIONS:
+            raise ValueError(f"Unknown compression '{self.compression}', expected one of {COMPRESSIONS}")
+        if self.format == "ipc" and self.compression == "gzip":
+            raise ValueError("Arrow IPC supports zstd compression, not gzip")
+        if self.content_encoding == "zstd" and zstandard is None:
+            raise ValueError(f"zstd compression of {self.format} results requires the 'zstandard' package")
+
+    @property
+    def content_encoding(self) -> Optional[str]:
+        """HTTP content coding of the stored bytes, if the format is wrapped in one."""
+        if self.format in STREAM_FORMATS and self.compression != "none":
+            return self.compression
+        return None
+
+    @property
+    def extension(self) -> str:
+        return EXTENSIONS[self.format] + STREAM_EXTENSIONS.get(self.content_encoding, "")
+
+    @property
+    def media_type(self) -> str:
+        return MEDIA_TYPES[self.format]
+
+    def to_dict(self) -> Dict[str, Any]:
+        return {"format": self.format, "compression": self.compression}
+
+
+def write_result(df: pl.DataFrame, path: str, options: OutputOptions) -> None:
+    compression = None if options.compression == "none" else options.compression
+    if options.format == "parquet":
+        df.write_parquet(path, compression=compression or "uncompressed")
+    elif options.format == "ipc":
+        df.write_ipc(path, compression=compression or "uncompressed")
+    else:
+        with open(path, "wb") as raw, _encoder(raw, compression) as f:
+            if options.format == "csv":
+                df.write_csv(f)
+            else:
+                df.write_ndjson(f)
+
+
+def read_result(path: str, options: OutputOptions) -> pl.DataFrame:
+    if options.format == "parquet":
+        return pl.read_parquet(path)
+    if options.format == "ipc":
+        return pl.read_ipc(path, memory_map=False)
+    with open_decoded(path, options) as f:
+        data = f.read()
+    return pl.read_csv(io.BytesIO(data)) if options.format == "csv" else pl.read_ndjson(io.BytesIO(data))
+
+
+def open_decoded(path: str, options: OutputOptions) -> BinaryIO:
+    """The stored result with any stream compression undone, for clients that cannot accept it."""
+    if options.content_encoding == "gzip":
+        return gzip.open(path, "rb")
+    if options.content_encoding == "zstd":
+        return zstandard.ZstdDecompressor().stream_reader(open(path, "rb"), closefd=True)
+    return open(path, "rb")
+
+
+def _encoder(raw: BinaryIO, compression: Optional[str]):
+    if compression == "gzip":
+        return gzip.GzipFile(fileobj=raw, mode="wb", compresslevel=6)
+    if compression == "zstd":
+        return zstandard.ZstdCompressor().stream_writer(raw, closefd=False)
+    return nullcontext(raw)
+
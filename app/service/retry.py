@@ -0,0 +1,51 @@
+"""
+Retry policy for aggregation work
+
+An error is fatal when running the same work again cannot change the
+outcome: a missing or unreadable input, a column the file does not have,
+or data Polars rejects. Those fail the job on the first attempt. Anything
+else (I/O hiccups, a worker process that died, running out of memory) is
+retried with exponential backoff and jitter, so retries from many jobs
+that failed together do not hit the machine at the same moment.
+"""
+import os
+import random
+from concurrent.futures import BrokenExecutor
+import polars as pl
+
+# Cap on the wait between two attempts, whatever the attempt number
+RETRY_MAX_DELAY = float(os.getenv("CSV_RETRY_MAX_DELAY", 60))
+
+FATAL_ERRORS = (
+    FileNotFoundError,
+    IsADirectoryError,
+    NotADirectoryError,
+    PermissionError,
+    KeyError,
+    TypeError,
+    ValueError,
+    pl.exceptions.ColumnNotFoundError,
+    pl.exceptions.SchemaError,
+    pl.exceptions.SchemaFieldNotFoundError,
+    pl.exceptions.InvalidOperationError,
+    pl.exceptions.ComputeError,
+    pl.exceptions.NoDataError,
+)
+RETRYABLE_ERRORS = (BrokenExecutor, MemoryError, TimeoutError, ConnectionError)
+
+
+def is_retryable(error: BaseException) -> bool:
+    """Whether another attempt at the same work could succeed; unknown errors count as retryable."""
+    if isinstance(error, RETRYABLE_ERRORS):
+        return True
+    return not isinstance(error, FATAL_ERRORS)
+
+
+def backoff_delay(attempt: int, base: float, max_delay: float = RETRY_MAX_DELAY) -> float:
+    """Seconds to wait after the ``attempt``-th failure (1-based).
+
+    Doubles from ``base`` up to ``max_delay``, then waits a random amount
+    between half of that and all of it.
+    """
+    ceiling = min(max_delay, base * 2 ** (attempt - 1))
+    return ceiling / 2 + random.uniform(0, ceiling / 2)
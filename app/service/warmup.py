@@ -0,0 +1,49 @@
+"""
+Startup warm-up
+
+The first job in a fresh process otherwise pays for Polars' lazy
+initialisation (its thread pool, the CSV reader and the streaming engine),
+the creation of the job executor and of asyncio's default thread pool, and,
+with the process backend, spawning every child and importing Polars in it.
+``warm_up`` does all of that once at startup on a small built-in file.
+"""
+import asyncio
+import os
+import tempfile
+from typing import Optional
+from app.service.executor import ExecutionBackend, get_execution_backend
+from app.service.query import CompiledQuery, QuerySpec
+from app.service.reader_service import AsyncCSVReaderService
+from app.utils.logger import Logger
+
+# "on" warms up the API before /ready reports ready, and worker daemons before they claim jobs
+DEFAULT_PREWARM = os.getenv("API_PREWARM", "on") == "on"
+
+WARMUP_CSV = (
+    b"Department Name,Date,Number of Sales\n"
+    b"Sales,2024-01-01,3\nSupport,2024-01-02,5\nSales,2024-01-03,n/a\n"
+)
+
+
+def _warm_up_job() -> int:
+    """Aggregate the built-in file in memory; module-level so the process backend can run it."""
+    return len(AsyncCSVReaderService._partial_aggregate_bytes(WARMUP_CSV, CompiledQuery(QuerySpec())))
+
+
+async def warm_up(executor: Optional[ExecutionBackend] = None, logger: Optional[Logger] = None) -> None:
+    """Run a tiny aggregation end to end and start every executor worker."""
+    executor = executor or get_execution_backend()
+    logger = logger or Logger()
+    with tempfile.TemporaryDirectory(prefix="csv-warmup-") as directory:
+        path = os.path.join(directory, "warmup.csv")
+        # Also starts asyncio's default thread pool, used for uploads and cache I/O
+        await asyncio.to_thread(_write, path, WARMUP_CSV)
+        service = AsyncCSVReaderService(logger=logger, executor=executor, checkpoints=False, columnar="off")
+        await service.aggregate_sales_by_department(path, directory, retries=1)
+    # One call per pool slot at once, so every thread or child process is started
+    await asyncio.gather(*(executor.run(_warm_up_job) for _ in range(executor.pool_size)))
+
+
+def _write(path: str, data: bytes) -> None:
+    with open(path, "wb") as f:
+        f.write(data)
@@ -0,0 +1,245 @@
+"""
+Ingest-to-download benchmark
+
+Builds fixed-seed datasets with generate_csv_vectorized and measures:
+- the AsyncCSVReaderService call on its own (rows/sec, MB/s, peak RSS)
+- the full /process -> /job_status -> /download path under concurrency,
+  split into upload, queue wait, processing and download latency
+
+Results are written as JSON. With --baseline, every metric is compared to a
+previous run and the process exits non-zero when any of them regresses by
+more than --threshold.
+"""
+import argparse
+import asyncio
+import json
+import logging
+import os
+import platform
+import statistics
+import tempfile
+import time
+import uuid
+from typing import Any, Dict, List, Optional
+from app.utils.generate_csv import generate_csv_vectorized
+from app.utils.metrics import PeakRSS
+
+DEFAULT_SIZES = [1_000_000, 10_000_000, 50_000_000]
+DEFAULT_SEED = 42
+DEFAULT_DIRTY_RATE = 0.01
+START_DATE = "2020-01-01"
+END_DATE = "2024-12-31"
+POLL_INTERVAL = 0.05
+DEFAULT_JOB_TIMEOUT = 3600.0
+# Higher is better for these metrics; for all others (latencies, memory) lower is better
+HIGHER_IS_BETTER = {"rows_per_sec", "mb_per_sec"}
+
+
+def build_dataset(data_dir: str, rows: int, seed: int, dirty_rate: float) -> str:
+    """Generate (once) a dataset of ``rows`` rows; the same arguments always give the same file."""
+    variant = f"dirty{dirty_rate:g}" if dirty_rate else "clean"
+    directory = os.path.join(data_dir, f"{rows}_{variant}_seed{seed}")
+    path = os.path.join(directory, "sales_data_1.csv")
+    if not os.path.exists(path):
+        os.makedirs(directory, exist_ok=True)
+        generate_csv_vectorized(1, rows, directory, START_DATE, END_DATE, malformed_rate=dirty_rate, seed=seed)
+    return path
+
+
+async def bench_service(path: str, rows: int, repeat: int) -> Dict[str, Any]:
+    from app.service.reader_service import AsyncCSVReaderService
+
+    service = AsyncCSVReaderService()
+    size = os.path.getsize(path)
+    timings = []
+    with tempfile.TemporaryDirectory() as out_dir, PeakRSS() as rss:
+        for _ in range(repeat):
+            start = time.perf_counter()
+            await service.aggregate_sales_by_department(path, out_dir, retries=1)
+            timings.append(time.perf_counter() - start)
+    seconds = statistics.median(timings)
+    return {
+        "seconds": seconds,
+        "rows_per_sec": rows / seconds,
+        "mb_per_sec": size / seconds / 1e6,
+        "peak_rss_mb": rss.peak / 1e6,
+    }
+
+
+def _drain_queue(queue) -> int:
+    """Discard jobs left on the in-process queue so the benchmark only times its own."""
+    drained = 0
+    while not queue.empty():
+        queue.task_done(queue.get_nowait())
+        drained += 1
+    return drained
+
+
+async def bench_api(
+    path: str,
+    rows: int,
+    concurrency: int,
+    base_url: Optional[str],
+    job_timeout: float = DEFAULT_JOB_TIMEOUT
+) -> Dict[str, Any]:
+    """Submit ``concurrency`` jobs at once and follow each through to its download."""
+    import httpx
+
+    worker_tasks = []
+    cache = None
+    cache_enabled = None
+    if base_url:
+        client = httpx.AsyncClient(base_url=base_url, timeout=None)
+    else:
+        from app.api.api import app
+        from app.api.state import job_queue, result_cache
+        from app.api.worker import worker
+
+        drained = _drain_queue(job_queue)
+        if drained:
+            logging.warning(f"Discarded {drained} stale jobs from the in-process queue.")
+        # Identical uploads must not be served from the cache; restored below
+        cache, cache_enabled = result_cache, result_cache.enabled
+        cache.enabled = False
+        worker_tasks = [asyncio.create_task(worker()) for _ in range(concurrency)]
+        client = httpx.AsyncClient(transport=httpx.ASGITransport(app=app), base_url="http://bench", timeout=None)
+
+    async def one_job():
+        job_id = f"bench-{uuid.uuid4().hex}"
+        stages = {}
+        start = time.perf_counter()
+        with open(path, "rb") as f:
+            response = await client.post(f"/process?job_id={job_id}", files={"csv_file": (os.path.basename(path), f, "text/csv")})
+        response.raise_for_status()
+        stages["upload"] = time.perf_counter() - start
+        deadline = time.monotonic() + job_timeout
+        while True:
+            status = (await client.get(f"/job_status/{job_id}")).json()
+            if status["status"] in ("FINISHED", "FAILED"):
+                break
+            if time.monotonic() > deadline:
+                raise TimeoutError(f"Benchmark job {job_id} did not finish within {job_timeout} seconds")
+            await asyncio.sleep(POLL_INTERVAL)
+        if status["status"] == "FAILED":
+            raise RuntimeError(f"Benchmark job {job_id} failed: {status['error']}")
+        waited = time.perf_counter() - start - stages["upload"]
+        stages["processing"] = status["processing_time"] or 0.0
+        stages["queue_wait"] = max(0.0, waited - stages["processing"])
+        download_start = time.perf_counter()
+        response = await client.get(f"/download/{job_id}")
+        response.raise_for_status()
+        stages["download"] = time.perf_counter() - download_start
+        stages["total"] = time.perf_counter() - start
+        return stages
+
+    try:
+        with PeakRSS() as rss:
+            start = time.perf_counter()
+            per_job = await asyncio.gather(*(one_job() for _ in range(concurrency)))
+            wall = time.perf_counter() - start
+    finally:
+        await client.aclose()
+        for task in worker_tasks:
+            task.cancel()
+        if cache is not None:
+            cache.enabled = cache_enabled
+    result = {
+        "seconds": wall,
+        "rows_per_sec": rows * concurrency / wall,
+        "peak_rss_mb": rss.peak / 1e6,
+    }
+    for stage in ("upload", "queue_wait", "processing", "download", "total"):
+        result[f"{stage}_p50_seconds"] = statistics.median(job[stage] for job in per_job)
+        result[f"{stage}_max_seconds"] = max(job[stage] for job in per_job)
+    return result
+
+
+def compare_results(current: Dict[str, Any], baseline: Dict[str, Any], threshold: float) -> List[str]:
+    """Human-readable regressions of ``current`` against ``baseline`` beyond ``threshold``."""
+    regressions = []
+    baseline_by_name = {r["name"]: r for r in baseline.get("results", [])}
+    for result in current.get("results", []):
+        previous = baseline_by_name.get(result["name"])
+        if not previous:
+            continue
+        for metric, value in result["metrics"].items():
+            old = previous["metrics"].get(metric)
+            if not old or metric == "seconds":
+                continue
+            change = (value - old) / old
+            worse = -change if metric in HIGHER_IS_BETTER else change
+            if worse > threshold:
+                regressions.append(f"{result['name']} {metric}: {old:.4g} -> {value:.4g} ({worse:+.1%} worse)")
+    return regressions
+
+
+async def run(args) -> Dict[str, Any]:
+    import polars as pl
+
+    results = []
+    for rows in args.rows:
+        for dirty_rate in sorted({0.0, args.dirty_rate}):
+            path = build_dataset(args.data_dir, rows, args.seed, dirty_rate)
+            variant = "dirty" if dirty_rate else "clean"
+            if "service" in args.stages:
+                metrics = await bench_service(path, rows, args.repeat)
+                results.append({"name": f"service/{rows}/{variant}", "metrics": metrics})
+                logging.info(f"service/{rows}/{variant}: {metrics}")
+            if "api" in args.stages:
+                metrics = await bench_api(path, rows, args.concurrency, args.base_url, args.job_timeout)
+                results.append({"name": f"api/{rows}/{variant}/c{args.concurrency}", "metrics": metrics})
+                logging.info(f"api/{rows}/{variant}/c{args.concurrency}: {metrics}")
+    return {
+        "meta": {
+            "timestamp": time.strftime("%Y-%m-%dT%H:%M:%S"),
+            "seed": args.seed,
+            "dirty_rate": args.dirty_rate,
+            "repeat": args.repeat,
+            "concurrency": args.concurrency,
+            "python": platform.python_version(),
+            "polars": pl.__version__,
+            "platform": platform.platform(),
+            "cpu_count": os.cpu_count(),
+        },
+        "results": results,
+    }
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description="Benchmark the CSV aggregation service and API.")
+    parser.add_argument("--rows", type=int, nargs="+", default=DEFAULT_SIZES, help="Dataset sizes in rows.")
+    parser.add_argument("--seed", type=int, default=DEFAULT_SEED, help="Random seed for dataset generation.")
+    parser.add_argument("--dirty_rate", type=float, default=DEFAULT_DIRTY_RATE, help="Share of malformed 'Number of Sales' values in the dirty variant (0 disables it).")
+    parser.add_argument("--data_dir", type=str, default="bench_data", help="Where generated datasets are kept between runs.")
+    parser.add_argument("--stages", nargs="+", choices=["service", "api"], default=["service", "api"], help="What to measure.")
+    parser.add_argument("--repeat", type=int, default=3, help="Service runs per dataset; the median is reported.")
+    parser.add_argument("--concurrency", type=int, default=4, help="Concurrent jobs in the API benchmark.")
+    parser.add_argument("--base_url", type=str, default=None, help="Benchmark a running server instead of the in-process app.")
+    parser.add_argument("--job_timeout", type=float, default=DEFAULT_JOB_TIMEOUT, help="Seconds to wait for one API job before failing the run.")
+    parser.add_argument("-o", "--output", type=str, default="bench_results.json", help="Where to write the JSON results.")
+    parser.add_argument("--baseline", type=str, default=None, help="Previous results JSON to compare against.")
+    parser.add_argument("--threshold", type=float, default=0.10, help="Allowed relative regression per metric.")
+    return parser.parse_args(argv)
+
+
+def main(argv=None) -> int:
+    args = parse_args(argv)
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s %(levelname)s: %(message)s')
+    report = asyncio.run(run(args))
+    with open(args.output, "w") as f:
+        json.dump(report, f, indent=2)
+    logging.info(f"Results written to {args.output}")
+    if args.baseline:
+        with open(args.baseline) as f:
+            baseline = json.load(f)
+        regressions = compare_results(report, baseline, args.threshold)
+        for line in regressions:
+            logging.error(f"Regression: {line}")
+        if regressions:
+            return 1
+        logging.info("No regressions against baseline.")
+    return 0
+
+
+if __name__ == "__main__":
+    raise SystemExit(main())
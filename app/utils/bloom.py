@@ -0,0 +1,156 @@
+import hashlib
+import math
+import struct
+from threading import Lock
+from typing import List, Set
+
+
+class BloomFilter:
+    """Scalable Bloom filter for set membership in a fixed number of bits per item.
+
+    Never reports a member as absent; reports a non-member as present with
+    probability at most ``error_rate``. When a layer reaches capacity a new,
+    twice-as-large layer is added, so the filter grows with the number of
+    items without the false-positive rate drifting upwards. Layers touched
+    since the last ``mark_clean`` are reported by ``dirty_layers`` so they
+    can be persisted one at a time.
+    """
+
+    def __init__(self, capacity: int = 100_000, error_rate: float = 1e-6):
+        self.capacity = capacity
+        self.error_rate = error_rate
+        self._layers: List[_Layer] = []
+        self._dirty: Set[int] = set()
+        self._lock = Lock()
+        self.clear()
+
+    def add(self, item: str) -> None:
+        h1, h2 = _hashes(item)
+        with self._lock:
+            if _in_layers(self._layers, h1, h2):
+                return
+            if self._layers[-1].count >= self._layers[-1].capacity:
+                self._grow()
+            self._layers[-1].add(h1, h2)
+            self._dirty.add(len(self._layers) - 1)
+
+    def __contains__(self, item: str) -> bool:
+        h1, h2 = _hashes(item)
+        with self._lock:
+            return _in_layers(self._layers, h1, h2)
+
+    def __len__(self) -> int:
+        return sum(layer.count for layer in self._layers)
+
+    def clear(self) -> None:
+        with self._lock:
+            self._layers = [_Layer(self.capacity, self.error_rate / 2)]
+            self._dirty.clear()
+
+    def dirty_layers(self) -> List[int]:
+        with self._lock:
+            return sorted(self._dirty)
+
+    def mark_clean(self, indices) -> None:
+        with self._lock:
+            self._dirty.difference_update(indices)
+
+    def layer_bytes(self, index: int) -> bytes:
+        with self._lock:
+            return self._layers[index].to_bytes()
+
+    def merge_layer_bytes(self, index: int, data: bytes) -> None:
+        """OR in one serialised layer written by a filter with the same parameters."""
+        other = _Layer.from_bytes(data, 0)[0]
+        with self._lock:
+            while len(self._layers) <= index:
+                self._grow()
+            mine = self._layers[index]
+            if len(mine.bits) == len(other.bits):
+                mine.merge(other)
+
+    @property
+    def nbytes(self) -> int:
+        return sum(len(layer.bits) for layer in self._layers)
+
+    def to_bytes(self) -> bytes:
+        with self._lock:
+            parts = [struct.pack(">I", len(self._layers))]
+            parts.extend(layer.to_bytes() for layer in self._layers)
+            return b"".join(parts)
+
+    def merge_bytes(self, data: bytes) -> None:
+        """OR in the bits of a serialised filter built with the same parameters."""
+        other = _layers_from_bytes(data)
+        with self._lock:
+            for i, layer in enumerate(other):
+                if i < len(self._layers) and len(self._layers[i].bits) == len(layer.bits):
+                    self._layers[i].merge(layer)
+                elif i >= len(self._layers):
+                    self._layers.append(layer)
+
+    def _grow(self) -> None:
+        last = self._layers[-1]
+        # Tighten each new layer so the compound error stays bounded
+        self._layers.append(_Layer(last.capacity * 2, last.error_rate / 2))
+
+
+class _Layer:
+    def __init__(self, capacity: int, error_rate: float):
+        self.capacity = capacity
+        self.error_rate = error_rate
+        self.count = 0
+        num_bits = max(8, int(-capacity * math.log(error_rate) / (math.log(2) ** 2)))
+        self.num_hashes = max(1, round(num_bits / capacity * math.log(2)))
+        self.bits = bytearray((num_bits + 7) // 8)
+
+    def positions(self, h1: int, h2: int):
+        # Enhanced double hashing: the cubic term keeps probes independent for large k
+        num_bits = len(self.bits) * 8
+        return ((h1 + i * h2 + (i * i * i - i) // 6) % num_bits for i in range(self.num_hashes))
+
+    def add(self, h1: int, h2: int) -> None:
+        for pos in self.positions(h1, h2):
+            self.bits[pos >> 3] |= 1 << (pos & 7)
+        self.count += 1
+
+    def __contains__(self, hashes) -> bool:
+        return all(self.bits[pos >> 3] & (1 << (pos & 7)) for pos in self.positions(*hashes))
+
+    def merge(self, other: "_Layer") -> None:
+        merged = int.from_bytes(self.bits, "big") | int.from_bytes(other.bits, "big")
+        self.bits = bytearray(merged.to_bytes(len(self.bits), "big"))
+        self.count = max(self.count, other.count)
+
+    def to_bytes(self) -> bytes:
+        return struct.pack(">QdQI", self.capacity, self.error_rate, self.count, len(self.bits)) + bytes(self.bits)
+
+    @classmethod
+    def from_bytes(cls, data: bytes, offset: int):
+        """Parse one layer at ``offset``; returns it with the offset just past it."""
+        capacity, error_rate, count, size = struct.unpack_from(">QdQI", data, offset)
+        offset += struct.calcsize(">QdQI")
+        layer = cls(capacity, error_rate)
+        layer.bits = bytearray(data[offset:offset + size])
+        layer.count = count
+        return layer, offset + size
+
+
+def _in_layers(layers: List[_Layer], h1: int, h2: int) -> bool:
+    return any((h1, h2) in layer for layer in layers)
+
+
+def _hashes(item: str):
+    digest = hashlib.blake2b(item.encode(), digest_size=16).digest()
+    h1, h2 = struct.unpack(">QQ", digest)
+    return h1, h2
+
+
+def _layers_from_bytes(data: bytes) -> List[_Layer]:
+    (num_layers,) = struct.unpack_from(">I", data, 0)
+    offset = 4
+    layers = []
+    for _ in range(num_layers):
+        layer, offset = _Layer.from_bytes(data, offset)
+        layers.append(layer)
+    return layers
@@ -7,14 +7,20 @@ Improvements:
 - Buffered writing for performance
 - Optional random seed for reproducibility
 - Logging for status and errors
+- Vectorized mode: rows are built in columnar batches with Polars and
+  files are generated in a process pool
+- Controlled share of malformed values and skewed department frequencies
 """
 import csv
 import random
-from datetime import datetime, timedelta
+from concurrent.futures import ProcessPoolExecutor
+from datetime import date, datetime, timedelta
 from faker import Faker
 import os
 import argparse
 import logging
+import multiprocessing
+import polars as pl
 from tqdm import tqdm
 import threading
 
@@ -27,6 +33,18 @@ departments = [
     "Garden", "Jewelry", "Shoes", "Office Supplies", "Pet Supplies"
 ]
 
+# Dirty 'Number of Sales' values seen in real exports
+malformed_values = ["", "N/A", "12abc", "-", "1,200", " 42 ", "abc", "3.5"]
+
+MAX_SALES = 500
+DEFAULT_BATCH_SIZE = 1_000_000
+# Department weights are drawn from a pool of this many slots
+WEIGHT_RESOLUTION = 10_000
+
+def department_weights(skew=0.0):
+    """Zipf-like weights: 0 is uniform, larger values concentrate rows in the first departments."""
+    return [1 / (rank + 1) ** skew for rank in range(len(departments))]
+
 def generate_date(start_date="2020-01-01", end_date="2024-12-31"):
     start = datetime.strptime(start_date, "%Y-%m-%d")
     end = datetime.strptime(end_date, "%Y-%m-%d")
@@ -34,21 +52,71 @@ def generate_date(start_date="2020-01-01", end_date="2024-12-31"):
     random_days = random.randint(0, delta.days)
     return (start + timedelta(days=random_days)).date().isoformat()
 
-def generate_csv(file_index, records_per_file, output_dir, start_date, end_date):
+def generate_csv(file_index, records_per_file, output_dir, start_date, end_date, malformed_rate=0.0, skew=0.0):
     filename = os.path.join(output_dir, f"sales_data_{file_index}.csv")
+    weights = department_weights(skew) if skew else None
     try:
         with open(filename, mode='w', newline='', buffering=1024*1024) as file:
             writer = csv.writer(file)
             writer.writerow(["Department Name", "Date", "Number of Sales"])
             for _ in tqdm(range(records_per_file), desc=f"File {file_index}", unit="rows"):
-                dept = random.choice(departments)
+                dept = random.choices(departments, weights)[0] if weights else random.choice(departments)
                 date = generate_date(start_date, end_date)
-                sales = random.randint(0, 500)
+                sales = random.randint(0, MAX_SALES)
+                if malformed_rate and random.random() < malformed_rate:
+                    sales = random.choice(malformed_values)
                 writer.writerow([dept, date, sales])
         logging.info(f"Generated {filename}")
     except Exception as e:
         logging.error(f"Failed to generate {filename}: {e}")
 
+def generate_csv_vectorized(
+    file_index, records_per_file, output_dir, start_date, end_date,
+    malformed_rate=0.0, skew=0.0, seed=None, batch_size=DEFAULT_BATCH_SIZE
+):
+    """Same file layout as generate_csv, built in columnar batches of ``batch_size`` rows.
+
+    Every column of a batch is one vectorized sample, so there is no per-row
+    Python work. With a ``seed`` the file depends only on the seed and
+    ``file_index``, whichever process or order it is generated in.
+    """
+    filename = os.path.join(output_dir, f"sales_data_{file_index}.csv")
+    rng = random.Random(f"{seed}:{file_index}") if seed is not None else random.Random()
+    start = datetime.strptime(start_date, "%Y-%m-%d").date()
+    num_days = (datetime.strptime(end_date, "%Y-%m-%d").date() - start).days
+    epoch_day = (start - date(1970, 1, 1)).days
+    weights = department_weights(skew)
+    total = sum(weights)
+    # Each department gets a share of slots proportional to its weight
+    slots = pl.Series([i for i, w in enumerate(weights) for _ in range(max(1, round(w / total * WEIGHT_RESOLUTION)))])
+    day_offsets = pl.int_range(0, num_days + 1, eager=True)
+    sales_values = pl.int_range(0, MAX_SALES + 1, eager=True)
+    malformed = pl.Series(malformed_values)
+    try:
+        with open(filename, mode='wb') as file, tqdm(total=records_per_file, desc=f"File {file_index}", unit="rows") as progress:
+            if records_per_file == 0:
+                file.write(b"Department Name,Date,Number of Sales\n")
+            for offset in range(0, records_per_file, batch_size):
+                n = min(batch_size, records_per_file - offset)
+                seeds = [rng.getrandbits(63) for _ in range(5)]
+                dept = pl.Series(departments).gather(slots.sample(n, with_replacement=True, seed=seeds[0]))
+                days = day_offsets.sample(n, with_replacement=True, seed=seeds[1]) + epoch_day
+                sales = sales_values.sample(n, with_replacement=True, seed=seeds[2]).cast(pl.Utf8)
+                if malformed_rate:
+                    draws = pl.int_range(0, 1_000_000, eager=True).sample(n, with_replacement=True, seed=seeds[3])
+                    replacement = malformed.sample(n, with_replacement=True, seed=seeds[4])
+                    sales = pl.select(pl.when(draws < malformed_rate * 1_000_000).then(replacement).otherwise(sales)).to_series()
+                batch = pl.DataFrame({
+                    "Department Name": dept,
+                    "Date": days.cast(pl.Int32).cast(pl.Date),
+                    "Number of Sales": sales,
+                })
+                batch.write_csv(file, include_header=offset == 0)
+                progress.update(n)
+        logging.info(f"Generated {filename}")
+    except Exception as e:
+        logging.error(f"Failed to generate {filename}: {e}")
+
 def main():
     parser = argparse.ArgumentParser(description="Generate synthetic sales CSV files.")
     parser.add_argument("-n", "--num_files", type=int, default=3, help="Number of CSV files to generate.")
@@ -57,17 +125,37 @@ def main():
     parser.add_argument("--start_date", type=str, default="2020-01-01", help="Start date (YYYY-MM-DD).")
     parser.add_argument("--end_date", type=str, default="2024-12-31", help="End date (YYYY-MM-DD).")
     parser.add_argument("--seed", type=int, default=None, help="Random seed for reproducibility.")
+    parser.add_argument("--mode", choices=["vectorized", "rows"], default="vectorized", help="Columnar batches in a process pool, or the original row-by-row writer.")
+    parser.add_argument("--workers", type=int, default=None, help="Processes for vectorized mode (default: one per file, up to the CPU count).")
+    parser.add_argument("--batch_size", type=int, default=DEFAULT_BATCH_SIZE, help="Rows per columnar batch in vectorized mode.")
+    parser.add_argument("--malformed_rate", type=float, default=0.0, help="Share of rows with a malformed 'Number of Sales' value.")
+    parser.add_argument("--skew", type=float, default=0.0, help="Zipf exponent for department frequencies (0 is uniform).")
     args = parser.parse_args()
 
     logging.basicConfig(level=logging.INFO, format='%(asctime)s %(levelname)s: %(message)s')
     os.makedirs(args.output_dir, exist_ok=True)
+    if args.mode == "vectorized":
+        workers = args.workers or min(args.num_files, os.cpu_count() or 1)
+        # Spawn rather than fork: Polars is already loaded here, and forking its thread pool can deadlock the child
+        with ProcessPoolExecutor(max_workers=workers, mp_context=multiprocessing.get_context("spawn")) as pool:
+            futures = [
+                pool.submit(
+                    generate_csv_vectorized, i, args.records_per_file, args.output_dir, args.start_date,
+                    args.end_date, args.malformed_rate, args.skew, args.seed, args.batch_size
+                )
+                for i in range(1, args.num_files + 1)
+            ]
+            for future in futures:
+                future.result()
+        return
+
     if args.seed is not None:
         random.seed(args.seed)
         Faker.seed(args.seed)
 
     threads = []
     for i in range(1, args.num_files + 1):
-        t = threading.Thread(target=generate_csv, args=(i, args.records_per_file, args.output_dir, args.start_date, args.end_date))
+        t = threading.Thread(target=generate_csv, args=(i, args.records_per_file, args.output_dir, args.start_date, args.end_date, args.malformed_rate, args.skew))
         t.start()
         threads.append(t)
     for t in threads:
@@ -1,5 +1,137 @@
+import atexit
+import datetime
+import json
 import logging
+import os
+import queue
+import time
+from contextlib import contextmanager
+from contextvars import ContextVar
+from logging.handlers import QueueHandler, QueueListener
 from threading import Lock
+from typing import Any, Dict, Tuple
+
+LOG_LEVEL = os.getenv("LOG_LEVEL", "INFO").upper()
+# "text" or "json" (one object per line, with job_id and stage when known)
+LOG_FORMAT = os.getenv("LOG_FORMAT", "text")
+# Records waiting for the writer thread; more are dropped rather than block the caller
+LOG_QUEUE_SIZE = int(os.getenv("LOG_QUEUE_SIZE", 10_000))
+# Per message template: records per second and burst size below WARNING (0 disables)
+LOG_RATE_LIMIT = float(os.getenv("LOG_RATE_LIMIT", 20))
+LOG_RATE_BURST = int(os.getenv("LOG_RATE_BURST", 100))
+# Templates tracked by the rate limiter before its buckets are reset
+MAX_RATE_KEYS = 4096
+TEXT_FORMAT = '[%(asctime)s] %(levelname)s: %(message)s'
+
+_context: ContextVar[Dict[str, Any]] = ContextVar("log_context", default={})
+
+
+@contextmanager
+def log_context(**fields: Any):
+    """Attach ``fields`` (e.g. ``job_id``, ``stage``) to records logged inside the block.
+
+    The context follows asyncio tasks and ``asyncio.to_thread``; the thread
+    backend of the executor copies it into its pool too.
+    """
+    token = _context.set({**_context.get(), **fields})
+    try:
+        yield
+    finally:
+        _context.reset(token)
+
+
+class ContextFilter(logging.Filter):
+    """Copies the current ``log_context`` onto the record on the logging thread."""
+
+    def filter(self, record: logging.LogRecord) -> bool:
+        record.context = _context.get()
+        return True
+
+
+class RateLimitFilter(logging.Filter):
+    """Token bucket per message template for records below ``max_level``.
+
+    Call sites log with ``%``-style arguments, so the template identifies the
+    kind of message. A record that gets through after some were dropped
+    carries the number dropped in ``record.suppressed``.
+    """
+
+    def __init__(self, rate: float = LOG_RATE_LIMIT, burst: int = LOG_RATE_BURST, max_level: int = logging.WARNING):
+        super().__init__()
+        self.rate = rate
+        self.burst = burst
+        self.max_level = max_level
+        self.suppressed = 0
+        self._buckets: Dict[str, Tuple[float, float, int]] = {}
+        self._lock = Lock()
+
+    def filter(self, record: logging.LogRecord) -> bool:
+        if self.rate <= 0 or record.levelno >= self.max_level:
+            return True
+        key = str(record.msg)
+        now = time.monotonic()
+        with self._lock:
+            if len(self._buckets) >= MAX_RATE_KEYS and key not in self._buckets:
+                self._buckets.clear()
+            tokens, last, dropped = self._buckets.get(key, (self.burst, now, 0))
+            tokens = min(self.burst, tokens + (now - last) * self.rate)
+            if tokens < 1:
+                self._buckets[key] = (tokens, now, dropped + 1)
+                self.suppressed += 1
+                return False
+            self._buckets[key] = (tokens - 1, now, 0)
+        if dropped:
+            record.suppressed = dropped
+        return True
+
+
+class BackgroundQueueHandler(QueueHandler):
+    """Hands records to the writer thread without formatting them first.
+
+    The message is built from ``msg % args`` on the writer thread, so callers
+    only pay for creating the record. A full queue drops the record.
+    """
+
+    def __init__(self, log_queue: queue.Queue):
+        super().__init__(log_queue)
+        self.dropped = 0
+
+    def prepare(self, record: logging.LogRecord) -> logging.LogRecord:
+        if record.exc_info:
+            # Tracebacks hold live frames; render them while they are valid
+            record.exc_text = logging.Formatter().formatException(record.exc_info)
+            record.exc_info = None
+        return record
+
+    def enqueue(self, record: logging.LogRecord) -> None:
+        try:
+            self.queue.put_nowait(record)
+        except queue.Full:
+            self.dropped += 1
+
+
+class TextFormatter(logging.Formatter):
+    def format(self, record: logging.LogRecord) -> str:
+        line = super().format(record)
+        suppressed = getattr(record, "suppressed", 0)
+        return f"{line} ({suppressed} similar messages suppressed)" if suppressed else line
+
+
+class JsonFormatter(logging.Formatter):
+    def format(self, record: logging.LogRecord) -> str:
+        entry = {
+            "time": datetime.datetime.fromtimestamp(record.created, datetime.timezone.utc).isoformat(),
+            "level": record.levelname,
+            "logger": record.name,
+            "message": record.getMessage(),
+            **getattr(record, "context", {}),
+        }
+        if getattr(record, "suppressed", 0):
+            entry["suppressed"] = record.suppressed
+        if record.exc_text:
+            entry["exception"] = record.exc_text
+        return json.dumps(entry, default=str)
+
 
 class Logger:
     _instance = None
@@ -15,13 +147,26 @@ class Logger:
 
     def _init_logger(self):
         self.logger = logging.getLogger("csv_parser")
-        self.logger.setLevel(logging.INFO)
+        self.logger.setLevel(LOG_LEVEL)
+        self.rate_limit = RateLimitFilter()
+        self.queue_handler = BackgroundQueueHandler(queue.Queue(LOG_QUEUE_SIZE))
+        self.listener = None
         if not self.logger.handlers:
+            # Writing happens on the listener's thread, off the event loop and the job threads
             ch = logging.StreamHandler()
-            ch.setLevel(logging.INFO)
-            formatter = logging.Formatter('[%(asctime)s] %(levelname)s: %(message)s')
-            ch.setFormatter(formatter)
-            self.logger.addHandler(ch)
+            ch.setLevel(LOG_LEVEL)
+            ch.setFormatter(JsonFormatter() if LOG_FORMAT == "json" else TextFormatter(TEXT_FORMAT))
+            self.listener = QueueListener(self.queue_handler.queue, ch, respect_handler_level=True)
+            self.listener.start()
+            atexit.register(self.listener.stop)
+            self.logger.addFilter(self.rate_limit)
+            self.logger.addFilter(ContextFilter())
+            self.logger.addHandler(self.queue_handler)
+
+    @property
+    def dropped(self) -> int:
+        """Records lost to the rate limiter or a full queue."""
+        return self.rate_limit.suppressed + self.queue_handler.dropped
 
     def get_logger(self):
         return self.logger
@@ -41,4 +186,4 @@ class Logger:
     def critical(self, msg, *args, **kwargs):
         self.logger.critical(msg, *args, **kwargs)
 
-# Usage: from app.utils.logger import Logger; logger = Logger(); logger.info("message"); logger.error("error message")
\ No newline at end of file
+# Usage: from app.utils.logger import Logger; logger = Logger(); logger.info("message %s", value); logger.error("error message")
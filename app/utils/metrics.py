@@ -0,0 +1,333 @@
+"""
+Process-local metrics and per-job stage timings
+
+Counters, gauges and histograms are rendered in the Prometheus text
+exposition format by ``/metrics``. Updating one takes a lock for a couple
+of dict operations, so they are cheap enough for the hot path; values that
+already live elsewhere (queue depth, cache hits) are registered with a
+``func`` and only read when scraped.
+
+``JobTrace`` collects one job's stage durations, rows, bytes read and peak
+RSS. It is a plain object that can be filled in a worker process and sent
+back as a dict.
+"""
+import bisect
+import os
+import platform
+import threading
+import time
+from contextlib import contextmanager
+from typing import Any, Callable, Dict, Iterator, List, Optional, Sequence, Tuple
+from app.utils.logger import log_context
+
+try:
+    import resource
+except ImportError:  # pragma: no cover - not available on Windows
+    resource = None
+
+RSS_SAMPLE_INTERVAL = float(os.getenv("METRICS_RSS_INTERVAL", 0.05))
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 120, 300, 600)
+BYTES_BUCKETS = tuple(2 ** i * 1024 * 1024 for i in range(4, 15))  # 16 MB .. 16 GB
+
+LabelKey = Tuple[str, ...]
+
+
+class _Metric:
+    kind = "untyped"
+
+    def __init__(self, name: str, help: str, labelnames: Sequence[str] = (), func: Optional[Callable[[], float]] = None):
+        self.name = name
+        self.help = help
+        self.labelnames = tuple(labelnames)
+        self.func = func
+        self._values: Dict[LabelKey, Any] = {}
+        if not self.labelnames and self.kind in ("counter", "gauge"):
+            self._values[()] = 0  # exported as 0 before the first update
+        self._lock = threading.Lock()
+
+    def _key(self, labels: Dict[str, str]) -> LabelKey:
+        return tuple(str(labels.get(name, "")) for name in self.labelnames)
+
+    def samples(self) -> Iterator[Tuple[str, Dict[str, str], float]]:
+        if self.func is not None:
+            yield self.name, {}, float(self.func())
+            return
+        with self._lock:
+            items = list(self._values.items())
+        for key, value in items:
+            yield self.name, dict(zip(self.labelnames, key)), value
+
+    def value(self, **labels: str) -> float:
+        with self._lock:
+            return self._values.get(self._key(labels), 0)
+
+
+class Counter(_Metric):
+    kind = "counter"
+
+    def inc(self, amount: float = 1, **labels: str) -> None:
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+
+class Gauge(_Metric):
+    kind = "gauge"
+
+    def set(self, value: float, **labels: str) -> None:
+        with self._lock:
+            self._values[self._key(labels)] = value
+
+    def inc(self, amount: float = 1, **labels: str) -> None:
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def dec(self, amount: float = 1, **labels: str) -> None:
+        self.inc(-amount, **labels)
+
+
+class Histogram(_Metric):
+    kind = "histogram"
+
+    def __init__(self, name: str, help: str, labelnames: Sequence[str] = (), buckets: Sequence[float] = DEFAULT_BUCKETS):
+        super().__init__(name, help, labelnames)
+        self.buckets = tuple(sorted(buckets))
+
+    def observe(self, value: float, **labels: str) -> None:
+        key = self._key(labels)
+        index = bisect.bisect_left(self.buckets, value)
+        with self._lock:
+            state = self._values.get(key)
+            if state is None:
+                # Per-bucket (non-cumulative) counts, then sum and count
+                state = self._values[key] = [[0] * (len(self.buckets) + 1), 0.0, 0]
+            state[0][index] += 1
+            state[1] += value
+            state[2] += 1
+
+    def samples(self) -> Iterator[Tuple[str, Dict[str, str], float]]:
+        with self._lock:
+            items = [(key, (list(s[0]), s[1], s[2])) for key, s in self._values.items()]
+        for key, (counts, total, count) in items:
+            labels = dict(zip(self.labelnames, key))
+            cumulative = 0
+            for bound, bucket_count in zip(self.buckets + (float("inf"),), counts):
+                cumulative += bucket_count
+                yield f"{self.name}_bucket", {**labels, "le": _format_value(bound)}, cumulative
+            yield f"{self.name}_sum", labels, total
+            yield f"{self.name}_count", labels, count
+
+    def count(self, **labels: str) -> int:
+        with self._lock:
+            state = self._values.get(self._key(labels))
+            return state[2] if state else 0
+
+
+class Registry:
+    def __init__(self):
+        self._metrics: Dict[str, _Metric] = {}
+        self._lock = threading.Lock()
+
+    def register(self, metric: _Metric) -> _Metric:
+        """Add ``metric``, replacing any earlier one of the same name (for callback gauges)."""
+        with self._lock:
+            self._metrics[metric.name] = metric
+        return metric
+
+    def render(self) -> str:
+        with self._lock:
+            metrics = list(self._metrics.values())
+        lines: List[str] = []
+        for metric in metrics:
+            lines.append(f"# HELP {metric.name} {metric.help}")
+            lines.append(f"# TYPE {metric.name} {metric.kind}")
+            for name, labels, value in metric.samples():
+                lines.append(f"{name}{_format_labels(labels)} {_format_value(value)}")
+        return "\n".join(lines) + "\n"
+
+
+REGISTRY = Registry()
+
+
+def counter(name: str, help: str, labelnames: Sequence[str] = (), func: Optional[Callable[[], float]] = None) -> Counter:
+    return REGISTRY.register(Counter(name, help, labelnames, func))
+
+
+def gauge(name: str, help: str, labelnames: Sequence[str] = (), func: Optional[Callable[[], float]] = None) -> Gauge:
+    return REGISTRY.register(Gauge(name, help, labelnames, func))
+
+
+def histogram(name: str, help: str, labelnames: Sequence[str] = (), buckets: Sequence[float] = DEFAULT_BUCKETS) -> Histogram:
+    return REGISTRY.register(Histogram(name, help, labelnames, buckets))
+
+
+STAGE_SECONDS = histogram("csv_stage_duration_seconds", "Time spent in each processing stage.", ["stage"])
+JOB_SECONDS = histogram("csv_job_duration_seconds", "Job processing time from start to finish.", ["status"])
+JOBS_TOTAL = counter("csv_jobs_total", "Jobs completed, by final status.", ["status"])
+ROWS_TOTAL = counter("csv_rows_processed_total", "CSV data rows aggregated.")
+BYTES_TOTAL = counter("csv_bytes_read_total", "CSV input bytes aggregated.")
+RETRIES_TOTAL = counter("csv_retries_total", "Aggregation attempts retried after a failure.")
+VALUES_CLEANED_TOTAL = counter(
+    "csv_sales_values_cleaned_total", "Number of Sales values that were not clean integers, by outcome.", ["outcome"]
+)
+ROW_GROUPS_TOTAL = counter(
+    "csv_columnar_row_groups_total", "Row groups of columnar copies read or skipped by their zone maps.", ["outcome"]
+)
+ACTIVE_WORKERS = gauge("csv_active_workers", "Workers currently processing a job.")
+JOB_PEAK_RSS = histogram("csv_job_peak_rss_bytes", "Peak RSS of the process running a job.", buckets=BYTES_BUCKETS)
+STARTUP_SECONDS = gauge("csv_startup_seconds", "Time from process start until the service was ready.")
+WARMUP_SECONDS = gauge("csv_warmup_seconds", "Time the startup warm-up took.")
+FIRST_RESULT_SECONDS = gauge(
+    "csv_time_to_first_result_seconds", "Time from process start until the first job finished; 0 until then."
+)
+
+_IMPORTED_AT = time.monotonic()
+_first_result_lock = threading.Lock()
+
+
+def observe_stage(stage: str, seconds: float) -> None:
+    STAGE_SECONDS.observe(seconds, stage=stage)
+
+
+def process_uptime() -> float:
+    """Seconds since this process started (Linux), or since this module was imported elsewhere."""
+    try:
+        with open("/proc/self/stat") as f:
+            # Field 22, after the parenthesised command name: start time in clock ticks since boot
+            ticks = int(f.read().rsplit(")", 1)[1].split()[19])
+        return time.clock_gettime(time.CLOCK_BOOTTIME) - ticks / os.sysconf("SC_CLK_TCK")
+    except (OSError, ValueError, IndexError, AttributeError):
+        return time.monotonic() - _IMPORTED_AT
+
+
+def record_first_result() -> Optional[float]:
+    """Record the time to first result; returns it for the first finished job of the process only."""
+    with _first_result_lock:
+        if FIRST_RESULT_SECONDS.value():
+            return None
+        seconds = process_uptime()
+        FIRST_RESULT_SECONDS.set(seconds)
+        return seconds
+
+
+class JobTrace:
+    """Stage durations and counters for one job (or one piece of one)."""
+
+    def __init__(self):
+        self.stages: Dict[str, float] = {}
+        self.rows = 0
+        self.bytes_read = 0
+        self.peak_rss_bytes = 0
+        # Number of Sales values repaired from their digits, defaulted to 0, or dropped
+        self.cleaning: Dict[str, int] = {"repaired": 0, "defaulted": 0, "dropped": 0}
+        # Row groups of columnar copies read, and skipped by their zone maps
+        self.row_groups: Dict[str, int] = {"read": 0, "skipped": 0}
+
+    @contextmanager
+    def stage(self, name: str):
+        start = time.perf_counter()
+        try:
+            with log_context(stage=name):
+                yield
+        finally:
+            self.add_stage(name, time.perf_counter() - start)
+
+    def add_stage(self, name: str, seconds: float) -> None:
+        self.stages[name] = self.stages.get(name, 0.0) + seconds
+
+    def merge(self, other: Dict[str, Any], stages: bool = True) -> None:
+        """Fold in a trace sent back as a dict.
+
+        Pieces that ran concurrently are merged with ``stages=False``: their
+        durations overlap, so only their counters are added.
+        """
+        if stages:
+            for name, seconds in other.get("stages", {}).items():
+                self.add_stage(name, seconds)
+        self.rows += other.get("rows", 0)
+        self.bytes_read += other.get("bytes_read", 0)
+        for outcome, count in other.get("cleaning", {}).items():
+            self.cleaning[outcome] = self.cleaning.get(outcome, 0) + count
+        for outcome, count in other.get("row_groups", {}).items():
+            self.row_groups[outcome] = self.row_groups.get(outcome, 0) + count
+        self.peak_rss_bytes = max(self.peak_rss_bytes, other.get("peak_rss_bytes", 0))
+
+    def to_dict(self) -> Dict[str, Any]:
+        return {
+            "stages": dict(self.stages),
+            "rows": self.rows,
+            "bytes_read": self.bytes_read,
+            "peak_rss_bytes": self.peak_rss_bytes,
+            "cleaning": dict(self.cleaning),
+            "row_groups": dict(self.row_groups),
+        }
+
+    def publish(self) -> None:
+        """Add this job's stages and counters to the process metrics."""
+        for name, seconds in self.stages.items():
+            observe_stage(name, seconds)
+        ROWS_TOTAL.inc(self.rows)
+        BYTES_TOTAL.inc(self.bytes_read)
+        for outcome, count in self.cleaning.items():
+            if count:
+                VALUES_CLEANED_TOTAL.inc(count, outcome=outcome)
+        for outcome, count in self.row_groups.items():
+            if count:
+                ROW_GROUPS_TOTAL.inc(count, outcome=outcome)
+        if self.peak_rss_bytes:
+            JOB_PEAK_RSS.observe(self.peak_rss_bytes)
+
+
+class PeakRSS:
+    """Samples this process's resident set size in a background thread."""
+
+    def __init__(self, interval: float = RSS_SAMPLE_INTERVAL):
+        self.interval = interval
+        self.peak = 0
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._run, daemon=True)
+
+    def __enter__(self):
+        self.peak = current_rss()
+        self._thread.start()
+        return self
+
+    def __exit__(self, *exc):
+        self._stop.set()
+        self._thread.join()
+        self.peak = max(self.peak, current_rss())
+
+    def _run(self):
+        while not self._stop.wait(self.interval):
+            self.peak = max(self.peak, current_rss())
+
+
+def current_rss() -> int:
+    """Current RSS in bytes (Linux), falling back to the lifetime peak elsewhere."""
+    try:
+        with open("/proc/self/statm") as f:
+            return int(f.read().split()[1]) * os.sysconf("SC_PAGE_SIZE")
+    except (OSError, ValueError, IndexError):
+        if resource is None:
+            return 0
+        peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        return peak if platform.system() == "Darwin" else peak * 1024
+
+
+def _format_labels(labels: Dict[str, str]) -> str:
+    if not labels:
+        return ""
+    return "{" + ",".join(f'{k}="{_escape(v)}"' for k, v in labels.items()) + "}"
+
+
+def _escape(value: str) -> str:
+    return str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+def _format_value(value: float) -> str:
+    if value == float("inf"):
+        return "+Inf"
+    if float(value).is_integer():
+        return str(int(value))
+    return repr(float(value))
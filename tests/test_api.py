@@ -1,17 +1,42 @@
 import os
 import io
+import asyncio
+import functools
+import json
 import shutil
 import tempfile
+import threading
 import pytest
 from fastapi.testclient import TestClient
-from app.api.api import app
-from app.api.state import jobs, used_job_ids
+from app.api.api import app, _job_upload_dir, prepare, readiness
+from app.api.state import jobs, used_job_ids, job_queue, JobStatus
+from app.api.job_store import evict_expired_jobs
+from app.api.worker import _run_job
+from app.service.columnar import ColumnarStore
+from app.service.datasets import Dataset
+from app.service.reader_service import AsyncCSVReaderService
+from app.service.result_cache import ResultCache
+from app.utils.logger import Logger
 
 client = TestClient(app)
 
 def setup_function():
     jobs.clear()
     used_job_ids.clear()
+    job_queue.clear()
+
+
+@pytest.fixture(autouse=True)
+def isolated_dirs(tmp_path, monkeypatch):
+    """Uploads, dataset states, cached results and results of jobs run here all go under tmp_path."""
+    monkeypatch.setattr("app.api.api.FILE_DIR", str(tmp_path / "FILE_DIR"))
+    datasets = functools.partial(Dataset, root=str(tmp_path / "datasets"))
+    monkeypatch.setattr("app.api.api.Dataset", datasets)
+    monkeypatch.setattr("app.api.worker.Dataset", datasets)
+    cache = ResultCache(str(tmp_path / "cache"))
+    monkeypatch.setattr("app.api.api.result_cache", cache)
+    monkeypatch.setattr("app.api.worker.result_cache", cache)
+    monkeypatch.setattr("app.api.worker.OUTPUT_DIR", str(tmp_path / "OUTPUT_DIR"))
 
 
 def test_health_check():
@@ -22,7 +47,7 @@ def test_health_check():
 
 def test_process_and_job_status():
     # Create a temp CSV file
-    csv_content = b"col1,col2\n1,2\n3,4\n"
+    csv_content = b"Department Name,Date,Number of Sales\nHR,2024-01-01,2\nIT,2024-01-02,4\n"
     job_id = "testjob1"
     files = {"csv_file": ("test.csv", io.BytesIO(csv_content), "text/csv")}
     response = client.post(f"/process?job_id={job_id}", files=files)
@@ -44,17 +69,28 @@ def test_process_and_job_status():
 
 def test_process_duplicate_job_id():
     job_id = "dupjob"
-    csv_content = b"a,b\n1,2\n"
-    files = {"csv_file": ("dup.csv", io.BytesIO(csv_content), "text/csv")}
+    csv_content = b"Department Name,Date,Number of Sales\nHR,2024-01-01,2\n"
     # First submission
+    files = {"csv_file": ("dup.csv", io.BytesIO(csv_content), "text/csv")}
     response = client.post(f"/process?job_id={job_id}", files=files)
     assert response.status_code == 200
     # Second submission with same job_id
+    files = {"csv_file": ("dup.csv", io.BytesIO(csv_content), "text/csv")}
     response = client.post(f"/process?job_id={job_id}", files=files)
     assert response.status_code == 400
     assert "already exists" in response.json()["detail"] or "has been used before" in response.json()["detail"]
 
 
+def test_process_rejects_missing_columns():
+    csv_content = b"col1,col2\n1,2\n3,4\n"
+    files = {"csv_file": ("bad_columns.csv", io.BytesIO(csv_content), "text/csv")}
+    response = client.post("/process?job_id=badcols", files=files)
+    assert response.status_code == 400
+    assert "Missing required columns" in response.json()["detail"]
+    assert not os.path.exists(_job_upload_dir("badcols"))
+    assert "badcols" not in jobs
+
+
 def test_job_status_not_found():
     response = client.get("/job_status/nonexistent")
     assert response.status_code == 404
@@ -93,3 +129,287 @@ def test_download_file_by_id_success(tmp_path):
     assert response.status_code == 200
     assert response.headers["content-type"].startswith("text/csv")
     assert response.content.startswith(b"a,b")
+
+
+def test_process_batch_uploads():
+    header = b"Department Name,Date,Number of Sales\n"
+    files = [
+        ("csv_files", ("batch_shard_1.csv", io.BytesIO(header + b"HR,2024-01-01,2\n"), "text/csv")),
+        ("csv_files", ("batch_shard_2.csv", io.BytesIO(header + b"IT,2024-01-01,3\n"), "text/csv")),
+    ]
+    response = client.post("/process_batch?job_id=batchjob", files=files)
+    assert response.status_code == 200
+    assert response.json()["shards"] == ["batch_shard_1.csv", "batch_shard_2.csv"]
+    data = client.get("/job_status/batchjob").json()
+    assert data["status"] == "WAITING"
+    assert set(data["shards"]) == {"batch_shard_1.csv", "batch_shard_2.csv"}
+
+
+def test_process_batch_pattern(tmp_path):
+    shard_dir = os.path.join(tmp_path, "FILE_DIR", "batch_pattern_test")
+    os.makedirs(shard_dir, exist_ok=True)
+    try:
+        for i in range(3):
+            with open(os.path.join(shard_dir, f"sales_data_{i}.csv"), "w") as f:
+                f.write("Department Name,Date,Number of Sales\nHR,2024-01-01,1\n")
+        # Same file name in two directories: shards are keyed by their path under FILE_DIR
+        for sub in ("east", "west"):
+            os.makedirs(os.path.join(shard_dir, sub), exist_ok=True)
+            with open(os.path.join(shard_dir, sub, "sales_data_0.csv"), "w") as f:
+                f.write("Department Name,Date,Number of Sales\nIT,2024-01-01,1\n")
+        response = client.post("/process_batch?job_id=patternjob&pattern=batch_pattern_test/**/sales_data_*.csv")
+        assert response.status_code == 200
+        shards = response.json()["shards"]
+        assert len(shards) == 5
+        assert os.path.join("batch_pattern_test", "east", "sales_data_0.csv") in shards
+        assert os.path.join("batch_pattern_test", "sales_data_0.csv") in shards
+        # Patterns cannot escape FILE_DIR
+        response = client.post("/process_batch?job_id=escapejob&pattern=../*")
+        assert response.status_code == 400
+    finally:
+        shutil.rmtree(shard_dir)
+
+
+def test_process_batch_pattern_skips_other_jobs_uploads():
+    upload_dir = _job_upload_dir("private_upload")
+    os.makedirs(upload_dir, exist_ok=True)
+    try:
+        with open(os.path.join(upload_dir, "private.csv"), "w") as f:
+            f.write("Department Name,Date,Number of Sales\nHR,2024-01-01,1\n")
+        response = client.post("/process_batch?job_id=snoopjob&pattern=uploads/**/*.csv")
+        assert response.status_code == 400
+    finally:
+        shutil.rmtree(upload_dir)
+
+
+def test_process_batch_requires_files_or_pattern():
+    response = client.post("/process_batch?job_id=emptybatch")
+    assert response.status_code == 400
+
+
+def test_job_id_rejected_after_eviction(tmp_path):
+    job_id = "evicted_job"
+    result = tmp_path / "result.csv"
+    result.write_text("a,b\n1,2\n")
+    jobs[job_id] = {"status": "FINISHED", "result": str(result), "error": None, "processing_time": {"start": None, "end": None}}
+    assert evict_expired_jobs(jobs, ttl=-1) == 1
+    assert job_id not in jobs
+    assert not result.exists()
+    files = {"csv_file": ("again.csv", io.BytesIO(b"Department Name,Date,Number of Sales\n"), "text/csv")}
+    response = client.post(f"/process?job_id={job_id}", files=files)
+    assert response.status_code == 400
+    assert "has been used before" in response.json()["detail"]
+
+
+def _finished_job(job_id, tmp_path, output):
+    from app.service.result_formats import OutputOptions, write_result
+    import polars as pl
+    options = OutputOptions(**output)
+    path = tmp_path / f"result{options.extension}"
+    write_result(pl.DataFrame({"Department Name": ["HR", "IT"], "Number of Sales": [3, 4]}), str(path), options)
+    jobs[job_id] = {"status": "FINISHED", "result": str(path), "error": None, "processing_time": {"start": None, "end": None}, "output": output}
+    return path
+
+
+def test_process_rejects_unknown_output_format():
+    files = {"csv_file": ("test.csv", io.BytesIO(b"Department Name,Date,Number of Sales\n"), "text/csv")}
+    response = client.post("/process?job_id=badformat&output_format=xlsx", files=files)
+    assert response.status_code == 400
+    assert "badformat" not in jobs
+
+
+def test_process_records_output_options():
+    files = {"csv_file": ("test.csv", io.BytesIO(b"Department Name,Date,Number of Sales\nHR,2024-01-01,2\n"), "text/csv")}
+    response = client.post("/process?job_id=parquetjob&output_format=parquet&compression=zstd", files=files)
+    assert response.status_code == 200
+    assert jobs.get("parquetjob")["output"] == {"format": "parquet", "compression": "zstd"}
+
+
+def test_download_gzip_result_with_accept_encoding(tmp_path):
+    path = _finished_job("gzipjob", tmp_path, {"format": "csv", "compression": "gzip"})
+    response = client.get("/download/gzipjob", headers={"Accept-Encoding": "gzip"})
+    assert response.status_code == 200
+    assert response.headers["content-encoding"] == "gzip"
+    assert response.headers["content-length"] == str(path.stat().st_size)
+    assert 'filename="result.csv"' in response.headers["content-disposition"]
+    assert response.content.startswith(b"Department Name")
+
+
+def test_download_gzip_result_decoded_without_accept_encoding(tmp_path):
+    _finished_job("plainjob", tmp_path, {"format": "csv", "compression": "gzip"})
+    response = client.get("/download/plainjob", headers={"Accept-Encoding": "identity"})
+    assert response.status_code == 200
+    assert "content-encoding" not in response.headers
+    assert response.content.startswith(b"Department Name,Number of Sales")
+
+
+def test_download_range_request(tmp_path):
+    path = _finished_job("rangejob", tmp_path, {"format": "parquet", "compression": "none"})
+    response = client.get("/download/rangejob", headers={"Range": "bytes=0-3"})
+    assert response.status_code == 206
+    assert response.content == b"PAR1"
+    assert response.headers["content-range"] == f"bytes 0-3/{path.stat().st_size}"
+    assert response.headers["content-type"] == "application/vnd.apache.parquet"
+
+
+def test_job_status_inline_result(tmp_path):
+    _finished_job("inlinejob", tmp_path, {"format": "ipc", "compression": "zstd"})
+    data = client.get("/job_status/inlinejob?inline=true").json()
+    assert data["inline_result"] == [
+        {"Department Name": "HR", "Number of Sales": 3},
+        {"Department Name": "IT", "Number of Sales": 4},
+    ]
+    assert "inline_result" not in client.get("/job_status/inlinejob").json()
+
+
+def test_zero_copy_response_uses_pathsend(tmp_path):
+    import asyncio
+    from app.api.responses import ZeroCopyFileResponse
+    path = tmp_path / "result.csv"
+    path.write_text("a,b\n1,2\n")
+    sent = []
+
+    async def send(message):
+        sent.append(message)
+
+    scope = {"type": "http", "method": "GET", "headers": [], "extensions": {"http.response.pathsend": {}}}
+    asyncio.run(ZeroCopyFileResponse(str(path))(scope, None, send))
+    assert [m["type"] for m in sent] == ["http.response.start", "http.response.pathsend"]
+    assert sent[1]["path"] == str(path)
+
+
+def test_process_accepts_query_spec():
+    query = {"group_by": [{"column": "Date", "truncate": "month"}], "aggregations": [{"op": "count"}]}
+    files = {"csv_file": ("test.csv", io.BytesIO(b"Department Name,Date,Number of Sales\nHR,2024-01-01,2\n"), "text/csv")}
+    response = client.post("/process?job_id=queryjob", files=files, data={"query": json.dumps(query)})
+    assert response.status_code == 200
+    stored = jobs.get("queryjob")["query"]
+    assert stored["group_by"][0]["truncate"] == "month"
+    assert stored["aggregations"][0]["op"] == "count"
+
+
+def test_process_rejects_invalid_query_spec():
+    files = {"csv_file": ("test.csv", io.BytesIO(b"Department Name,Date,Number of Sales\n"), "text/csv")}
+    response = client.post("/process?job_id=badquery", files=files, data={"query": '{"aggregations": [{"op": "median"}]}'})
+    assert response.status_code == 400
+    assert response.json()["detail"].startswith("Invalid query")
+    assert "badquery" not in jobs
+
+
+def _record(status, **fields):
+    return {"status": status, "result": None, "error": None, "processing_time": {"start": None, "end": None}, **fields}
+
+
+def test_job_status_long_poll_returns_on_change():
+    jobs["pollme"] = _record("WAITING")
+    threading.Timer(0.2, lambda: jobs.update("pollme", status="STARTED")).start()
+    response = client.get("/job_status/pollme?wait=10")
+    assert response.json()["status"] == "STARTED"
+    version = response.json()["version"]
+    # Unchanged since that version: answers with the same state once the wait runs out
+    response = client.get(f"/job_status/pollme?wait=0.2&since={version}")
+    assert response.json()["status"] == "STARTED"
+    assert response.json()["version"] == version
+
+
+def test_job_events_streams_several_jobs_until_done():
+    jobs["done"] = _record("FAILED", error="boom")
+    jobs["running"] = _record("STARTED")
+
+    def finish():
+        jobs.update("running", progress={"bytes_done": 5, "bytes_total": 10, "eta_seconds": 1.0})
+        jobs.update("running", status="FINISHED", progress={"bytes_done": 10, "bytes_total": 10, "eta_seconds": 0.0})
+
+    threading.Timer(0.2, finish).start()
+    with client.stream("GET", "/job_events?job_id=done&job_id=running&job_id=nosuchjob") as response:
+        assert response.headers["content-type"].startswith("text/event-stream")
+        events = [json.loads(line[len("data: "):]) for line in response.iter_lines() if line.startswith("data: ")]
+    by_job = {}
+    for event in events:
+        by_job.setdefault(event["job_id"], []).append(event)
+    assert [e["status"] for e in by_job["done"]] == ["FAILED"]
+    assert by_job["nosuchjob"][0]["status"] is None
+    assert by_job["running"][0]["status"] == "STARTED"
+    assert by_job["running"][-1]["status"] == "FINISHED"
+    assert by_job["running"][-1]["progress"]["bytes_done"] == 10
+
+
+def test_process_with_preview_stores_estimates():
+    csv_content = b"Department Name,Date,Number of Sales\n" + b"HR,2024-01-01,2\nIT,2024-01-02,4\n" * 50
+    files = {"csv_file": ("test.csv", io.BytesIO(csv_content), "text/csv")}
+    response = client.post("/process?job_id=previewjob&preview=1", files=files)
+    assert response.status_code == 200
+    preview = client.get("/job_status/previewjob").json()["preview"]
+    totals = {row["Department Name"]: row["Total Number of Sales"] for row in preview["rows"]}
+    assert totals["HR"]["estimate"] == pytest.approx(100)
+    assert totals["IT"]["low"] == pytest.approx(200)
+
+
+@pytest.mark.parametrize("params, query", [
+    ("preview=1.5", None),
+    ("preview=0.1", {"aggregations": [{"op": "max", "column": "Number of Sales"}]}),
+])
+def test_process_rejects_bad_preview(params, query):
+    files = {"csv_file": ("test.csv", io.BytesIO(b"Department Name,Date,Number of Sales\n"), "text/csv")}
+    data = {"query": json.dumps(query)} if query else None
+    response = client.post(f"/process?job_id=badpreview&{params}", files=files, data=data)
+    assert response.status_code == 400
+    assert "badpreview" not in jobs
+
+
+def test_process_dataset_job_carries_upload_checksums(monkeypatch):
+    enqueued = []
+    async def enqueue(job, record, size, priority, logger):
+        jobs[job["job_id"]] = record
+        enqueued.append(job)
+
+    monkeypatch.setattr("app.api.api._enqueue", enqueue)
+    csv_content = b"Department Name,Date,Number of Sales\nHR,2024-01-01,2\nIT,2024"
+    files = {"csv_file": ("test.csv", io.BytesIO(csv_content), "text/csv")}
+    response = client.post("/process?job_id=datasetjob&dataset=test-sales-api", files=files)
+    assert response.status_code == 200
+    assert jobs.get("datasetjob")["dataset"] == "test-sales-api"
+    assert enqueued[0]["dataset"] == "test-sales-api"
+    assert enqueued[0]["records"][0] == csv_content.rindex(b"\n") + 1
+
+    files = {"csv_file": ("test.csv", io.BytesIO(csv_content), "text/csv")}
+    response = client.post("/process?job_id=nodataset&dataset=", files=files)
+    assert response.status_code == 400
+
+
+@pytest.mark.asyncio
+async def test_same_upload_reuses_columnar_copy(tmp_path, monkeypatch):
+    columnar_dir = str(tmp_path / "columnar")
+    monkeypatch.setattr(
+        "app.api.worker.AsyncCSVReaderService",
+        functools.partial(AsyncCSVReaderService, columnar="always", columnar_dir=columnar_dir, checkpoints=False)
+    )
+    csv_content = b"Department Name,Date,Number of Sales\nHR,2024-01-01,2\nIT,2024-01-02,4\n"
+    # Queried differently, so the second job is not answered from the result cache
+    queries = {"columnar1": {}, "columnar2": {"aggregations": [{"op": "count"}]}}
+    for job_id, query in queries.items():
+        files = {"csv_file": ("same.csv", io.BytesIO(csv_content), "text/csv")}
+        assert client.post(f"/process?job_id={job_id}", files=files, data={"query": json.dumps(query)}).status_code == 200
+        await _run_job(job_queue.get_nowait(), Logger())
+        job_queue.task_done()
+        assert jobs.get(job_id)["status"] == JobStatus.FINISHED
+    # Each upload has its own directory, but the second job scans the first one's copy
+    assert "columnar_build" in jobs.get("columnar1")["metrics"]["stages"]
+    assert "columnar_build" not in jobs.get("columnar2")["metrics"]["stages"]
+    assert ColumnarStore(columnar_dir).stats()["copies"] == 1
+
+
+def test_ready_only_after_warm_up(monkeypatch):
+    monkeypatch.setitem(readiness, "ready", False)
+    response = client.get("/ready")
+    assert response.status_code == 503
+    assert response.json()["status"] == "starting"
+    # /health answers as soon as the process is up
+    assert client.get("/health").status_code == 200
+
+    asyncio.run(prepare(prewarm=True))
+    response = client.get("/ready")
+    assert response.status_code == 200
+    body = response.json()
+    assert body["status"] == "ready"
+    assert 0 < body["warmup_seconds"] <= body["startup_seconds"]
@@ -0,0 +1,39 @@
+import json
+import os
+import pytest
+from app.api.state import result_cache
+from app.utils.benchmark import main, compare_results, build_dataset
+
+
+def test_build_dataset_is_reproducible(tmp_path):
+    first = build_dataset(str(tmp_path / "a"), 200, seed=7, dirty_rate=0.2)
+    second = build_dataset(str(tmp_path / "b"), 200, seed=7, dirty_rate=0.2)
+    with open(first) as f1, open(second) as f2:
+        assert f1.read() == f2.read()
+
+
+def test_benchmark_run_writes_json_and_detects_regressions(tmp_path, monkeypatch):
+    # Keep uploads and results out of the repository's FILE_DIR/OUTPUT_DIR
+    monkeypatch.setattr("app.api.api.FILE_DIR", str(tmp_path / "files"))
+    monkeypatch.setattr("app.api.worker.OUTPUT_DIR", str(tmp_path / "output"))
+    output = tmp_path / "results.json"
+    args = [
+        "--rows", "500", "--dirty_rate", "0.05", "--repeat", "1", "--concurrency", "2",
+        "--data_dir", str(tmp_path / "data"), "-o", str(output), "--job_timeout", "60",
+    ]
+    assert main(args) == 0
+    assert result_cache.enabled
+    assert os.listdir(tmp_path / "output")
+    report = json.loads(output.read_text())
+    names = {r["name"] for r in report["results"]}
+    assert names == {"service/500/clean", "service/500/dirty", "api/500/clean/c2", "api/500/dirty/c2"}
+    api = next(r for r in report["results"] if r["name"] == "api/500/clean/c2")["metrics"]
+    for key in ("rows_per_sec", "peak_rss_mb", "upload_p50_seconds", "processing_p50_seconds", "download_p50_seconds"):
+        assert key in api
+
+    # A baseline twice as fast flags a throughput regression
+    baseline = json.loads(output.read_text())
+    for result in baseline["results"]:
+        result["metrics"]["rows_per_sec"] *= 2
+    assert any("rows_per_sec" in line for line in compare_results(report, baseline, 0.10))
+    assert compare_results(report, report, 0.10) == []
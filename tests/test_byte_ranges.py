@@ -0,0 +1,73 @@
+import csv
+import io
+import pytest
+from app.service.byte_ranges import split_byte_ranges, read_range, iter_record_blocks, iter_stream_blocks
+
+
+def _write(tmp_path, content: bytes):
+    path = tmp_path / "input.csv"
+    path.write_bytes(content)
+    return str(path)
+
+
+def test_ranges_cover_file_on_line_boundaries(tmp_path):
+    content = b"Department Name,Date,Number of Sales\n" + b"".join(
+        f"Dept{i % 7},2024-01-01,{i}\n".encode() for i in range(1000)
+    )
+    path = _write(tmp_path, content)
+    header, ranges = split_byte_ranges(path, 8)
+    assert header == b"Department Name,Date,Number of Sales\n"
+    assert len(ranges) == 8
+    assert ranges[0][0] == len(header)
+    assert ranges[-1][1] == len(content)
+    for (_, end), (start, _) in zip(ranges, ranges[1:]):
+        assert end == start
+        assert content[end - 1:end] == b"\n"
+
+
+def test_quoted_newlines_never_split(tmp_path):
+    rows = [["Department Name", "Date", "Number of Sales"]]
+    for i in range(300):
+        # Multi-line quoted fields, with escaped quotes, straddle many nominal cut points
+        name = f'Dept "{i % 5}"\nline two\n\nline four' if i % 3 == 0 else f"Dept{i % 5}"
+        rows.append([name, "2024-01-01", str(i)])
+    buffer = io.StringIO()
+    csv.writer(buffer, lineterminator="\n").writerows(rows)
+    content = buffer.getvalue().encode()
+    path = _write(tmp_path, content)
+    header, ranges = split_byte_ranges(path, 37)
+    parsed = []
+    for start, end in ranges:
+        chunk = (header + read_range(path, start, end)).decode()
+        parsed.extend(list(csv.reader(io.StringIO(chunk)))[1:])
+    assert parsed == rows[1:]
+    # Blocks within a range are record-aligned too
+    start, end = ranges[0][0], ranges[-1][1]
+    blocks = list(iter_record_blocks(path, start, end, block_size=64))
+    assert len(blocks) > 1
+    assert b"".join(blocks) == content[start:end]
+    parsed = []
+    for block in blocks:
+        parsed.extend(list(csv.reader(io.StringIO((header + block).decode())))[1:])
+    assert parsed == rows[1:]
+
+
+def test_small_file_single_range(tmp_path):
+    path = _write(tmp_path, b"a,b\n1,2\n")
+    header, ranges = split_byte_ranges(path, 4)
+    assert header == b"a,b\n"
+    assert ranges == [(4, 8)]
+
+
+def test_header_only_file_has_no_ranges(tmp_path):
+    path = _write(tmp_path, b"a,b\n")
+    assert split_byte_ranges(path, 4) == (b"a,b\n", [])
+
+
+def test_stream_blocks_end_on_records():
+    data = b'h\n"a\nb",1\nc,2\n"x""y\n",3\nlast'
+    for block_size in range(1, 12):
+        blocks = list(iter_stream_blocks(io.BytesIO(data), block_size))
+        assert b"".join(blocks) == data
+        for block in blocks[:-1]:
+            assert block.endswith(b"\n") and block.count(b'"') % 2 == 0
@@ -0,0 +1,86 @@
+import glob
+import os
+from functools import partial
+import polars as pl
+import pytest
+from app.service.columnar import ColumnarStore
+from app.service.query import QuerySpec, clean_sales
+from app.service.reader_service import AsyncCSVReaderService
+from app.utils.generate_csv import generate_csv_vectorized
+from app.utils.logger import Logger
+
+
+def _build(store, path):
+    schema = {"Date": pl.Date, "Number of Sales": pl.Utf8}
+    return store.build(path, clean_sales(pl.scan_csv(path, schema_overrides=schema, ignore_errors=True)))
+
+
+def _service(tmp_path, **kwargs):
+    return AsyncCSVReaderService(logger=Logger(), columnar_dir=str(tmp_path / "columnar"), checkpoints=False, **kwargs)
+
+
+@pytest.mark.asyncio
+async def test_repeat_query_scans_copy_and_skips_row_groups(tmp_path, monkeypatch):
+    monkeypatch.setattr("app.service.reader_service.ColumnarStore", partial(ColumnarStore, row_group_rows=1000))
+    generate_csv_vectorized(1, 20_000, str(tmp_path), "2022-01-01", "2022-12-31", malformed_rate=0.05, seed=5)
+    path = glob.glob(str(tmp_path / "*.csv"))[0]
+    query = QuerySpec.model_validate({"filters": [{"column": "Date", "op": "between", "value": ["2022-03-01", "2022-03-31"]}]})
+
+    first = _service(tmp_path, engine="parquet", query=query)
+    await first.aggregate_sales_by_department(path, str(tmp_path), retries=1)
+    assert "columnar_build" in first.trace.stages
+
+    # A later streaming job on the same file reads the copy, and only March's row groups of it
+    second = _service(tmp_path, query=query)
+    result = pl.read_csv(await second.aggregate_sales_by_department(path, str(tmp_path), retries=1))
+    assert "columnar_build" not in second.trace.stages
+    assert 0 < second.trace.row_groups["read"] <= 3
+    assert second.trace.row_groups["skipped"] >= 17
+
+    from_csv = _service(tmp_path, query=query, columnar="off")
+    expected = pl.read_csv(await from_csv.aggregate_sales_by_department(path, str(tmp_path), retries=1))
+    assert result.sort("Department Name").equals(expected.sort("Department Name"))
+    assert second.trace.cleaning == from_csv.trace.cleaning
+
+
+def test_zone_map_skips_departments_and_null_dates(tmp_path):
+    path = tmp_path / "input.csv"
+    path.write_text(
+        "Department Name,Date,Number of Sales\n"
+        "A,2024-01-01,1\nA,2024-01-02,2\nB,2024-02-01,3\nB,2024-02-02,4\nC,not-a-date,5\nC,,6\n"
+    )
+    copy = _build(ColumnarStore(str(tmp_path / "columnar"), row_group_rows=2), str(path))
+    assert [g["departments"] for g in copy.row_groups] == [["A"], ["B"], ["C"]]
+    assert copy.row_groups[2]["date_min"] is None
+
+    def runs(filters):
+        return copy.runs(QuerySpec.model_validate({"filters": filters}).filters)
+
+    assert runs([]) == [(0, 6)]
+    assert runs([{"column": "Department Name", "op": "in", "value": ["A", "C"]}]) == [(0, 2), (4, 2)]
+    assert runs([{"column": "Date", "op": "ge", "value": "2024-01-15"}]) == [(2, 2)]
+    assert runs([{"column": "Department Name", "op": "eq", "value": "Z"}]) == []
+
+
+def test_store_misses_changed_input_and_evicts_least_recently_used(tmp_path):
+    store = ColumnarStore(str(tmp_path / "columnar"))
+    inputs = []
+    for name in ("a", "b", "c"):
+        path = tmp_path / f"{name}.csv"
+        path.write_text("Department Name,Date,Number of Sales\n" + f"{name},2024-01-01,1\n" * 50)
+        inputs.append(str(path))
+    _build(store, inputs[0])
+    size = store.stats()["bytes"]
+    store.max_bytes = 2 * size
+    _build(store, inputs[1])
+    assert store.get(inputs[0]) is not None
+    _build(store, inputs[2])
+    # "b" was used least recently
+    assert store.get(inputs[1]) is None
+    assert store.get(inputs[0]) is not None and store.get(inputs[2]) is not None
+    assert store.stats()["copies"] == 2
+
+    with open(inputs[0], "a") as f:
+        f.write("a,2024-01-02,1\n")
+    assert store.get(inputs[0]) is None
+    assert not [p for p in os.listdir(store.root) if p.endswith(".tmp")]
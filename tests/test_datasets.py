@@ -0,0 +1,95 @@
+import hashlib
+import polars as pl
+import pytest
+from app.service.datasets import Dataset, PrefixHashes, records_prefix
+from app.service.query import QuerySpec
+from app.service.reader_service import AsyncCSVReaderService
+from app.utils.logger import Logger
+
+HEADER = "Department Name,Date,Number of Sales\n"
+
+
+def _service(tmp_path, query=None):
+    return AsyncCSVReaderService(
+        logger=Logger(), query=query, columnar="off", checkpoints=False, columnar_dir=str(tmp_path / "columnar")
+    )
+
+
+async def _aggregate(tmp_path, path, dataset, query=None):
+    service = _service(tmp_path, query)
+    result = pl.read_csv(await service.aggregate_dataset(str(path), dataset, str(tmp_path), retries=1))
+    return dict(zip(result["Department Name"], result["Total Number of Sales"])), service
+
+
+def test_prefix_hashes_match_sha256_at_every_split():
+    data = (HEADER + 'HR,2024-01-01,2\n"I\nT",2024-01-02,4\nHR,2024-01-03,1').encode()
+    for chunk_size in (1, 3, 7, len(data)):
+        hashes = PrefixHashes(prefix_offset=20)
+        for i in range(0, len(data), chunk_size):
+            hashes.update(data[i:i + chunk_size])
+        assert hashes.hexdigest() == hashlib.sha256(data).hexdigest()
+        assert hashes.prefix_sha256 == hashlib.sha256(data[:20]).hexdigest()
+        # The newline inside the quoted field is not a record end
+        assert hashes.records_end == data.rindex(b"\n") + 1
+        assert hashes.records_sha256 == hashlib.sha256(data[:hashes.records_end]).hexdigest()
+
+
+@pytest.mark.asyncio
+async def test_appended_rows_are_read_alone_and_merged(tmp_path):
+    path = tmp_path / "sales.csv"
+    dataset = Dataset("sales", root=str(tmp_path / "datasets"))
+    path.write_text(HEADER + "HR,2024-01-01,2\nIT,2024-01-02,4\n")
+    totals, _ = await _aggregate(tmp_path, path, dataset)
+    assert totals == {"HR": 2, "IT": 4}
+    saved = dataset.state().offset
+    assert saved == path.stat().st_size
+
+    appended = "HR,2024-01-03,5\nOPS,2024-01-04,1\n"
+    with open(path, "a") as f:
+        f.write(appended)
+    totals, service = await _aggregate(tmp_path, path, dataset)
+    assert totals == {"HR": 7, "IT": 4, "OPS": 1}
+    assert service.trace.bytes_read == len(appended)
+    assert dataset.state().offset == path.stat().st_size
+
+
+@pytest.mark.asyncio
+async def test_unterminated_last_record_counts_but_is_not_saved(tmp_path):
+    path = tmp_path / "sales.csv"
+    dataset = Dataset("sales", root=str(tmp_path / "datasets"))
+    path.write_text(HEADER + "HR,2024-01-01,2\nIT,2024-01-02,4")
+    totals, _ = await _aggregate(tmp_path, path, dataset)
+    assert totals == {"HR": 2, "IT": 4}
+    assert dataset.state().offset == len(HEADER + "HR,2024-01-01,2\n")
+
+    # The writer finishes the record it was in the middle of
+    with open(path, "a") as f:
+        f.write("0\n")
+    totals, _ = await _aggregate(tmp_path, path, dataset)
+    assert totals == {"HR": 2, "IT": 40}
+
+
+@pytest.mark.asyncio
+async def test_rewritten_file_or_new_query_recomputes(tmp_path):
+    path = tmp_path / "sales.csv"
+    dataset = Dataset("sales", root=str(tmp_path / "datasets"))
+    path.write_text(HEADER + "HR,2024-01-01,2\nIT,2024-01-02,4\n")
+    await _aggregate(tmp_path, path, dataset)
+
+    path.write_text(HEADER + "HR,2024-01-01,3\nIT,2024-01-02,4\nIT,2024-01-05,1\n")
+    totals, service = await _aggregate(tmp_path, path, dataset)
+    assert totals == {"HR": 3, "IT": 5}
+    assert service.trace.bytes_read == path.stat().st_size - len(HEADER)
+
+    query = QuerySpec.model_validate({"filters": [{"column": "Department Name", "op": "eq", "value": "IT"}]})
+    totals, _ = await _aggregate(tmp_path, path, dataset, query)
+    assert totals == {"IT": 5}
+    assert dataset.state().query == query.to_dict()
+
+
+def test_records_prefix_of_file(tmp_path):
+    path = tmp_path / "sales.csv"
+    path.write_bytes(HEADER.encode() + b"HR,2024-01-01,2\nIT")
+    end, sha = records_prefix(str(path))
+    assert end == len(HEADER) + len("HR,2024-01-01,2\n")
+    assert sha == hashlib.sha256(path.read_bytes()[:end]).hexdigest()
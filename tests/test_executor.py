@@ -0,0 +1,74 @@
+import os
+import polars as pl
+import pytest
+from app.service import executor as executor_module
+from app.service.executor import ExecutionBackend, default_job_slots
+from app.service.warmup import warm_up
+from app.service.reader_service import AsyncCSVReaderService
+from app.utils.logger import Logger
+
+
+def _polars_threads_env():
+    return os.environ.get("POLARS_MAX_THREADS")
+
+
+@pytest.mark.asyncio
+@pytest.mark.parametrize("backend", ["thread", "inline"])
+async def test_backend_runs_function(backend):
+    executor = ExecutionBackend(backend=backend, pool_size=2)
+    try:
+        assert await executor.run(sum, [1, 2, 3]) == 6
+    finally:
+        executor.shutdown()
+
+
+@pytest.mark.asyncio
+async def test_process_backend_limits_polars_threads():
+    executor = ExecutionBackend(backend="process", pool_size=1, polars_threads=2)
+    try:
+        assert await executor.run(_polars_threads_env) == "2"
+    finally:
+        executor.shutdown()
+
+
+@pytest.mark.asyncio
+async def test_aggregation_on_process_backend(tmp_path):
+    input_csv = tmp_path / "input.csv"
+    input_csv.write_text("Department Name,Date,Number of Sales\nSales,2024-01-01,10\nHR,2024-01-01,5\nSales,2024-01-02,15\n")
+    executor = ExecutionBackend(backend="process", pool_size=1, polars_threads=1)
+    try:
+        service = AsyncCSVReaderService(logger=Logger(), executor=executor)
+        output_csv_path = await service.aggregate_sales_by_department(str(input_csv), str(tmp_path), retries=1)
+    finally:
+        executor.shutdown()
+    df = pl.read_csv(output_csv_path)
+    assert dict(zip(df["Department Name"], df["Total Number of Sales"])) == {"Sales": 25, "HR": 5}
+
+
+def test_invalid_backend_configuration():
+    with pytest.raises(ValueError):
+        ExecutionBackend(backend="gpu")
+    with pytest.raises(ValueError):
+        ExecutionBackend(backend="thread", pool_size=0)
+
+
+@pytest.mark.parametrize("cpus, memory, expected", [
+    (8, 64 * 1024 ** 3, 8),
+    (8, 3 * 1024 ** 3, 3),
+    (8, 256 * 1024 ** 2, 1),
+    (2, None, 2),
+])
+def test_job_slots_follow_cpus_and_memory(monkeypatch, cpus, memory, expected):
+    monkeypatch.setattr(executor_module, "available_cpus", lambda: cpus)
+    monkeypatch.setattr(executor_module, "available_memory", lambda: memory)
+    assert default_job_slots(job_memory=1024 ** 3) == expected
+
+
+@pytest.mark.asyncio
+async def test_warm_up_starts_every_pool_worker():
+    executor = ExecutionBackend(backend="thread", pool_size=3)
+    try:
+        await warm_up(executor, Logger())
+        assert len(executor._get_executor()._threads) == 3
+    finally:
+        executor.shutdown()
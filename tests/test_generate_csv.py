@@ -3,7 +3,8 @@ import csv
 import tempfile
 import shutil
 import pytest
-from app.utils.generate_csv import generate_csv
+import polars as pl
+from app.utils.generate_csv import generate_csv, generate_csv_vectorized, malformed_values
 
 def test_generate_csv_creates_valid_file():
     # Create a temporary directory for output
@@ -25,3 +26,40 @@ def test_generate_csv_creates_valid_file():
                 assert row[0]  # Department Name not empty
                 assert row[1]  # Date not empty
                 assert row[2].isdigit()  # Number of Sales is a digit
+
+
+def test_generate_csv_malformed_rate():
+    with tempfile.TemporaryDirectory() as tmpdir:
+        generate_csv(1, 500, tmpdir, "2022-01-01", "2022-12-31", malformed_rate=0.5)
+        with open(os.path.join(tmpdir, "sales_data_1.csv"), newline='') as csvfile:
+            rows = list(csv.reader(csvfile))[1:]
+        malformed = sum(not row[2].isdigit() for row in rows)
+        assert 150 < malformed < 350
+
+
+def test_vectorized_generation_is_reproducible_and_valid(tmp_path):
+    first, second = tmp_path / "a", tmp_path / "b"
+    first.mkdir()
+    second.mkdir()
+    generate_csv_vectorized(2, 1000, str(first), "2022-01-01", "2022-12-31", seed=7, batch_size=300)
+    generate_csv_vectorized(2, 1000, str(second), "2022-01-01", "2022-12-31", seed=7, batch_size=300)
+    content = (first / "sales_data_2.csv").read_text()
+    assert content == (second / "sales_data_2.csv").read_text()
+    with open(first / "sales_data_2.csv", newline='') as csvfile:
+        rows = list(csv.reader(csvfile))
+    assert rows[0] == ["Department Name", "Date", "Number of Sales"]
+    assert len(rows) == 1001
+    assert all(row[2].isdigit() and "2022-01-01" <= row[1] <= "2022-12-31" for row in rows[1:])
+
+
+def test_vectorized_malformed_rate_and_skew(tmp_path):
+    generate_csv_vectorized(1, 20_000, str(tmp_path), "2022-01-01", "2022-12-31", malformed_rate=0.1, skew=2.0, seed=1)
+    df = pl.read_csv(tmp_path / "sales_data_1.csv", infer_schema=False, missing_utf8_is_empty_string=True)
+    sales = df["Number of Sales"].to_list()
+    malformed = sum(not value.isdigit() for value in sales)
+    assert 1_500 < malformed < 2_500
+    assert all(value.isdigit() or value in malformed_values for value in sales)
+    counts = df["Department Name"].value_counts(sort=True)
+    # With skew 2 the first department takes well over half the rows
+    assert counts["Department Name"][0] == "Electronics"
+    assert counts["count"][0] > 10_000
@@ -0,0 +1,127 @@
+import time
+import os
+import pytest
+from app.api.job_store import InMemoryJobStore, SQLiteJobStore, create_job_store, evict_expired_jobs
+from app.utils.bloom import BloomFilter
+from app.utils.logger import Logger
+
+
+def _stores(tmp_path):
+    return [InMemoryJobStore(), SQLiteJobStore(str(tmp_path / "jobs.sqlite3"), batch_size=4, flush_interval=60)]
+
+
+@pytest.mark.parametrize("kind", [0, 1])
+def test_store_crud_and_status_index(tmp_path, kind):
+    store = _stores(tmp_path)[kind]
+    store["a"] = {"status": "WAITING", "result": None}
+    store["b"] = {"status": "WAITING", "result": None}
+    store.update("a", status="FINISHED", result="out.csv")
+    assert store.get("a")["result"] == "out.csv"
+    assert store.get("missing") is None
+    assert "b" in store
+    assert sorted(store.ids_by_status("WAITING")) == ["b"]
+    assert store.ids_by_status("FINISHED") == ["a"]
+    # Records are copies: mutating one does not change the store
+    store.get("b")["status"] = "FAILED"
+    assert store.get("b")["status"] == "WAITING"
+    store.delete(["a"])
+    assert "a" not in store
+    assert store.was_used("a")
+
+
+def test_sqlite_store_persists_across_instances(tmp_path):
+    path = str(tmp_path / "jobs.sqlite3")
+    store = SQLiteJobStore(path, batch_size=100, flush_interval=60)
+    store["a"] = {"status": "FINISHED", "result": None}
+    store.delete(["a"])
+    store["b"] = {"status": "WAITING", "result": None}
+    store.close()
+    reopened = SQLiteJobStore(path)
+    assert reopened.get("b") == {"status": "WAITING", "result": None}
+    assert reopened.get("a") is None
+    assert reopened.was_used("a")
+
+
+@pytest.mark.parametrize("kind", [0, 1])
+def test_evict_expired_removes_owned_files(tmp_path, kind):
+    store = _stores(tmp_path)[kind]
+    upload_dir = tmp_path / "uploads" / "old"
+    upload_dir.mkdir(parents=True)
+    (upload_dir / "input.csv").write_text("x")
+    result = tmp_path / "result.csv"
+    result.write_text("y")
+    store["old"] = {"status": "FINISHED", "result": str(result), "owned_files": [str(upload_dir)]}
+    store["running"] = {"status": "STARTED", "result": None}
+    assert evict_expired_jobs(store, ttl=-1, logger=Logger()) == 1
+    assert not upload_dir.exists()
+    assert not result.exists()
+    assert "old" not in store
+    assert "running" in store
+
+
+def test_bloom_filter_grows_without_false_negatives():
+    ids = BloomFilter(capacity=100, error_rate=1e-6)
+    for i in range(1000):
+        ids.add(f"job-{i}")
+    assert all(f"job-{i}" in ids for i in range(1000))
+    assert sum(f"other-{i}" in ids for i in range(10000)) == 0
+    restored = BloomFilter(capacity=100, error_rate=1e-6)
+    restored.merge_bytes(ids.to_bytes())
+    assert "job-999" in restored
+
+
+def test_sqlite_updates_from_two_processes_keep_each_others_fields(tmp_path):
+    path = str(tmp_path / "jobs.sqlite3")
+    api = SQLiteJobStore(path, batch_size=100, flush_interval=60)
+    worker = SQLiteJobStore(path, batch_size=100, flush_interval=60)
+    api["a"] = {"status": "WAITING", "result": None, "preview": None}
+    api.flush()
+    worker.update("a", status="FINISHED", result="out.csv")
+    # Updated from a copy that still says WAITING
+    assert api.update("a", preview={"rows": []})["status"] == "WAITING"
+    worker.flush()
+    api.flush()
+    for store in (api, worker):
+        assert store.get("a") == {"status": "FINISHED", "result": "out.csv", "preview": {"rows": []}}
+    assert api.ids_by_status("FINISHED") == ["a"]
+
+
+def test_sqlite_store_sees_ids_used_by_another_process(tmp_path):
+    path = str(tmp_path / "jobs.sqlite3")
+    first = SQLiteJobStore(path, batch_size=1, flush_interval=60)
+    second = SQLiteJobStore(path, batch_size=1, flush_interval=60)
+    first["shared"] = {"status": "FINISHED", "result": None}
+    first.delete(["shared"])
+    first.flush()
+    assert "shared" not in second
+    assert second.was_used("shared")
+
+
+def test_sqlite_store_flushes_on_timer_and_persists_changed_layers(tmp_path):
+    path = str(tmp_path / "jobs.sqlite3")
+    store = SQLiteJobStore(path, batch_size=100, flush_interval=0.05)
+    store.used_ids = BloomFilter(capacity=2)
+    for i in range(5):
+        store[f"job-{i}"] = {"status": "WAITING", "result": None}
+    time.sleep(0.3)
+    # Flushed by the timer without any further write
+    reader = SQLiteJobStore(path)
+    assert reader.get("job-4") == {"status": "WAITING", "result": None}
+    keys = [k for (k,) in reader._conn.execute("SELECT key FROM meta WHERE key LIKE 'used_ids:%' ORDER BY key")]
+    assert keys == ["used_ids:0", "used_ids:1"]
+    assert store.used_ids.dirty_layers() == []
+    store["job-5"] = {"status": "WAITING", "result": None}
+    assert store.used_ids.dirty_layers() == [1]
+    store.close()
+
+
+@pytest.mark.parametrize("kind", ["memory", "sqlite"])
+def test_store_notifies_listeners_on_writes(tmp_path, kind):
+    store = create_job_store(kind, str(tmp_path / "jobs.sqlite3"))
+    seen = []
+    store.listeners.append(seen.append)
+    store["a"] = {"status": "WAITING", "result": None}
+    store.update("a", status="STARTED")
+    store.delete(["a"])
+    assert seen == ["a", "a", "a"]
+    store.close()
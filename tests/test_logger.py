@@ -38,3 +38,48 @@ def test_logger_methods(caplog):
     logger.critical('critical message')
     assert 'critical message' in caplog.text
     logger.logger.setLevel(logging.INFO)
+
+
+def _record(msg, *args, level=logging.INFO):
+    return logging.LogRecord("csv_parser", level, __file__, 1, msg, args, None)
+
+
+def test_rate_limit_per_template(monkeypatch):
+    from app.utils.logger import RateLimitFilter
+    clock = [100.0]
+    monkeypatch.setattr("app.utils.logger.time.monotonic", lambda: clock[0])
+    limiter = RateLimitFilter(rate=1, burst=2)
+    assert [limiter.filter(_record("poll %s", i)) for i in range(4)] == [True, True, False, False]
+    # Other templates and warnings have their own budget
+    assert limiter.filter(_record("other"))
+    assert limiter.filter(_record("poll %s", 5, level=logging.WARNING))
+    clock[0] += 1
+    record = _record("poll %s", 6)
+    assert limiter.filter(record)
+    assert record.suppressed == 2
+    assert limiter.suppressed == 2
+
+
+def test_queue_handler_defers_formatting_and_drops_when_full():
+    import queue
+    from app.utils.logger import BackgroundQueueHandler
+    handler = BackgroundQueueHandler(queue.Queue(1))
+    args = (["job-1"], 2)
+    handler.handle(_record("job %s %s", *args))
+    handler.handle(_record("job %s %s", *args))
+    queued = handler.queue.get_nowait()
+    assert queued.args == args and queued.msg == "job %s %s"
+    assert handler.dropped == 1
+
+
+def test_json_formatter_includes_log_context():
+    import json
+    from app.utils.logger import ContextFilter, JsonFormatter, log_context
+    record = _record("finished %s", "job-1")
+    with log_context(job_id="job-1"), log_context(stage="aggregate"):
+        ContextFilter().filter(record)
+    entry = json.loads(JsonFormatter().format(record))
+    assert entry["message"] == "finished job-1"
+    assert entry["job_id"] == "job-1"
+    assert entry["stage"] == "aggregate"
+    assert entry["level"] == "INFO"
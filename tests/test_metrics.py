@@ -0,0 +1,69 @@
+import pytest
+from fastapi.testclient import TestClient
+from app.api.api import app
+from app.service.reader_service import AsyncCSVReaderService
+from app.utils.logger import Logger
+from app.utils.metrics import (
+    Counter, FIRST_RESULT_SECONDS, Histogram, JobTrace, Registry, STAGE_SECONDS, process_uptime, record_first_result
+)
+
+
+def test_registry_renders_prometheus_text():
+    registry = Registry()
+    jobs = registry.register(Counter("jobs_total", "Jobs.", ["status"]))
+    latency = registry.register(Histogram("latency_seconds", "Latency.", buckets=(0.1, 1)))
+    jobs.inc(status="FINISHED")
+    jobs.inc(2, status="FINISHED")
+    latency.observe(0.05)
+    latency.observe(0.5)
+    latency.observe(5)
+    text = registry.render()
+    assert "# TYPE jobs_total counter" in text
+    assert 'jobs_total{status="FINISHED"} 3' in text
+    assert 'latency_seconds_bucket{le="0.1"} 1' in text
+    assert 'latency_seconds_bucket{le="1"} 2' in text
+    assert 'latency_seconds_bucket{le="+Inf"} 3' in text
+    assert "latency_seconds_count 3" in text
+
+
+@pytest.mark.asyncio
+@pytest.mark.parametrize("engine,parallel,columnar", [
+    ("streaming", "off", "on"), ("parquet", "off", "on"), ("parquet", "off", "off"), ("streaming", "on", "on")
+])
+async def test_service_trace_reports_stages_rows_and_bytes(tmp_path, engine, parallel, columnar):
+    input_csv = tmp_path / "input.csv"
+    input_csv.write_text("Department Name,Date,Number of Sales\nHR,2024-01-01,2\nIT,2024-01-02,4\nHR,2024-01-03,x\n")
+    trace = JobTrace()
+    service = AsyncCSVReaderService(
+        logger=Logger(), engine=engine, parallel=parallel, trace=trace, columnar=columnar, columnar_dir=str(tmp_path / "columnar")
+    )
+    await service.aggregate_sales_by_department(str(input_csv), str(tmp_path), retries=1)
+    assert trace.rows == 3
+    assert trace.bytes_read > 0
+    assert trace.peak_rss_bytes > 0
+    assert "write_result" in trace.stages
+    if engine == "parquet" and columnar == "off":
+        assert {"parquet_spill", "group_by"} <= set(trace.stages)
+    elif engine == "parquet":
+        # The conversion is kept as the input's columnar copy
+        assert "columnar_build" in trace.stages
+        assert trace.row_groups == {"read": 1, "skipped": 0}
+
+
+def test_metrics_endpoint():
+    JobTrace().publish()
+    STAGE_SECONDS.observe(0.2, stage="scan_clean_group")
+    response = TestClient(app).get("/metrics")
+    assert response.status_code == 200
+    assert response.headers["content-type"].startswith("text/plain")
+    for name in ("csv_stage_duration_seconds_bucket", "csv_queue_depth", "csv_active_workers", "csv_rows_processed_total"):
+        assert name in response.text
+
+
+def test_time_to_first_result_is_recorded_once():
+    FIRST_RESULT_SECONDS.set(0)
+    first = record_first_result()
+    assert 0 < first <= process_uptime()
+    assert record_first_result() is None
+    assert FIRST_RESULT_SECONDS.value() == first
+    assert "csv_time_to_first_result_seconds" in TestClient(app).get("/metrics").text
@@ -0,0 +1,71 @@
+import glob
+import polars as pl
+import pytest
+from app.service.preview import sample_preview
+from app.service.query import QuerySpec
+from app.service.reader_service import AsyncCSVReaderService
+from app.utils.generate_csv import generate_csv_vectorized
+from app.utils.logger import Logger
+
+
+@pytest.fixture(scope="module")
+def sales_csv(tmp_path_factory):
+    out_dir = tmp_path_factory.mktemp("preview")
+    generate_csv_vectorized(1, 100_000, str(out_dir), "2022-01-01", "2022-12-31", malformed_rate=0.05, seed=11)
+    return glob.glob(str(out_dir / "*.csv"))[0]
+
+
+async def _exact(path, query, name, tmp_path):
+    """Known totals: the exact result of the same query over the whole file."""
+    service = AsyncCSVReaderService(logger=Logger(), query=query, checkpoints=False)
+    result = pl.read_csv(await service.aggregate_sales_by_department(path, str(tmp_path)))
+    return dict(zip(result["Department Name"], result[name]))
+
+
+def _coverage(path, query, exact, seeds=15):
+    """Share of the intervals, over ``seeds`` samples, containing the exact value; per aggregation."""
+    covered = dict.fromkeys(exact, 0)
+    total = 0
+    for seed in range(seeds):
+        preview = sample_preview(path, query, fraction=0.2, block_bytes=16384, seed=seed)
+        for row in preview["rows"]:
+            total += 1
+            for name, values in exact.items():
+                covered[name] += row[name]["low"] <= values[row["Department Name"]] <= row[name]["high"]
+    return {name: hits / total for name, hits in covered.items()}
+
+
+@pytest.mark.asyncio
+async def test_preview_intervals_cover_known_totals(sales_csv, tmp_path):
+    exact = await _exact(sales_csv, QuerySpec(), "Total Number of Sales", tmp_path)
+    coverage = _coverage(sales_csv, QuerySpec(), {"Total Number of Sales": exact})
+    # Nominal 95% intervals; the normal approximation may undercover a little
+    assert coverage["Total Number of Sales"] >= 0.85
+
+
+@pytest.mark.asyncio
+async def test_preview_intervals_cover_counts_and_means(sales_csv, tmp_path):
+    query = QuerySpec.model_validate({"aggregations": [
+        {"op": "count", "alias": "rows"},
+        {"op": "mean", "column": "Number of Sales", "alias": "mean"},
+    ]})
+    exact = {name: await _exact(sales_csv, query, name, tmp_path) for name in ("rows", "mean")}
+    coverage = _coverage(sales_csv, query, exact)
+    assert coverage["rows"] >= 0.85 and coverage["mean"] >= 0.85
+
+
+@pytest.mark.asyncio
+async def test_full_sample_is_exact(sales_csv, tmp_path):
+    exact = await _exact(sales_csv, QuerySpec(), "Total Number of Sales", tmp_path)
+    preview = sample_preview(sales_csv, fraction=1.0, block_bytes=4096)
+    assert preview["sampled_fraction"] == 1.0
+    for row in preview["rows"]:
+        estimate = row["Total Number of Sales"]
+        assert estimate["estimate"] == pytest.approx(exact[row["Department Name"]])
+        assert estimate["high"] - estimate["low"] == pytest.approx(0)
+
+
+def test_preview_rejects_unsupported_aggregations(sales_csv):
+    query = QuerySpec.model_validate({"aggregations": [{"op": "max", "column": "Number of Sales"}]})
+    with pytest.raises(ValueError):
+        sample_preview(sales_csv, query)
@@ -0,0 +1,137 @@
+import datetime
+import polars as pl
+import pytest
+from pydantic import ValidationError
+from app.service.query import CLEAN, DEFAULTED, REPAIRED, SALES_STATE, CompiledQuery, QuerySpec, clean_sales
+from app.service.reader_service import AsyncCSVReaderService
+from app.utils.logger import Logger
+
+CSV = (
+    "Department Name,Date,Number of Sales\n"
+    "Sales,2024-01-05,10\n"
+    "Sales,2024-01-20,4\n"
+    "Sales,2024-02-03,x6\n"
+    "HR,2024-01-07,5\n"
+    "HR,2024-03-01,\n"
+    "IT,not-a-date,7\n"
+)
+
+MULTI = {
+    "group_by": ["Department Name", {"column": "Date", "truncate": "month", "alias": "Month"}],
+    "aggregations": [
+        {"op": "sum", "column": "Number of Sales", "alias": "Total"},
+        {"op": "count"},
+        {"op": "mean", "column": "Number of Sales", "alias": "Mean"},
+        {"op": "min", "column": "Date", "alias": "First"},
+        {"op": "max", "column": "Number of Sales", "alias": "Largest"},
+        {"op": "approx_distinct", "column": "Date", "alias": "Days"},
+    ],
+    "filters": [{"column": "Date", "op": "between", "value": ["2024-01-01", "2024-02-29"]}],
+}
+
+
+def _rows(df):
+    return {(r["Department Name"], r["Month"]): r for r in df.to_dicts()}
+
+
+def test_default_query_is_sales_per_department():
+    df = CompiledQuery().plan(pl.read_csv(CSV.encode(), schema_overrides={"Date": pl.Date}, ignore_errors=True).lazy()).collect()
+    totals = dict(zip(df["Department Name"], df["Total Number of Sales"]))
+    assert totals == {"Sales": 20, "HR": 5, "IT": 7}
+
+
+def test_multi_aggregation_query():
+    spec = QuerySpec.model_validate(MULTI)
+    lf = pl.read_csv(CSV.encode(), schema_overrides={"Date": pl.Date}, ignore_errors=True).lazy()
+    rows = _rows(CompiledQuery(spec).plan(lf).collect())
+    jan = rows[("Sales", datetime.date(2024, 1, 1))]
+    assert (jan["Total"], jan["count(*)"], jan["Mean"], jan["Largest"], jan["Days"]) == (14, 2, 7.0, 10, 2)
+    assert jan["First"] == datetime.date(2024, 1, 5)
+    assert rows[("Sales", datetime.date(2024, 2, 1))]["Total"] == 6
+    # The March row and the row without a valid date are filtered out
+    assert set(rows) == {("Sales", datetime.date(2024, 1, 1)), ("Sales", datetime.date(2024, 2, 1)), ("HR", datetime.date(2024, 1, 1))}
+
+
+def test_query_reads_only_referenced_columns():
+    spec = QuerySpec.model_validate({"group_by": ["Department Name"], "aggregations": [{"op": "count"}]})
+    assert spec.columns() == ["Department Name"]
+
+
+def test_approx_distinct_merges_sketches(monkeypatch):
+    monkeypatch.setattr("app.service.query.DISTINCT_SKETCH_SIZE", 64)
+    spec = QuerySpec.model_validate({"aggregations": [{"op": "approx_distinct", "column": "Number of Sales", "alias": "n"}]})
+    compiled = CompiledQuery(spec)
+    pieces = [pl.DataFrame({"Department Name": ["A"] * 1000, "Number of Sales": [str(i) for i in range(start, start + 1000)]}) for start in (0, 500)]
+    merged = compiled.merge([compiled.partial(p.lazy()).collect() for p in pieces])
+    assert abs(merged["n"][0] - 1500) < 1500 * 0.35
+    small = compiled.merge([compiled.partial(p.head(10).lazy()).collect() for p in pieces])
+    assert small["n"][0] == 20
+
+
+@pytest.mark.parametrize("spec", [
+    {"group_by": [{"column": "Department Name", "truncate": "month"}]},
+    {"aggregations": [{"op": "sum", "column": "Date"}]},
+    {"aggregations": [{"op": "mean"}]},
+    {"aggregations": [{"op": "count"}, {"op": "count"}]},
+    {"filters": [{"column": "Date", "op": "ge", "value": "January"}]},
+    {"filters": [{"column": "Date", "op": "between", "value": ["2024-01-01"]}]},
+    {"aggregations": [{"op": "median", "column": "Number of Sales"}]},
+    {"group_by": []},
+])
+def test_invalid_queries_rejected(spec):
+    with pytest.raises(ValidationError):
+        QuerySpec.model_validate(spec)
+
+
+def test_query_round_trips_through_dict():
+    spec = QuerySpec.model_validate(MULTI)
+    assert QuerySpec.model_validate(spec.to_dict()) == spec
+    assert QuerySpec().to_dict() != spec.to_dict()
+
+
+@pytest.mark.asyncio
+@pytest.mark.parametrize("engine,parallel", [("streaming", "off"), ("streaming", "on"), ("parquet", "off")])
+async def test_query_paths_agree(tmp_path, monkeypatch, engine, parallel):
+    monkeypatch.setattr("app.service.reader_service.RANGE_BLOCK_BYTES", 64)
+    input_csv = tmp_path / "input.csv"
+    header, body = CSV.split("\n", 1)
+    input_csv.write_text(header + "\n" + body * 20)
+    spec = QuerySpec.model_validate(MULTI)
+    service = AsyncCSVReaderService(
+        logger=Logger(), engine=engine, parallel=parallel, query=spec, columnar_dir=str(tmp_path / "columnar")
+    )
+    df = pl.read_csv(await service.aggregate_sales_by_department(str(input_csv), str(tmp_path), retries=1), try_parse_dates=True)
+    rows = _rows(df)
+    jan = rows[("Sales", datetime.date(2024, 1, 1))]
+    assert (jan["Total"], jan["count(*)"], jan["Days"]) == (280, 40, 2)
+    # Rows that passed the filter
+    assert service.trace.rows == 80
+
+
+@pytest.mark.asyncio
+async def test_batch_query_merges_shards(tmp_path):
+    paths = []
+    for i in range(3):
+        path = tmp_path / f"sales_data_{i}.csv"
+        path.write_text(CSV)
+        paths.append(str(path))
+    spec = QuerySpec.model_validate(MULTI)
+    service = AsyncCSVReaderService(logger=Logger(), query=spec)
+    df = pl.read_csv(await service.aggregate_sales_by_department_batch(paths, str(tmp_path), retries=1), try_parse_dates=True)
+    hr = _rows(df)[("HR", datetime.date(2024, 1, 1))]
+    assert (hr["Total"], hr["Mean"], hr["Days"]) == (15, 5.0, 1)
+
+
+def test_sales_fast_path_matches_regex_repair():
+    values = ["5", "007", "+5", "-5", " 7", "1a2", "x6", "1e3", "", None, "abc", "٣", "12.5", "9223372036854775807"]
+    df = pl.DataFrame({"Number of Sales": values}, schema={"Number of Sales": pl.Utf8})
+    cleaned = clean_sales(df.lazy()).collect()
+    # The repair every value used to go through
+    legacy = df.select(
+        pl.col("Number of Sales").str.replace_all(r"[^0-9]", "").str.replace_all(r"^$", "0").cast(pl.Int64).fill_null(0)
+    )
+    assert cleaned["Number of Sales"].to_list() == legacy["Number of Sales"].to_list()
+    states = dict(zip(values, cleaned[SALES_STATE].to_list()))
+    assert states["007"] == states["+5"] == states["9223372036854775807"] == CLEAN
+    assert states["-5"] == states["1a2"] == states[" 7"] == REPAIRED
+    assert states[""] == states[None] == states["abc"] == DEFAULTED
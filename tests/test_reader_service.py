@@ -3,9 +3,14 @@ import polars as pl
 import tempfile
 import os
 import asyncio
+from app.service.executor import ExecutionBackend
 from app.service.reader_service import AsyncCSVReaderService
 from app.utils.logger import Logger
 
+# Parallel tests split files into at least as many ranges as the pool has slots,
+# so they use a fixed pool instead of one sized from the host
+POOL = ExecutionBackend("thread", pool_size=4)
+
 @pytest.mark.asyncio
 async def test_aggregate_sales_by_department(tmp_path):
     # Prepare a sample CSV file
@@ -24,3 +29,249 @@ async def test_aggregate_sales_by_department(tmp_path):
     assert sales_row["Total Number of Sales"][0] == 25
     hr_row = df.filter(pl.col("Department Name") == "HR")
     assert hr_row["Total Number of Sales"][0] == 5
+
+
+@pytest.mark.asyncio
+@pytest.mark.parametrize("engine", ["streaming", "parquet"])
+async def test_aggregate_engines_handle_malformed_values(tmp_path, engine):
+    csv_content = (
+        "Department Name,Date,Number of Sales\n"
+        "Sales,2024-01-01,10\n"
+        "Sales,2024-01-02,\n"
+        "HR,2024-01-01,abc\n"
+        "HR,2024-01-03,1a2\n"
+        "IT,not-a-date,7\n"
+    )
+    input_csv = tmp_path / "input.csv"
+    input_csv.write_text(csv_content)
+    service = AsyncCSVReaderService(logger=Logger(), engine=engine, columnar_dir=str(tmp_path / "columnar"))
+    output_csv_path = await service.aggregate_sales_by_department(str(input_csv), str(tmp_path), retries=1)
+    df = pl.read_csv(output_csv_path)
+    assert df.columns == ["Department Name", "Total Number of Sales"]
+    totals = dict(zip(df["Department Name"], df["Total Number of Sales"]))
+    assert totals == {"Sales": 10, "HR": 12, "IT": 7}
+    assert service.trace.cleaning == {"repaired": 1, "defaulted": 2, "dropped": 0}
+
+
+def test_unknown_engine_rejected():
+    with pytest.raises(ValueError):
+        AsyncCSVReaderService(logger=Logger(), engine="bogus")
+
+
+@pytest.mark.asyncio
+async def test_aggregate_batch_merges_shards(tmp_path):
+    shard1 = tmp_path / "sales_data_1.csv"
+    shard1.write_text("Department Name,Date,Number of Sales\nSales,2024-01-01,10\nHR,2024-01-01,5\n")
+    shard2 = tmp_path / "sales_data_2.csv"
+    shard2.write_text("Department Name,Date,Number of Sales\nSales,2024-01-02,15\nIT,2024-01-02,x3\n")
+    events = []
+    service = AsyncCSVReaderService(logger=Logger(), checkpoint_dir=str(tmp_path / "checkpoints"))
+    output_csv_path = await service.aggregate_sales_by_department_batch(
+        [str(shard1), str(shard2)], str(tmp_path), retries=1,
+        on_shard_status=lambda path, status, error=None: events.append((os.path.basename(path), status))
+    )
+    df = pl.read_csv(output_csv_path)
+    assert dict(zip(df["Department Name"], df["Total Number of Sales"])) == {"Sales": 25, "HR": 5, "IT": 3}
+    assert ("sales_data_1.csv", "FINISHED") in events
+    assert ("sales_data_2.csv", "FINISHED") in events
+
+
+@pytest.mark.asyncio
+async def test_aggregate_batch_fails_when_a_shard_fails(tmp_path):
+    shard = tmp_path / "sales_data_1.csv"
+    shard.write_text("Department Name,Date,Number of Sales\nSales,2024-01-01,10\n")
+    events = []
+    service = AsyncCSVReaderService(logger=Logger(), checkpoint_dir=str(tmp_path / "checkpoints"))
+    with pytest.raises(Exception):
+        await service.aggregate_sales_by_department_batch(
+            [str(shard), str(tmp_path / "missing.csv")], str(tmp_path), retries=1, delay=0,
+            on_shard_status=lambda path, status, error=None: events.append((os.path.basename(path), status))
+        )
+    assert ("missing.csv", "FAILED") in events
+
+
+@pytest.mark.asyncio
+async def test_parallel_mode_matches_serial(tmp_path, monkeypatch):
+    # Small blocks so every range is parsed in several pieces
+    monkeypatch.setattr("app.service.reader_service.RANGE_BLOCK_BYTES", 512)
+    lines = ["Department Name,Date,Number of Sales"]
+    for i in range(2000):
+        dept = '"Home, Kitchen"' if i % 4 == 0 else f"Dept{i % 3}"
+        sales = "" if i % 11 == 0 else ("7a" if i % 13 == 0 else str(i % 50))
+        lines.append(f"{dept},2024-01-{i % 28 + 1:02d},{sales}")
+    input_csv = tmp_path / "input.csv"
+    input_csv.write_text("\n".join(lines) + "\n")
+    serial = AsyncCSVReaderService(logger=Logger(), parallel="off")
+    parallel = AsyncCSVReaderService(logger=Logger(), executor=POOL, parallel="on", checkpoint_dir=str(tmp_path / "checkpoints"))
+    expected = pl.read_csv(await serial.aggregate_sales_by_department(str(input_csv), str(tmp_path), retries=1))
+    actual = pl.read_csv(await parallel.aggregate_sales_by_department(str(input_csv), str(tmp_path), retries=1))
+    assert actual.sort("Department Name").equals(expected.sort("Department Name"))
+    assert parallel.trace.cleaning == serial.trace.cleaning
+    assert serial.trace.cleaning["repaired"] > 0 and serial.trace.cleaning["defaulted"] > 0
+
+    progress = []
+    await AsyncCSVReaderService(logger=Logger(), executor=POOL, parallel="on", checkpoint_dir=str(tmp_path / "checkpoints")).aggregate_sales_by_department(
+        str(input_csv), str(tmp_path), retries=1, on_progress=lambda done, total: progress.append((done, total))
+    )
+    total = progress[0][1]
+    assert progress[0] == (0, total) and progress[-1] == (total, total)
+    assert len(progress) > 2 and [d for d, _ in progress] == sorted(d for d, _ in progress)
+
+
+def test_parallel_auto_threshold(tmp_path):
+    input_csv = tmp_path / "input.csv"
+    input_csv.write_text("Department Name,Date,Number of Sales\nHR,2024-01-01,5\n")
+    service = AsyncCSVReaderService(logger=Logger(), parallel="auto", parallel_threshold=10)
+    assert service._use_parallel(str(input_csv))
+    service = AsyncCSVReaderService(logger=Logger(), parallel="auto", parallel_threshold=10**9)
+    assert not service._use_parallel(str(input_csv))
+    # The legacy engine has no parallel path: auto stays serial and "on" is refused
+    service = AsyncCSVReaderService(logger=Logger(), engine="parquet", parallel="auto", parallel_threshold=10)
+    assert not service._use_parallel(str(input_csv))
+    with pytest.raises(ValueError):
+        AsyncCSVReaderService(logger=Logger(), engine="parquet", parallel="on")
+
+
+@pytest.mark.asyncio
+async def test_compressed_inputs_match_plain(tmp_path, monkeypatch):
+    import bz2
+    import gzip
+    monkeypatch.setattr("app.service.reader_service.RANGE_BLOCK_BYTES", 64)
+    body = "Department Name,Date,Number of Sales\n" + "".join(
+        f'"Dept, {i % 3}",2024-01-{i % 28 + 1:02d},{i}\n' for i in range(300)
+    )
+    data = body.encode()
+    half = data.index(b"\n", len(data) // 2) + 1
+    inputs = {
+        "plain.csv": data,
+        # Two gzip members, as written by appending compressed exports
+        "multi.csv.gz": gzip.compress(data[:half]) + gzip.compress(data[half:]),
+        "data.bz2": bz2.compress(data),
+    }
+    results = {}
+    for name, content in inputs.items():
+        (tmp_path / name).write_bytes(content)
+        # "on" falls back to serial for compressed files
+        service = AsyncCSVReaderService(logger=Logger(), parallel="on", checkpoint_dir=str(tmp_path / "checkpoints"))
+        path = await service.aggregate_sales_by_department(str(tmp_path / name), str(tmp_path), retries=1)
+        results[name] = pl.read_csv(path).sort("Department Name")
+        assert service.trace.rows == 300
+    assert results["multi.csv.gz"].equals(results["plain.csv"])
+    assert results["data.bz2"].equals(results["plain.csv"])
+    batch = AsyncCSVReaderService(logger=Logger(), checkpoint_dir=str(tmp_path / "checkpoints"))
+    merged = pl.read_csv(await batch.aggregate_sales_by_department_batch(
+        [str(tmp_path / "multi.csv.gz"), str(tmp_path / "data.bz2")], str(tmp_path), retries=1
+    ))
+    assert merged["Total Number of Sales"].sum() == 2 * results["plain.csv"]["Total Number of Sales"].sum()
+
+
+@pytest.mark.asyncio
+async def test_overflowing_sales_value_is_dropped(tmp_path):
+    input_csv = tmp_path / "input.csv"
+    input_csv.write_text("Department Name,Date,Number of Sales\nHR,2024-01-01,5\nHR,2024-01-02,99999999999999999999\n")
+    service = AsyncCSVReaderService(logger=Logger())
+    df = pl.read_csv(await service.aggregate_sales_by_department(str(input_csv), str(tmp_path), retries=1))
+    assert df.rows() == [("HR", 5)]
+    assert service.trace.cleaning == {"repaired": 0, "defaulted": 0, "dropped": 1}
+    assert service.trace.rows == 2
+
+
+@pytest.mark.asyncio
+async def test_fatal_error_is_not_retried(tmp_path, monkeypatch):
+    sleeps = []
+    monkeypatch.setattr("app.service.reader_service.asyncio.sleep", lambda seconds: sleeps.append(seconds))
+    input_csv = tmp_path / "input.csv"
+    input_csv.write_text("Department Name,Date\nHR,2024-01-01\n")
+    service = AsyncCSVReaderService(logger=Logger())
+    with pytest.raises(pl.exceptions.ColumnNotFoundError):
+        await service.aggregate_sales_by_department(str(input_csv), str(tmp_path), retries=3, delay=100)
+    assert sleeps == []
+
+
+@pytest.mark.asyncio
+async def test_retryable_error_backs_off(tmp_path, monkeypatch):
+    sleeps = []
+
+    async def no_sleep(seconds):
+        sleeps.append(seconds)
+
+    monkeypatch.setattr("app.service.reader_service.asyncio.sleep", no_sleep)
+    calls = []
+
+    async def flaky():
+        calls.append(1)
+        if len(calls) < 3:
+            raise OSError("transient")
+        return "ok"
+
+    service = AsyncCSVReaderService(logger=Logger())
+    assert await service._with_retries("flaky", flaky, retries=3, delay=1) == "ok"
+    assert len(sleeps) == 2 and 0.5 <= sleeps[0] <= 1 and 1 <= sleeps[1] <= 2
+
+
+@pytest.mark.asyncio
+async def test_parallel_job_resumes_from_checkpoints(tmp_path, monkeypatch):
+    import app.service.reader_service as reader_service
+    monkeypatch.setattr(reader_service, "RANGE_BLOCK_BYTES", 512)
+    lines = ["Department Name,Date,Number of Sales"]
+    lines += [f"Dept{i % 5},2024-01-{i % 28 + 1:02d},{i % 40}" for i in range(3000)]
+    input_csv = tmp_path / "input.csv"
+    input_csv.write_text("\n".join(lines) + "\n")
+    checkpoint_dir = tmp_path / "checkpoints"
+    real = reader_service._run_range_aggregation
+    computed = []
+
+    def failing_last_range(path, header, start, end, *args):
+        if end == os.path.getsize(path):
+            raise ValueError("simulated crash")
+        computed.append(start)
+        return real(path, header, start, end, *args)
+
+    monkeypatch.setattr(reader_service, "_run_range_aggregation", failing_last_range)
+    service = AsyncCSVReaderService(logger=Logger(), executor=POOL, parallel="on", checkpoint_dir=str(checkpoint_dir))
+    with pytest.raises(ValueError):
+        await service.aggregate_sales_by_department(str(input_csv), str(tmp_path), retries=1)
+    finished = len(computed)
+    assert finished >= 1
+
+    def counting(path, header, start, end, *args):
+        computed.append(start)
+        return real(path, header, start, end, *args)
+
+    monkeypatch.setattr(reader_service, "_run_range_aggregation", counting)
+    service = AsyncCSVReaderService(logger=Logger(), executor=POOL, parallel="on", checkpoint_dir=str(checkpoint_dir))
+    actual = pl.read_csv(await service.aggregate_sales_by_department(str(input_csv), str(tmp_path), retries=1))
+    # Only the range that failed was aggregated again
+    assert len(computed) == finished + 1
+    serial = AsyncCSVReaderService(logger=Logger(), parallel="off", checkpoints=False)
+    expected = pl.read_csv(await serial.aggregate_sales_by_department(str(input_csv), str(tmp_path), retries=1))
+    assert actual.sort("Department Name").equals(expected.sort("Department Name"))
+    assert os.listdir(checkpoint_dir) == []
+
+
+@pytest.mark.asyncio
+async def test_memory_limit_parses_in_blocks_with_same_result(tmp_path, monkeypatch):
+    import app.service.reader_service as reader_service
+    monkeypatch.setattr(reader_service, "MIN_BLOCK_BYTES", 256)
+    lines = ["Department Name,Date,Number of Sales"]
+    lines += [f'"Dept, {i % 7}",2024-01-{i % 28 + 1:02d},{"" if i % 9 == 0 else i % 30}' for i in range(3000)]
+    input_csv = tmp_path / "input.csv"
+    input_csv.write_text("\n".join(lines) + "\n")
+    unlimited = AsyncCSVReaderService(logger=Logger(), parallel="off", checkpoints=False, columnar="off")
+    expected = pl.read_csv(await unlimited.aggregate_sales_by_department(str(input_csv), str(tmp_path), retries=1))
+
+    parsed = []
+    real = reader_service.AsyncCSVReaderService._partial_aggregate_bytes
+    monkeypatch.setattr(
+        reader_service.AsyncCSVReaderService, "_partial_aggregate_bytes",
+        staticmethod(lambda data, compiled: parsed.append(len(data)) or real(data, compiled))
+    )
+    limited = AsyncCSVReaderService(
+        logger=Logger(), executor=POOL, parallel="off", checkpoints=False, columnar="off", memory_limit=48 * 1024
+    )
+    actual = pl.read_csv(await limited.aggregate_sales_by_department(str(input_csv), str(tmp_path), retries=1))
+    assert actual.sort("Department Name").equals(expected.sort("Department Name"))
+    # 48 KiB over a factor of 12: blocks of about 4 KiB
+    assert len(parsed) > 10 and max(parsed) < 5 * 1024
+    with pytest.raises(ValueError):
+        AsyncCSVReaderService(logger=Logger(), memory_limit=-1)
@@ -0,0 +1,89 @@
+import os
+import threading
+import time
+import pytest
+from app.service.result_cache import ResultCache
+from app.utils.logger import Logger
+
+SPEC = {"group_by": ["Department Name"], "aggregations": [{"column": "Number of Sales", "op": "sum"}]}
+
+
+def _result(tmp_path, name, content="Department Name,Total Number of Sales\nHR,5\n"):
+    path = tmp_path / name
+    path.write_text(content)
+    return str(path)
+
+
+def test_cache_hit_and_miss(tmp_path):
+    cache = ResultCache(str(tmp_path / "cache"), logger=Logger())
+    dest = str(tmp_path / "out1.csv")
+    assert cache.get("abc", SPEC, dest) is None
+    cache.put("abc", SPEC, _result(tmp_path, "result.csv"))
+    assert cache.get("abc", SPEC, dest) == dest
+    assert open(dest).read().startswith("Department Name")
+    # A different spec over the same bytes is a different entry
+    assert cache.get("abc", {"other": True}, str(tmp_path / "out2.csv")) is None
+    stats = cache.stats()
+    assert stats["hits"] == 1
+    assert stats["misses"] == 2
+    assert stats["entries"] == 1
+
+
+def test_cached_copy_survives_result_deletion(tmp_path):
+    cache = ResultCache(str(tmp_path / "cache"), logger=Logger())
+    result = _result(tmp_path, "result.csv")
+    cache.put("abc", SPEC, result)
+    os.remove(result)
+    assert cache.get("abc", SPEC, str(tmp_path / "out.csv")) is not None
+
+
+def test_cache_evicts_by_size_lru(tmp_path):
+    cache = ResultCache(str(tmp_path / "cache"), max_bytes=100, logger=Logger())
+    cache.put("a", SPEC, _result(tmp_path, "a.csv", "x" * 60))
+    cache.put("b", SPEC, _result(tmp_path, "b.csv", "y" * 60))
+    assert cache.get("a", SPEC, str(tmp_path / "a_out.csv")) is None
+    assert cache.get("b", SPEC, str(tmp_path / "b_out.csv")) is not None
+    assert cache.stats()["evictions"] >= 1
+
+
+def test_replacing_an_entry_is_not_an_eviction(tmp_path):
+    cache = ResultCache(str(tmp_path / "cache"), logger=Logger())
+    cache.put("a", SPEC, _result(tmp_path, "a.csv"))
+    cache.put("a", SPEC, _result(tmp_path, "a2.csv"))
+    index_path = tmp_path / "cache" / "index.json"
+    mtime = index_path.stat().st_mtime_ns
+    stats = cache.stats()
+    assert stats["evictions"] == 0
+    assert stats["entries"] == 1
+    # Reading stats does not rewrite the index
+    assert index_path.stat().st_mtime_ns == mtime
+
+
+def test_cache_evicts_by_age(tmp_path):
+    cache = ResultCache(str(tmp_path / "cache"), max_age=0.01, logger=Logger())
+    cache.put("a", SPEC, _result(tmp_path, "a.csv"))
+    time.sleep(0.05)
+    assert cache.get("a", SPEC, str(tmp_path / "out.csv")) is None
+    assert cache.stats()["entries"] == 0
+
+
+def test_cache_concurrent_access(tmp_path):
+    cache = ResultCache(str(tmp_path / "cache"), logger=Logger())
+    errors = []
+
+    def run(i):
+        try:
+            cache.put(f"fp{i % 4}", SPEC, _result(tmp_path, f"r{i}.csv"))
+            cache.get(f"fp{i % 4}", SPEC, str(tmp_path / f"o{i}.csv"))
+        except Exception as e:  # pragma: no cover
+            errors.append(e)
+
+    threads = [threading.Thread(target=run, args=(i,)) for i in range(16)]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    assert not errors
+    stats = cache.stats()
+    assert stats["entries"] == 4
+    assert stats["hits"] == 16
@@ -0,0 +1,42 @@
+import gzip
+import polars as pl
+import pytest
+from app.service.result_formats import OutputOptions, open_decoded, read_result, write_result
+
+DF = pl.DataFrame({"Department Name": ["HR", "IT"], "Number of Sales": [3, 4]})
+
+
+@pytest.mark.parametrize("fmt,compression", [
+    ("csv", "none"), ("csv", "gzip"), ("ndjson", "gzip"),
+    ("parquet", "none"), ("parquet", "gzip"), ("parquet", "zstd"),
+    ("ipc", "none"), ("ipc", "zstd"),
+])
+def test_write_read_round_trip(tmp_path, fmt, compression):
+    options = OutputOptions(fmt, compression)
+    path = str(tmp_path / f"result{options.extension}")
+    write_result(DF, path, options)
+    assert read_result(path, options).equals(DF)
+
+
+def test_gzip_text_is_a_gzip_stream(tmp_path):
+    options = OutputOptions("csv", "gzip")
+    assert options.extension == ".csv.gz"
+    assert options.content_encoding == "gzip"
+    path = str(tmp_path / "result.csv.gz")
+    write_result(DF, path, options)
+    with open(path, "rb") as f:
+        assert gzip.decompress(f.read()).startswith(b"Department Name,Number of Sales")
+    with open_decoded(path, options) as f:
+        assert f.read().startswith(b"Department Name")
+
+
+def test_columnar_compression_has_no_content_encoding():
+    options = OutputOptions("parquet", "zstd")
+    assert options.content_encoding is None
+    assert options.extension == ".parquet"
+
+
+@pytest.mark.parametrize("fmt,compression", [("xlsx", "none"), ("csv", "brotli"), ("ipc", "gzip")])
+def test_invalid_options_rejected(fmt, compression):
+    with pytest.raises(ValueError):
+        OutputOptions(fmt, compression)
@@ -0,0 +1,25 @@
+from concurrent.futures.process import BrokenProcessPool
+import polars as pl
+from app.service.retry import backoff_delay, is_retryable
+
+
+def test_deterministic_errors_are_fatal():
+    assert not is_retryable(FileNotFoundError("gone.csv"))
+    assert not is_retryable(ValueError("bad spec"))
+    assert not is_retryable(pl.exceptions.ColumnNotFoundError("Number of Sales"))
+
+
+def test_transient_errors_are_retryable():
+    assert is_retryable(OSError("disk hiccup"))
+    assert is_retryable(BrokenProcessPool("worker died"))
+    assert is_retryable(MemoryError())
+    assert is_retryable(TimeoutError())
+    assert is_retryable(RuntimeError("unknown"))
+
+
+def test_backoff_grows_with_jitter_and_is_capped():
+    for attempt, ceiling in ((1, 2), (2, 4), (3, 8)):
+        delays = [backoff_delay(attempt, 2) for _ in range(50)]
+        assert all(ceiling / 2 <= d <= ceiling for d in delays)
+        assert len(set(delays)) > 1
+    assert all(5 <= backoff_delay(20, 2, max_delay=10) <= 10 for _ in range(50))
@@ -0,0 +1,110 @@
+import asyncio
+import io
+import time
+import pytest
+from fastapi.testclient import TestClient
+from app.api.api import app
+from app.api.scheduler import JobScheduler, QueueFull
+from app.api.state import jobs, used_job_ids, job_queue
+
+
+def _drain(scheduler):
+    return [scheduler.get_nowait()["id"] for _ in range(scheduler.qsize())]
+
+
+def test_shortest_job_first_within_priority():
+    scheduler = JobScheduler()
+    scheduler.put_nowait({"id": "big"}, size=20_000)
+    scheduler.put_nowait({"id": "small"}, size=10)
+    scheduler.put_nowait({"id": "medium"}, size=500)
+    scheduler.put_nowait({"id": "urgent-big"}, size=50_000, priority=5)
+    assert _drain(scheduler) == ["urgent-big", "small", "medium", "big"]
+
+
+def test_starved_jobs_jump_ahead():
+    scheduler = JobScheduler(starvation_seconds=0.05)
+    scheduler.put_nowait({"id": "big"}, size=20_000)
+    scheduler.put_nowait({"id": "urgent-big"}, size=30_000, priority=5)
+    time.sleep(0.06)
+    scheduler.put_nowait({"id": "small"}, size=10)
+    # Starved jobs still go by priority among themselves
+    assert _drain(scheduler) == ["urgent-big", "big", "small"]
+
+
+def test_on_admit_runs_only_for_admitted_jobs():
+    scheduler = JobScheduler(max_depth=1)
+    admitted = []
+    scheduler.put_nowait({"id": "a"}, on_admit=lambda: admitted.append("a"))
+    with pytest.raises(QueueFull):
+        scheduler.put_nowait({"id": "b"}, on_admit=lambda: admitted.append("b"))
+    assert admitted == ["a"]
+
+
+def test_admission_limits():
+    scheduler = JobScheduler(max_depth=2, max_bytes=100)
+    scheduler.put_nowait({"id": "a"}, size=60)
+    with pytest.raises(QueueFull) as exc:
+        scheduler.put_nowait({"id": "b"}, size=60)
+    assert exc.value.retry_after >= 1
+    scheduler.put_nowait({"id": "c"}, size=30)
+    with pytest.raises(QueueFull):
+        scheduler.put_nowait({"id": "d"}, size=0)
+    stats = scheduler.stats()
+    assert stats["depth"] == 2
+    assert stats["queued_bytes"] == 90
+    assert stats["rejected"] == 2
+    # A single job larger than the budget is admitted into an empty queue
+    empty = JobScheduler(max_bytes=10)
+    empty.put_nowait({"id": "huge"}, size=1000)
+
+
+@pytest.mark.asyncio
+async def test_get_waits_and_join_completes():
+    scheduler = JobScheduler()
+    getter = asyncio.create_task(scheduler.get())
+    await asyncio.sleep(0)
+    await scheduler.put({"id": "a"}, size=1)
+    assert (await asyncio.wait_for(getter, 1))["id"] == "a"
+    joiner = asyncio.create_task(scheduler.join())
+    await asyncio.sleep(0)
+    assert not joiner.done()
+    scheduler.task_done()
+    await asyncio.wait_for(joiner, 1)
+    assert scheduler.stats()["in_progress"] == 0
+
+
+@pytest.mark.asyncio
+async def test_cancelled_getter_passes_wakeup_on():
+    scheduler = JobScheduler()
+    first = asyncio.create_task(scheduler.get())
+    second = asyncio.create_task(scheduler.get())
+    await asyncio.sleep(0)
+    scheduler.put_nowait({"id": "only"})
+    # The woken getter is cancelled before it runs; the other one must still get the job
+    first.cancel()
+    assert (await asyncio.wait_for(second, 1))["id"] == "only"
+
+
+@pytest.mark.asyncio
+async def test_clear_releases_joiners():
+    scheduler = JobScheduler()
+    scheduler.put_nowait({"id": "a"})
+    joiner = asyncio.create_task(scheduler.join())
+    await asyncio.sleep(0)
+    scheduler.clear()
+    await asyncio.wait_for(joiner, 1)
+
+
+def test_process_returns_429_when_queue_full(monkeypatch):
+    jobs.clear()
+    used_job_ids.clear()
+    monkeypatch.setattr(job_queue, "max_depth", job_queue.qsize())
+    client = TestClient(app)
+    files = {"csv_file": ("full.csv", io.BytesIO(b"Department Name,Date,Number of Sales\n"), "text/csv")}
+    response = client.post("/process?job_id=queue_full", files=files)
+    assert response.status_code == 429
+    assert int(response.headers["retry-after"]) >= 1
+    assert "queue_full" not in jobs
+    assert client.get("/queue_stats").json()["rejected"] >= 1
+    # A refused job ID is not spent and can be submitted again
+    assert "queue_full" not in used_job_ids
@@ -0,0 +1,125 @@
+import asyncio
+import io
+import time
+import pytest
+from fastapi.testclient import TestClient
+from app.api.api import app
+from app.api.job_store import SQLiteJobStore
+from app.api.scheduler import QueueFull
+from app.api.spool import MAX_DELIVERIES, SpoolQueue
+from app.api.state import jobs, JobStatus
+from app.api.worker import worker
+from app.service.result_cache import ResultCache
+
+
+def _spool(tmp_path, **kwargs):
+    return SpoolQueue(str(tmp_path / "spool.sqlite3"), **kwargs)
+
+
+def test_spool_orders_like_scheduler(tmp_path):
+    spool = _spool(tmp_path)
+    spool.put_nowait({"job_id": "big"}, size=20_000)
+    spool.put_nowait({"job_id": "small"}, size=10)
+    spool.put_nowait({"job_id": "urgent-big"}, size=50_000, priority=5)
+    order = [spool.get_nowait()["job_id"] for _ in range(3)]
+    assert order == ["urgent-big", "small", "big"]
+    assert spool.qsize() == 0 and spool.stats()["in_progress"] == 3
+    for job_id in order:
+        spool.task_done({"job_id": job_id})
+    assert spool.stats()["in_progress"] == 0
+    with pytest.raises(asyncio.QueueEmpty):
+        spool.get_nowait()
+
+
+def test_spool_admission_limits(tmp_path):
+    spool = _spool(tmp_path, max_depth=2, max_bytes=100)
+    spool.put_nowait({"job_id": "a"}, size=60)
+    with pytest.raises(QueueFull):
+        spool.put_nowait({"job_id": "b"}, size=60)
+    assert spool.rejected == 1
+
+
+def test_spool_is_shared_and_redelivers_expired_leases(tmp_path):
+    api = _spool(tmp_path)
+    first = _spool(tmp_path, lease_seconds=0.05)
+    second = _spool(tmp_path, lease_seconds=0.05)
+    api.put_nowait({"job_id": "a"})
+    api.put_nowait({"job_id": "b"})
+    assert first.get_nowait()["job_id"] == "a"
+    assert second.get_nowait()["job_id"] == "b"
+    second.task_done({"job_id": "b"})
+    # Claimed outside an event loop, so nothing renews the lease: as if "first" had crashed
+    time.sleep(0.1)
+    job = second.get_nowait()
+    assert job["job_id"] == "a" and job["deliveries"] == 2
+    # The lost lease cannot remove the job another worker now holds
+    first.task_done({"job_id": "a"})
+    assert api.stats()["in_progress"] == 1
+
+
+@pytest.mark.asyncio
+async def test_spool_heartbeat_keeps_lease_and_release_hands_job_over(tmp_path):
+    first = _spool(tmp_path, lease_seconds=0.15)
+    second = _spool(tmp_path, lease_seconds=0.15)
+    first.put_nowait({"job_id": "a"})
+    first.get_nowait()
+    await asyncio.sleep(0.4)
+    with pytest.raises(asyncio.QueueEmpty):
+        second.get_nowait()
+    first.release_all()
+    assert second.get_nowait()["job_id"] == "a"
+    second.release_all()
+
+
+@pytest.mark.asyncio
+async def test_worker_runs_spooled_jobs(tmp_path, monkeypatch):
+    monkeypatch.setattr("app.api.worker.OUTPUT_DIR", str(tmp_path))
+    jobs.clear()
+    spool = _spool(tmp_path, poll_interval=0.01)
+    input_csv = tmp_path / "input.csv"
+    input_csv.write_text("Department Name,Date,Number of Sales\nHR,2024-01-01,2\n")
+    for job_id in ("spooled", "abandoned"):
+        jobs[job_id] = {"status": JobStatus.WAITING, "result": None, "error": None, "processing_time": {"start": None, "end": None}, "preview": {"rows": []}}
+    spool.put_nowait({"job_id": "spooled", "file_path": str(input_csv), "queued_at": time.time()})
+    spool.put_nowait({"job_id": "abandoned", "file_path": str(input_csv)})
+    spool._conn.execute("UPDATE spool SET deliveries = ? WHERE job_id = 'abandoned'", (MAX_DELIVERIES,))
+    task = asyncio.create_task(worker(queue=spool))
+    try:
+        await asyncio.wait_for(spool.join(), 10)
+    finally:
+        task.cancel()
+    assert jobs["spooled"]["status"] == JobStatus.FINISHED
+    # The exact result replaces the estimate
+    assert jobs["spooled"]["preview"] is None
+    assert jobs["abandoned"]["status"] == JobStatus.FAILED
+    assert "abandoned" in jobs["abandoned"]["error"]
+
+
+@pytest.mark.asyncio
+async def test_job_submitted_to_api_is_finished_by_daemon(tmp_path, monkeypatch):
+    # The API and the worker daemon each with their own connections to the shared files
+    api_store = SQLiteJobStore(str(tmp_path / "jobs.sqlite3"))
+    api_spool = _spool(tmp_path)
+    daemon_store = SQLiteJobStore(str(tmp_path / "jobs.sqlite3"))
+    daemon_spool = _spool(tmp_path, poll_interval=0.01)
+    monkeypatch.setattr("app.api.api.FILE_DIR", str(tmp_path / "files"))
+    monkeypatch.setattr("app.api.api.jobs", api_store)
+    monkeypatch.setattr("app.api.api.used_job_ids", api_store.used_ids)
+    monkeypatch.setattr("app.api.api.job_queue", api_spool)
+    monkeypatch.setattr("app.api.worker.jobs", daemon_store)
+    monkeypatch.setattr("app.api.worker.OUTPUT_DIR", str(tmp_path / "output"))
+    monkeypatch.setattr("app.api.worker.result_cache", ResultCache(str(tmp_path / "cache")))
+    client = TestClient(app)
+    files = {"csv_file": ("shared.csv", io.BytesIO(b"Department Name,Date,Number of Sales\nHR,2024-01-01,2\n"), "text/csv")}
+    assert client.post("/process?job_id=shared", files=files).status_code == 200
+    task = asyncio.create_task(worker(queue=daemon_spool))
+    try:
+        await asyncio.wait_for(api_spool.join(), 10)
+    finally:
+        task.cancel()
+    daemon_store.flush()
+    status = client.get("/job_status/shared").json()
+    assert status["status"] == JobStatus.FINISHED
+    assert status["download_url"]
+    for closable in (api_spool, daemon_spool, api_store, daemon_store):
+        closable.close()
@@ -0,0 +1,70 @@
+import bz2
+import gzip
+import hashlib
+import io
+import os
+import pytest
+from fastapi import UploadFile
+from app.api.upload import stream_upload, parse_header, read_file_header, UploadRejected
+from app.service import compression
+
+HEADER = b"Department Name,Date,Number of Sales\n"
+
+
+@pytest.mark.asyncio
+async def test_stream_upload_header_spanning_chunks(tmp_path):
+    body = HEADER + b"HR,2024-01-01,5\n" * 100
+    dest = str(tmp_path / "upload.csv")
+    result = await stream_upload(UploadFile(io.BytesIO(body), filename="upload.csv"), dest, chunk_size=7)
+    assert result.size == len(body)
+    assert result.fingerprint == hashlib.sha256(body).hexdigest()
+    assert result.columns == ["Department Name", "Date", "Number of Sales"]
+    with open(dest, "rb") as f:
+        assert f.read() == body
+    assert not os.path.exists(dest + ".part")
+
+
+@pytest.mark.asyncio
+async def test_stream_upload_rejects_before_writing(tmp_path):
+    dest = str(tmp_path / "upload.csv")
+    with pytest.raises(UploadRejected):
+        await stream_upload(UploadFile(io.BytesIO(b"a,b\n1,2\n"), filename="upload.csv"), dest)
+    assert os.listdir(tmp_path) == []
+
+
+def test_parse_header_handles_bom_and_quotes():
+    assert parse_header(b'\xef\xbb\xbf"Department Name",Date,Number of Sales\r\nHR') == [
+        "Department Name", "Date", "Number of Sales"
+    ]
+
+
+@pytest.mark.asyncio
+@pytest.mark.parametrize("compress,kind", [(gzip.compress, "gzip"), (bz2.compress, "bz2")])
+async def test_stream_upload_stores_compressed(tmp_path, compress, kind):
+    body = compress(HEADER + b"HR,2024-01-01,5\n" * 1000)
+    dest = str(tmp_path / "upload.csv.gz")
+    result = await stream_upload(UploadFile(io.BytesIO(body), filename="upload.csv.gz"), dest, chunk_size=5)
+    assert result.compression == kind
+    assert result.columns == ["Department Name", "Date", "Number of Sales"]
+    assert result.size == len(body)
+    with open(dest, "rb") as f:
+        assert f.read() == body
+    assert read_file_header(dest) == result.columns
+
+
+@pytest.mark.asyncio
+async def test_stream_upload_checks_compressed_header(tmp_path):
+    dest = str(tmp_path / "upload.csv.gz")
+    with pytest.raises(UploadRejected, match="Missing required columns"):
+        await stream_upload(UploadFile(io.BytesIO(gzip.compress(b"a,b\n1,2\n")), filename="x.gz"), dest)
+    with pytest.raises(UploadRejected, match="Invalid gzip"):
+        await stream_upload(UploadFile(io.BytesIO(b"\x1f\x8b" + b"\x00" * 64), filename="x.gz"), dest)
+    assert os.listdir(tmp_path) == []
+
+
+@pytest.mark.asyncio
+async def test_stream_upload_rejects_zstd_without_package(tmp_path, monkeypatch):
+    monkeypatch.setattr(compression, "zstandard", None)
+    dest = str(tmp_path / "upload.csv.zst")
+    with pytest.raises(UploadRejected, match="zstandard"):
+        await stream_upload(UploadFile(io.BytesIO(b"\x28\xb5\x2f\xfd" + b"\x00" * 16), filename="x.zst"), dest)